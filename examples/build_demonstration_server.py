@@ -90,6 +90,7 @@ if __name__ == '__main__':
             # Create new workspace
             geoserver.create_workspace(workspace, verbose=True)
 
+            filenames = []
             for filename in os.listdir(subdir):
 
                 if filename in excluded_files:
@@ -98,17 +99,25 @@ if __name__ == '__main__':
                 basename, extension = os.path.splitext(filename)
                 
                 if extension in ['.asc', '.txt', '.tif', '.shp', '.zip']:                
-                    header('Uploading %s' % filename)
-                    lyr = geoserver.upload_layer(filename='%s/%s' % (subdir, filename),
-                                                 workspace=workspace,
-                                                 verbose=True)                
+                    filenames.append('%s/%s' % (subdir, filename))
+                    
+            # Upload files of workspace concurrently
+            header('Uploading %i files to %s' % (len(filenames), workspace))
+            for result in geoserver.upload_layers(filenames, workspace=workspace, verbose=True):
+                if result['error']:
+                    msg = 'Could not upload %s: %s' % (result['filename'], result['error'])
+                    raise Exception(msg)
+                    
+                print 'Uploaded %s in %.1f seconds' % (result['filename'], result['seconds'])
                 
+                lyr = result['layer']
+                extension = os.path.splitext(result['filename'])[1]
 
-                    if extension in ['.asc', '.txt', '.tif']:
-                        raster_layers.append(lyr)
+                if extension in ['.asc', '.txt', '.tif']:
+                    raster_layers.append(lyr)
 
-                    if extension in ['.shp']:        
-                        vector_layers.append(lyr)                                                
+                if extension in ['.shp']:        
+                    vector_layers.append(lyr)                                                
 
     # Ensure that rasters come first and observe specified order                
     layers = []                    
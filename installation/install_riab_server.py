@@ -2,7 +2,10 @@
 
 Usage:
 
-sudo python install_geoserver.py
+sudo python install_riab_server.py [--with-async]
+
+--with-async also installs trollius for the optional event loop client
+geoserver_api/async_geoserver.py.
 """
 
 import sys, os, commands
@@ -37,10 +40,18 @@ def install_ubuntu_packages():
             raise Exception(msg)
             
 
-def install_python_packages():
+def install_python_packages(with_async=False):
     """Python packages that are not part of Ubuntu
+    
+    trollius is only installed if with_async is True.
     """
     os.system('easy_install argparse')
+    
+    # Event loop for geoserver_api.async_geoserver (optional).
+    # NOTE: trollius is deprecated and no longer maintained. Nothing else depends
+    # on it and its tests are skipped without it.
+    if with_async:
+        os.system('easy_install trollius')
 
     
 def get_plugins():
@@ -72,7 +83,7 @@ if __name__ == '__main__':
     print ' - Installing Riab_server dependencies'
                 
     install_ubuntu_packages()
-    install_python_packages()
+    install_python_packages(with_async='--with-async' in sys.argv[1:])
     get_plugins()
     change_permissions()
     set_environment()    
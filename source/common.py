@@ -22,6 +22,29 @@ port=8000
 server_url=localhost
 [Plugins]
 basepath="."
+[Engine]
+tile_memory=33554432
+workers=1
+fetch_threads=4
+lookup_table_resolution=0
+lookup_table_interpolate=true
+target_grid=exposure
+hazard_resampling=bilinear
+exposure_resampling=sum
+impact_cache_size=64
+max_running_jobs=2
+max_queued_jobs=16
+geoserver_ttl=300
+catalog_ttl=60
+wcs_metadata_ttl=600
+wcs_metadata_dir=
+coverage_cache_size=536870912
+download_chunk_cells=0
+download_threads=4
+upload_data_type=
+upload_compression=DEFLATE
+upload_tile_size=256
+upload_overviews=true
 """
 
 config = ConfigParser.ConfigParser()
@@ -30,5 +53,25 @@ config.read('riab_server.cfg')
 
 port=config.getint('Server', 'port')
 server_url=config.get('Server', 'server_url')
-
-
+tile_memory=config.getint('Engine', 'tile_memory')
+workers=config.getint('Engine', 'workers')
+fetch_threads=config.getint('Engine', 'fetch_threads')
+lookup_table_resolution=config.getfloat('Engine', 'lookup_table_resolution')
+lookup_table_interpolate=config.getboolean('Engine', 'lookup_table_interpolate')
+target_grid=config.get('Engine', 'target_grid')
+hazard_resampling=config.get('Engine', 'hazard_resampling')
+exposure_resampling=config.get('Engine', 'exposure_resampling')
+impact_cache_size=config.getint('Engine', 'impact_cache_size')
+max_running_jobs=config.getint('Engine', 'max_running_jobs')
+max_queued_jobs=config.getint('Engine', 'max_queued_jobs')
+geoserver_ttl=config.getfloat('Engine', 'geoserver_ttl')
+catalog_ttl=config.getfloat('Engine', 'catalog_ttl')
+wcs_metadata_ttl=config.getfloat('Engine', 'wcs_metadata_ttl')
+wcs_metadata_dir=config.get('Engine', 'wcs_metadata_dir')
+coverage_cache_size=config.getint('Engine', 'coverage_cache_size')
+download_chunk_cells=config.getint('Engine', 'download_chunk_cells')
+download_threads=config.getint('Engine', 'download_threads')
+upload_data_type=config.get('Engine', 'upload_data_type')
+upload_compression=config.get('Engine', 'upload_compression')
+upload_tile_size=config.getint('Engine', 'upload_tile_size')
+upload_overviews=config.getboolean('Engine', 'upload_overviews')
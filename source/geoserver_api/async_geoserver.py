@@ -0,0 +1,732 @@
+"""Asynchronous Python interface to the Geoserver REST API
+
+AsyncGeoserver mirrors the methods of Geoserver as coroutines for use on
+an event loop. Requests are made by AsyncRestClient over keep-alive
+connections held in a pool shared by all users of the same geoserver, so
+hundreds of concurrent layer operations run on one loop without a thread
+or process per request. Local work such as encoding rasters, zipping
+shapefiles and writing styles runs in the default executor of the loop.
+
+Cancelling a coroutine cancels the request it is waiting for and closes
+the connection it used, so the pool never holds half read responses.
+
+Coroutines are written for trollius, the asyncio package for Python 2:
+
+    loop = asyncio.get_event_loop()
+    gs = loop.run_until_complete(get_async_geoserver(url, username, password))
+    results = loop.run_until_complete(gs.upload_layers(filenames, 'hazard'))
+"""
+
+import time
+import json
+import trollius as asyncio
+from trollius import From, Return
+
+from rest_client import RestClient, HTTPError, TIMEOUT, check_status, can_retry, encode_body, \
+    get_address, get_request_path, format_request_head, parse_status_line, parse_header, \
+    get_will_close, get_body_length, parse_chunk_size
+from catalog import get_catalog
+import geoserver
+import encoding
+import raster
+
+
+# Default maximal number of requests in flight per geoserver
+MAX_CONNECTIONS = 32
+
+# Size of blocks in which files are sent (bytes)
+CHUNK_SIZE = 65536
+
+
+class AsyncRestClient(RestClient):
+    """Client for the REST API of one Geoserver on an event loop
+
+    Requests are coroutines. At most max_connections requests are in flight
+    at the same time and idle keep-alive connections are reused by later
+    requests. Other URLs on the same servers (e.g. WCS) can be fetched
+    through the same pool.
+
+    Requests are formatted and responses interpreted by the functions of
+    rest_client.py. This class only moves the bytes over asyncio streams.
+    Connections are (reader, writer) pairs held in the pool of RestClient.
+    """
+
+    def __init__(self, geoserver_url, username, password,
+                 max_connections=MAX_CONNECTIONS, timeout=TIMEOUT, loop=None):
+
+        RestClient.__init__(self, geoserver_url, username, password,
+                            max_idle_connections=max_connections, timeout=timeout)
+
+        self.loop = loop or asyncio.get_event_loop()
+        self.semaphore = asyncio.Semaphore(max_connections, loop=self.loop)
+
+
+    @asyncio.coroutine
+    def request(self, method, rest_dir, body=None, content_type=None, headers=None):
+        """Make request to REST resource and return status and body of the response
+
+        Arguments are those of RestClient.request. Raises HTTPError if the
+        server responds with an error status (400 and above).
+        """
+
+        url = self.get_url(rest_dir)
+        status, reason, data = yield From(self.fetch(method, url, body,
+                                                     self.get_headers(content_type, headers)))
+        check_status(method, url, status, reason, data)
+
+        raise Return((status, data))
+
+
+    @asyncio.coroutine
+    def fetch(self, method, url, body=None, headers=None):
+        """Make request to any URL through the connection pool
+
+        Returns
+            status, reason, body of the response. Error statuses are not raised.
+        """
+
+        address = get_address(url)
+        path = get_request_path(url)
+        body = encode_body(body)
+
+        yield From(self.semaphore.acquire())
+        try:
+            exchange = self._exchange(method, address, path, body, headers or {})
+            result = yield From(asyncio.wait_for(exchange, self.timeout, loop=self.loop))
+        finally:
+            self.semaphore.release()
+
+        raise Return(result)
+
+
+    @asyncio.coroutine
+    def _exchange(self, method, address, path, body, headers):
+        connection, reused = yield From(self._get_connection(address))
+        try:
+            try:
+                response = yield From(self._send(connection, method, address, path, body, headers))
+            except (EOFError, EnvironmentError):
+                if not can_retry(method, reused):
+                    raise
+
+                # Server closed the idle connection. Retry once on a new one.
+                self._close_connection(connection)
+                connection, reused = yield From(self._get_connection(address, reuse=False))
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+                response = yield From(self._send(connection, method, address, path, body, headers))
+        except (EOFError, EnvironmentError):
+            self._close_connection(connection)
+            self.healthy = False
+            raise
+        except:
+            # Also on cancellation as the response may be partly read
+            self._close_connection(connection)
+            raise
+
+        self.healthy = True
+
+        status, reason, data, will_close = response
+        if will_close:
+            self._close_connection(connection)
+        else:
+            self._release_connection(connection, address)
+
+        raise Return((status, reason, data))
+
+
+    def _close_connection(self, connection):
+        connection[1].close()
+
+
+    @asyncio.coroutine
+    def _get_connection(self, address, reuse=True):
+        """Get idle connection to address from the pool or a new one
+
+        Returns
+            (reader, writer), True if it was reused
+        """
+
+        if reuse:
+            connection = self._take_idle_connection(address)
+            if connection is not None:
+                raise Return((connection, True))
+
+        scheme, host, port = address
+        reader, writer = yield From(asyncio.open_connection(host, port,
+                                                            ssl=(scheme == 'https'),
+                                                            loop=self.loop))
+        raise Return(((reader, writer), False))
+
+
+    @asyncio.coroutine
+    def _send(self, connection, method, address, path, body, headers):
+        """Send request and read response
+
+        Returns
+            status, reason, body, True if the server closes the connection
+        """
+
+        reader, writer = connection
+
+        writer.write(format_request_head(method, path, address, body, headers))
+        if hasattr(body, 'read'):
+            # Files are streamed so that they are never held in memory as a whole
+            while True:
+                chunk = body.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                yield From(writer.drain())
+        elif body:
+            writer.write(body)
+        yield From(writer.drain())
+
+        line = yield From(reader.readline())
+        version, status, reason = parse_status_line(line)
+
+        response_headers = {}
+        while True:
+            line = yield From(reader.readline())
+            if not parse_header(line, response_headers):
+                break
+        will_close = get_will_close(version, response_headers)
+
+        length = get_body_length(method, status, response_headers)
+        if length == 'chunked':
+            chunks = []
+            while True:
+                line = yield From(reader.readline())
+                size = parse_chunk_size(line)
+                if size == 0:
+                    # Skip trailers
+                    while True:
+                        line = yield From(reader.readline())
+                        if not parse_header(line, {}):
+                            break
+                    break
+                chunk = yield From(reader.readexactly(size))
+                chunks.append(chunk)
+                yield From(reader.readexactly(2))
+            data = ''.join(chunks)
+        elif length is None:
+            # Body ends when the server closes the connection
+            data = yield From(reader.read())
+            will_close = True
+        else:
+            data = yield From(reader.readexactly(length))
+
+        raise Return((status, reason, data, will_close))
+
+
+_clients = {}
+
+def get_async_client(geoserver_url, username, password, loop=None):
+    """Get client for Geoserver shared by all coroutines on loop, creating it on first request
+    """
+
+    loop = loop or asyncio.get_event_loop()
+    key = (geoserver_url.rstrip('/'), username, password, loop)
+
+    if key not in _clients:
+        _clients[key] = AsyncRestClient(geoserver_url, username, password, loop=loop)
+    return _clients[key]
+
+
+class AsyncGeoserver:
+    """Connection to one instance of a geoserver for use on an event loop
+
+    Methods are coroutines mirroring those of Geoserver. The connection is
+    verified by get_async_geoserver.
+    """
+
+    def __init__(self, geoserver_url, geoserver_username, geoserver_userpass, loop=None):
+
+        # Record login information
+        self.geoserver_url = geoserver_url
+        self.geoserver_username = geoserver_username
+        self.geoserver_userpass = geoserver_userpass
+
+        self.loop = loop or asyncio.get_event_loop()
+
+        # Connections are pooled and shared by all instances for the same geoserver and loop
+        self.client = get_async_client(geoserver_url, geoserver_username, geoserver_userpass,
+                                       loop=self.loop)
+
+        # The catalog cache is shared with Geoserver
+        self.catalog = get_catalog(geoserver_url)
+
+
+    def run_in_executor(self, function, *args):
+        """Run blocking function in the default executor of the loop
+
+        Returns
+            future with the result
+        """
+
+        return self.loop.run_in_executor(None, function, *args)
+
+
+    @asyncio.coroutine
+    def verify(self):
+        """Verify that Geoserver is running and record the time of verification
+        """
+
+        status, page = yield From(self.client.request('GET', ''))
+
+        msg = 'Could not connect to geoserver at %s' % self.geoserver_url
+        assert page.find('workspaces') > 0, msg
+
+        self.verified = time.time()
+
+
+    # Methods for manipulating the geoserver (e.g. add and delete workspaces)
+    @asyncio.coroutine
+    def create_workspace(self, name, verbose=False):
+        """Create new workspace on the geoserver
+        """
+
+        try:
+            yield From(self.client.request('POST', 'workspaces', geoserver.get_workspace_xml(name), 'text/xml'))
+        except HTTPError, e:
+            # Workspace may already exist, no worries
+            geoserver.check_existing(e, 'workspace', name)
+
+        self.catalog.set('workspace', name)
+
+
+    @asyncio.coroutine
+    def get_workspace(self, name, verbose=False, use_cache=True):
+        """Check that workspace exists on the geoserver
+
+        Workspaces found recently are taken to exist unless use_cache is False
+        """
+
+        if use_cache and self.catalog.get('workspace', name):
+            return
+
+        try:
+            yield From(self.client.request('GET', 'workspaces/%s' % name))
+        except HTTPError, e:
+            if e.status != 404:
+                raise
+            msg = 'Could not find workspace %s in geoserver %s' % (name, self.geoserver_url)
+            raise Exception(msg)
+
+        self.catalog.set('workspace', name)
+
+
+    # Methods for up and downloading layers
+    @asyncio.coroutine
+    def get_coverage(self, coverage_name, workspace):
+        """Get Coverage object for downloading named raster layer through WCS
+        """
+
+        # Metadata may have to be fetched by the blocking WCS metadata cache
+        c = yield From(self.run_in_executor(geoserver.get_wcs_coverage, self.geoserver_url,
+                                            coverage_name, workspace))
+        raise Return(c)
+
+
+    @asyncio.coroutine
+    def read_coverage(self, coverage_name, workspace, bounding_box=None, format='GeoTIFF'):
+        """Get named raster layer as string in given format
+
+        Coverages are cached, cut out of overlapping cached coverages and
+        split into chunks as by Geoserver.read_coverage. Chunks are
+        downloaded concurrently on the loop.
+        """
+
+        c = yield From(self.get_coverage(coverage_name, workspace))
+
+        plan = geoserver.get_read_plan(c, bounding_box, format, geoserver.Geoserver.DOWNLOAD_CHUNK_CELLS)
+        if plan['data'] is not None:
+            raise Return(plan['data'])
+
+        downloads = yield From(asyncio.gather(*[self._read_part(c, format, part) for part in plan['parts']],
+                                              loop=self.loop))
+        data = yield From(self.run_in_executor(geoserver.assemble_coverage, plan, downloads))
+        raise Return(data)
+
+
+    @asyncio.coroutine
+    def _read_part(self, c, format, bounding_box):
+        """Download bounding box of coverage c
+        """
+
+        c.check_format(format)
+
+        url = c.get_url(format, bounding_box)
+        status, reason, data = yield From(self.client.fetch('GET', url))
+        check_status('GET', url, status, reason, data)
+        c.check_response(data)
+
+        raise Return(data)
+
+
+    @asyncio.coroutine
+    def download_coverage(self,
+                          coverage_name,
+                          bounding_box=None,
+                          output_filename=None,
+                          workspace=None,
+                          format='GeoTIFF',
+                          verbose=False):
+        """Retrieve named raster layer as ASCII file and return its name
+        """
+
+        if workspace is None:
+            raise Exception('Default workspace not yet implemented')
+
+        if output_filename is None:
+            output_filename = coverage_name + '.tif'
+
+        data = yield From(self.read_coverage(coverage_name, workspace, bounding_box, format=format))
+
+        def save():
+            fid = open(output_filename, 'wb')
+            try:
+                fid.write(data)
+            finally:
+                fid.close()
+            return geoserver.convert_to_ascii(output_filename, verbose=verbose)
+
+        ascii_filename = yield From(self.run_in_executor(save))
+        raise Return(ascii_filename)
+
+
+    @asyncio.coroutine
+    def get_raster_data(self,
+                        coverage_name,
+                        bounding_box=None,
+                        workspace=None,
+                        verbose=False):
+        """Retrieve named coverage layer as Raster object held in memory
+        """
+
+        if workspace is None:
+            raise Exception('Default workspace not yet implemented')
+
+        data = yield From(self.read_coverage(coverage_name, workspace, bounding_box))
+        raise Return(raster.MemoryRaster(data, coverage_name))
+
+
+    @asyncio.coroutine
+    def upload_layer(self, filename, workspace, verbose=False):
+        """Upload coverage (raster) or vector data to geoserver
+
+        See Geoserver.upload_layer.
+        """
+
+        if geoserver.get_layer_type(filename) == 'coverage':
+            layer = yield From(self.upload_coverage(filename, workspace, verbose))
+        else:
+            layer = yield From(self.upload_vector_layer(filename, workspace, verbose))
+
+        raise Return(layer)
+
+
+    @asyncio.coroutine
+    def upload_layers(self, filenames, workspace, verbose=False):
+        """Upload several coverages or vector files to the same workspace concurrently
+
+        Returns
+            list with a hash for each file as returned by Geoserver.upload_layers
+        """
+
+        @asyncio.coroutine
+        def upload(filename):
+            t0 = time.time()
+            result = {'filename': filename, 'layer': None, 'error': None}
+            try:
+                result['layer'] = yield From(self.upload_layer(filename, workspace, verbose=verbose))
+            except asyncio.CancelledError:
+                raise
+            except Exception, e:
+                result['error'] = geoserver.get_error_message(e)
+            result['seconds'] = time.time() - t0
+
+            raise Return(result)
+
+        results = yield From(asyncio.gather(*[upload(filename) for filename in filenames],
+                                            loop=self.loop))
+        raise Return(results)
+
+
+    @asyncio.coroutine
+    def upload_coverage(self, filename, workspace, verbose=False, data_type=None):
+        """Upload raster file to named layer
+
+        See Geoserver.upload_coverage.
+        """
+
+        layername = geoserver.get_layer_name(filename)
+
+        data = yield From(self.run_in_executor(geoserver.encode_coverage, filename, data_type))
+        yield From(self.upload_geotiff(data, layername, workspace))
+
+        # Take care of styling
+        style_filename = yield From(self.run_in_executor(geoserver.prepare_style, filename))
+        if style_filename is not None:
+            yield From(self.apply_style(layername, style_filename, verbose=verbose))
+
+        raise Return('%s:%s' % (workspace, layername))
+
+
+    @asyncio.coroutine
+    def upload_geotiff(self, data, layername, workspace):
+        """Upload GeoTIFF held in memory to named layer
+        """
+
+        yield From(self.client.request('PUT',
+                                       'workspaces/%s/coveragestores/%s/file.geotiff' % (workspace, layername),
+                                       data,
+                                       'image/tif'))
+
+        # Bounding box and resolution may have changed
+        geoserver.invalidate_layer(self.geoserver_url, workspace, layername)
+
+
+    @asyncio.coroutine
+    def upload_vector_layer(self, filename, workspace, verbose=False):
+        """Upload zipped shapefile or shapefile (*.shp) to named layer
+
+        See Geoserver.upload_vector_layer.
+        """
+
+        layername = geoserver.get_layer_name(filename)
+        fid = yield From(self.run_in_executor(geoserver.open_vector_data, filename))
+
+        rest_dir = 'workspaces/%s/datastores/%s/file.shp' % (workspace, layername)
+        try:
+            yield From(self.client.request('PUT', rest_dir, fid, 'application/zip'))
+        finally:
+            fid.close()
+
+        # Take care of styling
+        style_filename = yield From(self.run_in_executor(geoserver.prepare_style, filename))
+        if style_filename is not None:
+            yield From(self.apply_style(layername, style_filename, verbose=verbose))
+
+        raise Return('%s:%s' % (workspace, layername))
+
+
+    @asyncio.coroutine
+    def store_raster_data(self, A, geotransform, projection, layername, workspace,
+                          nodata_value=-9999, verbose=False, data_type=None):
+        """Publish numeric array as raster layer
+
+        See Geoserver.store_raster_data.
+        """
+
+        data = yield From(self.run_in_executor(encoding.encode_array,
+                                               A, geotransform, projection, nodata_value,
+                                               data_type))
+        yield From(self.upload_geotiff(data, layername, workspace))
+
+        # Style from the encoded raster
+        style_filename = yield From(self.run_in_executor(geoserver.write_memory_raster_sld, data, layername))
+        yield From(self.apply_style(layername, style_filename, verbose=verbose))
+
+        raise Return('%s:%s' % (workspace, layername))
+
+
+    # Methods for styles
+    @asyncio.coroutine
+    def find_style(self, name):
+        """Get description of style or None if it does not exist
+        """
+
+        d = self.catalog.get('style', name)
+        if isinstance(d, dict):
+            raise Return(d)
+
+        try:
+            status, body = yield From(self.client.request('GET', 'styles/%s' % name,
+                                                          headers={'Accept': 'text/json'}))
+        except HTTPError, e:
+            if e.status == 404:
+                raise Return(None)
+            raise
+
+        d = json.loads(body)
+        self.catalog.set('style', name, d)
+        raise Return(d)
+
+
+    @asyncio.coroutine
+    def upload_style(self, style_name, style_file, verbose=False):
+        """Upload style file to geoserver
+        """
+
+        # This step is skipped if the style is known to exist.
+        if not self.catalog.get('style', style_name):
+            try:
+                yield From(self.client.request('POST', 'styles', geoserver.get_style_xml(style_name, style_file),
+                                               'text/xml'))
+            except HTTPError, e:
+                # Style may already exist, no worries
+                geoserver.check_existing(e, 'style', style_name)
+
+        fid = open(style_file, 'rb')
+        try:
+            yield From(self.client.request('PUT', 'styles/%s' % style_name, fid,
+                                           'application/vnd.ogc.sld+xml'))
+        finally:
+            fid.close()
+
+        # The style now exists but a description fetched by find_style
+        # before the PUT is stale
+        self.catalog.set('style', style_name)
+
+
+    @asyncio.coroutine
+    def apply_style(self, layer_name, style_file, verbose=False):
+        """Upload style file as style named after layer and make it the default of the layer
+        """
+
+        yield From(self.upload_style(layer_name, style_file, verbose=verbose))
+        yield From(self.set_default_style(layer_name, layer_name, verbose=verbose))
+
+
+    @asyncio.coroutine
+    def set_default_style(self, style_name, layer_name, verbose=False):
+        """Set given style as default for specified layer
+        """
+
+        yield From(self.client.request('PUT', 'layers/%s' % layer_name,
+                                       geoserver.get_default_style_xml(style_name), 'text/xml'))
+
+
+    @asyncio.coroutine
+    def delete_style(self, style_name, verbose=False):
+        """Delete style and its file on the geoserver
+        """
+
+        self.catalog.invalidate('style', style_name)
+        yield From(self.client.request('DELETE', 'styles/%s?purge=true' % style_name))
+
+
+    # Methods for deleting layers
+    @asyncio.coroutine
+    def delete_layer(self, layer_name, workspace, verbose=False):
+        """Delete layer on server together with its coverage or data store
+        """
+
+        if not layer_name:
+            msg = 'Valid layer name was not provided for deletion. I got "%s"' % str(layer_name)
+            raise Exception(msg)
+
+        # Vector layers are held in data stores
+        try:
+            yield From(self._delete_store(workspace, 'coveragestores', layer_name))
+        except HTTPError, e:
+            if e.status != 404:
+                raise
+            yield From(self._delete_store(workspace, 'datastores', layer_name))
+
+
+    @asyncio.coroutine
+    def get_names(self, rest_dir, kind):
+        """Get names of resources listed by REST resource
+
+        See Geoserver.get_names.
+        """
+
+        status, body = yield From(self.client.request('GET', rest_dir, headers={'Accept': 'text/json'}))
+        raise Return(geoserver.parse_names(body, kind))
+
+
+    @asyncio.coroutine
+    def delete_all_layers(self, workspace=None, verbose=False):
+        """Delete all layers on server
+
+        Stores are listed and deleted concurrently with recurse=true and
+        orphaned styles are removed afterwards.
+
+        Returns
+            list with a hash for each store as returned by Geoserver.delete_all_layers
+        """
+
+        if workspace is None:
+            workspaces = yield From(self.get_names('workspaces', 'workspace'))
+        else:
+            workspaces = [workspace]
+
+        listings = [(name, store_type, kind) for name in workspaces for store_type, kind in geoserver.STORE_TYPES]
+        names = yield From(asyncio.gather(*[self.get_names('workspaces/%s/%s' % (name, store_type), kind)
+                                            for name, store_type, kind in listings],
+                                          loop=self.loop))
+
+        stores = []
+        for (name, store_type, _), store_names in zip(listings, names):
+            for store in store_names:
+                stores.append((name, store_type, store))
+
+        if not stores:
+            raise Return([])
+
+        remaining = {}
+        if workspace is not None:
+            layers = yield From(self.get_names('layers', 'layer'))
+            remaining = geoserver.get_remaining_layers(layers, stores)
+
+        styles = yield From(self.get_names('styles', 'style'))
+
+        @asyncio.coroutine
+        def delete_store(name, store_type, store):
+            t0 = time.time()
+            result = {'layer': '%s:%s' % (name, store), 'style': None, 'error': None, 'style_error': None}
+            try:
+                yield From(self._delete_store(name, store_type, store))
+            except asyncio.CancelledError:
+                raise
+            except Exception, e:
+                result['error'] = geoserver.get_error_message(e)
+            result['seconds'] = time.time() - t0
+
+            raise Return(result)
+
+        @asyncio.coroutine
+        def delete_style(result):
+            t0 = time.time()
+            style = result['layer'].split(':')[1]
+            try:
+                yield From(self.delete_style(style, verbose=verbose))
+                result['style'] = style
+            except asyncio.CancelledError:
+                raise
+            except Exception, e:
+                result['style_error'] = geoserver.get_error_message(e)
+            result['seconds'] += time.time() - t0
+
+        results = yield From(asyncio.gather(*[delete_store(*store) for store in stores],
+                                            loop=self.loop))
+
+        # Styles can only be removed once no layer uses them
+        yield From(asyncio.gather(*[delete_style(result)
+                                    for result in geoserver.get_orphaned_styles(results, styles, remaining)],
+                                  loop=self.loop))
+
+        raise Return(results)
+
+
+    @asyncio.coroutine
+    def _delete_store(self, workspace, store_type, store):
+        """Delete store with its coverages or feature types and layers
+        """
+
+        geoserver.invalidate_layer(self.geoserver_url, workspace, store)
+
+        yield From(self.client.request('DELETE', 'workspaces/%s/%s/%s?recurse=true' % (workspace, store_type, store)))
+
+
+@asyncio.coroutine
+def get_async_geoserver(geoserver_url, geoserver_username, geoserver_userpass, loop=None):
+    """Get verified connection to geoserver for use on loop
+    """
+
+    gs = AsyncGeoserver(geoserver_url, geoserver_username, geoserver_userpass, loop=loop)
+    yield From(gs.verify())
+
+    raise Return(gs)
@@ -0,0 +1,103 @@
+"""In-process cache of Geoserver catalog lookups
+
+Checks such as whether a workspace or style exists are made before most
+operations although their answers rarely change. Positive answers are
+cached per geoserver for a limited time (TTL). Entries are invalidated
+when the resource is created or deleted through this API.
+
+Resources are identified by kind ('workspace' or 'style') and name.
+"""
+
+import time
+import threading
+
+
+# Default number of seconds for which catalog entries are trusted
+CATALOG_TTL = 60
+
+
+class CatalogCache:
+    """Catalog entries of one geoserver with expiry time
+
+    It is safe to use from several threads.
+    """
+
+    def __init__(self, ttl=CATALOG_TTL):
+
+        self.ttl = ttl
+        self.entries = {}    # (kind, name) -> (time stored, value)
+        self.lock = threading.Lock()
+
+
+    def get(self, kind, name):
+        """Get cached value of resource or None if not cached or expired
+        """
+
+        key = (kind, name)
+
+        self.lock.acquire()
+        try:
+            if key not in self.entries:
+                return None
+
+            stored, value = self.entries[key]
+            if time.time() - stored > self.ttl:
+                del self.entries[key]
+                return None
+
+            return value
+        finally:
+            self.lock.release()
+
+
+    def set(self, kind, name, value=True):
+        """Record that resource exists, optionally with its description
+        """
+
+        self.lock.acquire()
+        try:
+            self.entries[(kind, name)] = (time.time(), value)
+        finally:
+            self.lock.release()
+
+
+    def invalidate(self, kind, name=None):
+        """Forget resource or, if name is None, all resources of given kind
+        """
+
+        self.lock.acquire()
+        try:
+            for key in self.entries.keys():
+                if key[0] == kind and (name is None or key[1] == name):
+                    del self.entries[key]
+        finally:
+            self.lock.release()
+
+
+    def clear(self):
+        """Forget all resources
+        """
+
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+        finally:
+            self.lock.release()
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def get_catalog(geoserver_url):
+    """Get catalog cache shared by all connections to geoserver
+    """
+
+    key = geoserver_url.rstrip('/')
+
+    _catalogs_lock.acquire()
+    try:
+        if key not in _catalogs:
+            _catalogs[key] = CatalogCache()
+        return _catalogs[key]
+    finally:
+        _catalogs_lock.release()
@@ -1,10 +1,11 @@
 """Low level interface to download of coverage (raster) from Geoserver
 """
 
-import pycurl
 import numpy
 from osgeo import osr, gdal
 import sys
+import urllib2
+import wcs_metadata
 
 class Coverage:
   
@@ -23,37 +24,19 @@ class Coverage:
     self.workspace = None
     
     # ------------------------------------------------------------------------------------------------------------
-    # Grab as much metadata as possible from DescribeCoverage and setup the coverage object with sensible defaults
+    # Grab as much metadata as possible from the WCS server and setup the coverage object with sensible defaults.
+    # Metadata is cached in memory and on disk (see wcs_metadata.py)
     # ------------------------------------------------------------------------------------------------------------
-    from owslib.wcs import WebCoverageService
-
-    wcs = WebCoverageService(base_url, version='1.0.0') # Raises a deprecation waring
+    metadata = wcs_metadata.cache.get(base_url, layername)
     if len(self.layername.split(':')) == 2:
       self.workspace, self.layername = layername.split(':')
-    # try:
-    #     print wcs.contents[layername]
-    # except:
-    #     print wcs.contents[self.layername]
-    # FIXME: Temporary construction until OWS Lib is OK 
-    try:
-      metadata = wcs.contents[self.layername]
-    except:  
-      metadata = wcs.contents[layername]    
 
-    #print metadata.supportedCRS
-    #print metadata.supportedFormats
-    
-    self.bbox     = metadata.boundingBoxWGS84 # FIXME (Ole): Is this a default bbox and if so can it be used as such?
-    try:
-        self.crs  = metadata.supportedCRS[0]    # FIXME (Ole): supportedCRS may be an empty list 
-    except(IndexError):                         # FIXME (shoaib): not sure why this would be empty,
-        self.crs  = "EPSG:4326"                 # all data we are dealing with should have a CRS
-        
-    self.format   = metadata.supportedFormats[0]
-    self.formats  = metadata.supportedFormats
-    self.resx     = metadata.grid.offsetvectors[0][0]
-    #FIXME (shoaib) not sure why it was working earlier without the abs
-    self.resy     = abs(float(metadata.grid.offsetvectors[1][1])) # -ve since the grid origin is top-left 
+    self.bbox     = metadata['bbox'] # FIXME (Ole): Is this a default bbox and if so can it be used as such?
+    self.crs      = metadata['crs']
+    self.format   = metadata['formats'][0]
+    self.formats  = metadata['formats']
+    self.resx     = metadata['resx']
+    self.resy     = metadata['resy'] # Positive although the grid origin is top-left
     self.coverage = self.layername
     
     # some WCS version 1.1.1 - params for later 
@@ -62,39 +45,67 @@ class Coverage:
     self.store = 'false'
 
   
-  def get_url(self):
-    self.__url= self.base_url+'?version='+self.version \
+  def get_url(self, format=None, bounding_box=None):
+    """Get GetCoverage URL for format and bounding_box, by default those last set on this object"""
+
+    if format is None:
+      format = self.format
+    if bounding_box is None:
+      bounding_box = self.bbox
+
+    # The URL is built locally as several threads may read from this object
+    url = self.base_url+'?version='+self.version \
     +'&service='+self.service \
     +'&request='+self.request \
     +'&identifier='+self.identifier \
-    +'&format='+self.format \
-    +'&BoundingBox=%f,%f,%f,%f,%s' % (self.bbox[1], self.bbox[0], self.bbox[3], self.bbox[2], self.crs_urn) \
+    +'&format='+format \
+    +'&BoundingBox=%.12f,%.12f,%.12f,%.12f,%s' % (bounding_box[1], bounding_box[0], bounding_box[3], bounding_box[2], self.crs_urn) \
     +'&store='+self.store \
     +'&coverage='+self.coverage \
     +'&crs='+self.crs \
-    +'&bbox=%f,%f,%f,%f' % tuple(self.bbox) \
+    +'&bbox=%.12f,%.12f,%.12f,%.12f' % tuple(bounding_box) \
     +'&resx='+str(self.resx) \
     +'&resy='+str(self.resy)
             
-    return self.__url
-    
-  def download(self, format='GeoTiff', bounding_box=[-1.0,96.0,4.0,100.0], outputfile='test.tif'):
-    """given an outputformat and a bounding_box in WGS84 [minx,miny,maxx,maxy] returns the layer"""
+    return url
     
-    # Check if format is supported
+  def read(self, format='GeoTIFF', bounding_box=None, chunk_size=1048576):
+    """given an outputformat and a bounding_box in WGS84 [minx,miny,maxx,maxy] returns the layer as a string
+
+    The response is read in chunks of chunk_size bytes and kept in memory. If bounding_box
+    is None the bounding box of the layer is used. The object is not modified so several
+    threads may read from it concurrently.
+    """
+
+    self.check_format(format)
+
+    response = urllib2.urlopen(self.get_url(format, bounding_box))
+    try:
+      chunks = []
+      while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+          break
+        chunks.append(chunk)
+      content_type = response.info().getheader('Content-Type', '')
+    finally:
+      response.close()
+
+    data = ''.join(chunks)
+    self.check_response(data, content_type)
+
+    return data
+
+  def check_format(self, format):
+    """Check that format is supported by the server"""
+
     msg = 'Requested format %s is not supported. Supported formats are %s' % (format, self.formats)
     assert format.lower() in [fmt.lower() for fmt in self.formats], msg
-    
-    self.format = format
-    self.bbox=bounding_box
 
-          
-    c = pycurl.Curl()
-    f = open(outputfile, 'w+')
-    c.setopt(pycurl.URL, self.get_url())
-    c.setopt(pycurl.WRITEFUNCTION, f.write)
-    
-    #print pycurl.URL, self.get_url()
-    #print pycurl.WRITEFUNCTION
-    
-    c.perform()
+  def check_response(self, data, content_type=''):
+    """Raise exception if GetCoverage response is an error report"""
+
+    # Geoserver reports errors as XML documents with status 200
+    if content_type.find('xml') >= 0 or data.startswith('<?xml') or data.startswith('<ServiceExceptionReport'):
+      msg = 'Could not get coverage %s from %s: %s' % (self.coverage, self.base_url, data[:1000])
+      raise Exception(msg)
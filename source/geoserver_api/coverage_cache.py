@@ -0,0 +1,255 @@
+"""Local cache of coverages downloaded through WCS
+
+The same population and hazard coverages are downloaded again and again
+for different analyses. Responses are therefore kept on local disk as the
+file returned by the server, keyed by server, workspace, layer, layer
+revision, bounding box, resolution and format.
+
+A request that is not cached as such may still be cut out of cached
+coverages of the same layer revision, resolution and format whose extents
+overlap it (see mosaic.py).
+
+Entries are evicted in least recently used order once their total size
+exceeds the byte budget. Uploading a layer through this library bumps its
+revision, so stale entries are never returned. The directory holding the
+files is removed when the process exits.
+"""
+
+import os
+import atexit
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from wcs_metadata import get_key as get_layer_key
+
+
+# Default maximal total size of cached coverages (bytes)
+MAX_CACHED_BYTES = 512*1024*1024
+
+
+class CoverageCache:
+    """Downloaded coverages held in files below a private directory
+
+    It is safe to use from several threads.
+    """
+
+    def __init__(self, max_bytes=MAX_CACHED_BYTES):
+
+        self.max_bytes = max_bytes
+        self.directory = None    # Created on first use
+
+        self.entries = {}        # key -> (filename, size)
+        self.keys = []           # Keys in order of use, most recent last
+        self.revisions = {}      # (wcs_url, layer_name) -> revision
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.partial_hits = 0    # Misses served at least in part by other entries
+        self.lock = threading.Lock()
+
+
+    def get_key(self, wcs_url, layer_name, bounding_box, resolution, format='GeoTIFF'):
+        """Get key of coverage
+
+        Arguments
+            wcs_url = URL of WCS server
+            layer_name = name of layer as workspace:layer
+            bounding_box = [minx, miny, maxx, maxy] in WGS84
+            resolution = resx, resy
+            format = format requested from the server
+
+        Returns
+            hashable key including the current revision of the layer
+        """
+
+        layer_key = get_layer_key(wcs_url, layer_name)
+
+        self.lock.acquire()
+        try:
+            revision = self.revisions.get(layer_key, 0)
+        finally:
+            self.lock.release()
+
+        return (layer_key, revision,
+                tuple([float(x) for x in bounding_box]),
+                tuple([float(x) for x in resolution]),
+                format.lower())
+
+
+    def get(self, key):
+        """Get cached coverage as string or None if it is not cached
+        """
+
+        self.lock.acquire()
+        try:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.keys.remove(key)
+            self.keys.append(key)
+
+            filename, size = self.entries[key]
+            fid = open(filename, 'rb')
+            try:
+                return fid.read()
+            finally:
+                fid.close()
+        finally:
+            self.lock.release()
+
+
+    def get_overlapping(self, key):
+        """Get cached coverages which overlap the bounding box of key
+
+        Only coverages of the same layer revision, resolution and format are
+        considered. If one of them contains the bounding box, only that one is
+        returned.
+
+        Returns
+            list of (bounding box, string), most recently used first
+        """
+
+        layer_key, revision, bounding_box, resolution, format = key
+
+        self.lock.acquire()
+        try:
+            overlapping = []
+            for other in reversed(self.keys):
+                if other[:2] != key[:2] or other[3:] != key[3:]:
+                    continue
+
+                b = other[2]
+                if b[0] >= bounding_box[2] or b[2] <= bounding_box[0] or \
+                   b[1] >= bounding_box[3] or b[3] <= bounding_box[1]:
+                    continue
+
+                if b[0] <= bounding_box[0] and b[1] <= bounding_box[1] and \
+                   b[2] >= bounding_box[2] and b[3] >= bounding_box[3]:
+                    overlapping = [other]
+                    break
+
+                overlapping.append(other)
+
+            result = []
+            for other in overlapping:
+                self.keys.remove(other)
+                self.keys.append(other)
+
+                fid = open(self.entries[other][0], 'rb')
+                try:
+                    result.append((list(other[2]), fid.read()))
+                finally:
+                    fid.close()
+
+            if result:
+                self.partial_hits += 1
+
+            return result
+        finally:
+            self.lock.release()
+
+
+    def put(self, key, data):
+        """Store coverage given as string, evicting least recently used entries as needed
+
+        Coverages larger than the byte budget are not cached.
+        """
+
+        if len(data) > self.max_bytes:
+            return
+
+        self.lock.acquire()
+        try:
+            if key[1] != self.revisions.get(key[0], 0):
+                # Layer was uploaded again while this coverage was being downloaded
+                return
+
+            if key in self.entries:
+                self._remove(key)
+
+            if self.directory is None:
+                self.directory = tempfile.mkdtemp(prefix='riab_coverages_')
+                atexit.register(shutil.rmtree, self.directory, ignore_errors=True)
+
+            filename = os.path.join(self.directory, hashlib.md5(repr(key)).hexdigest() + '.tif')
+            fid = open(filename, 'wb')
+            try:
+                fid.write(data)
+            finally:
+                fid.close()
+
+            self.entries[key] = (filename, len(data))
+            self.keys.append(key)
+            self.size += len(data)
+
+            while self.size > self.max_bytes:
+                self._remove(self.keys[0])
+        finally:
+            self.lock.release()
+
+
+    def invalidate(self, wcs_url, layer_name):
+        """Bump revision of layer and remove its cached coverages
+        """
+
+        layer_key = get_layer_key(wcs_url, layer_name)
+
+        self.lock.acquire()
+        try:
+            self.revisions[layer_key] = self.revisions.get(layer_key, 0) + 1
+
+            for key in self.keys[:]:
+                if key[0] == layer_key:
+                    self._remove(key)
+        finally:
+            self.lock.release()
+
+
+    def clear(self):
+        """Remove all cached coverages
+        """
+
+        self.lock.acquire()
+        try:
+            for key in self.keys[:]:
+                self._remove(key)
+
+            if self.directory is not None:
+                shutil.rmtree(self.directory, ignore_errors=True)
+                self.directory = None
+        finally:
+            self.lock.release()
+
+
+    def get_statistics(self):
+        """Get number of entries, their total size in bytes, hits, misses and partial hits as a hash
+        """
+
+        self.lock.acquire()
+        try:
+            return {'entries': len(self.keys),
+                    'bytes': self.size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'partial_hits': self.partial_hits}
+        finally:
+            self.lock.release()
+
+
+    def _remove(self, key):
+        filename, size = self.entries.pop(key)
+        self.keys.remove(key)
+        self.size -= size
+
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+# Cache used by Geoserver
+cache = CoverageCache()
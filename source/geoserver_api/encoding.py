@@ -0,0 +1,200 @@
+"""Encoding of GeoTIFF files uploaded to Geoserver
+
+Rasters are converted before upload according to a policy: data keeps its
+type unless DATA_TYPE (or the data_type argument) asks for floating point
+data to be stored differently, blocks are compressed with a predictor,
+the file is tiled internally and overviews are added to large rasters.
+This reduces the number of bytes transferred and lets Geoserver read
+windows and coarse levels of large grids without decoding whole strips.
+"""
+
+import uuid
+import numpy
+import osgeo.gdal
+import osgeo.osr
+from raster import read_memory_file
+
+
+# Data type of floating point data ('Float32' or 'Float64'). None keeps the data type
+# of the source. Other data types are always kept.
+DATA_TYPE = None
+
+# Compression of blocks ('DEFLATE', 'LZW' or 'NONE')
+COMPRESSION = 'DEFLATE'
+
+# Width and height of internal tiles in pixels (0 gives strips)
+TILE_SIZE = 256
+
+# Add overviews to rasters larger than a tile
+OVERVIEWS = True
+
+
+def get_data_type(fid, data_type=None):
+    """Get name of GDAL data type used for uploading open GDAL dataset
+
+    Floating point data is stored with data_type, which defaults to DATA_TYPE.
+    If both are None, the data type of the dataset is kept.
+    """
+
+    if data_type is None:
+        data_type = DATA_TYPE
+
+    source_type = osgeo.gdal.GetDataTypeName(fid.GetRasterBand(1).DataType)
+    if source_type.startswith('Float') and data_type:
+        return data_type
+
+    return source_type
+
+
+def get_creation_options(data_type, compression=None, tile_size=None):
+    """Get GeoTIFF creation options for data type
+
+    Compression and tile size default to COMPRESSION and TILE_SIZE.
+
+    Returns
+        list of options like 'COMPRESS=DEFLATE'
+    """
+
+    if compression is None:
+        compression = COMPRESSION
+    if tile_size is None:
+        tile_size = TILE_SIZE
+
+    options = ['PROFILE=GEOTIFF']
+
+    if compression and compression.upper() != 'NONE':
+        options.append('COMPRESS=%s' % compression.upper())
+
+        # Horizontal differencing for integers, floating point predictor otherwise
+        if data_type.startswith('Float'):
+            options.append('PREDICTOR=3')
+        else:
+            options.append('PREDICTOR=2')
+
+    if tile_size:
+        options += ['TILED=YES',
+                    'BLOCKXSIZE=%i' % tile_size,
+                    'BLOCKYSIZE=%i' % tile_size]
+
+    return options
+
+
+def get_overview_levels(nrows, ncols, tile_size=None):
+    """Get decimation factors of overviews down to about the size of one tile
+    """
+
+    if tile_size is None:
+        tile_size = TILE_SIZE
+    size = tile_size or 256
+
+    levels = []
+    factor = 2
+    while max(nrows, ncols) > size*factor/2:
+        levels.append(factor)
+        factor *= 2
+
+    return levels
+
+
+def encode_geotiff(source, data_type=None):
+    """Encode raster as GeoTIFF for upload
+
+    Arguments
+        source = name of raster file readable by GDAL or open GDAL dataset
+        data_type = data type of floating point data, e.g. 'Float32' (see get_data_type)
+
+    Returns
+        string with GeoTIFF
+
+    The GeoTIFF is written to GDAL's virtual file system, so the raster is
+    encoded in process and no temporary file is written.
+    """
+
+    if isinstance(source, basestring):
+        fid = osgeo.gdal.Open(source, osgeo.gdal.GA_ReadOnly)
+        if fid is None:
+            msg = 'Could not open file %s' % source
+            raise Exception(msg)
+    else:
+        fid = source
+
+    band = fid.GetRasterBand(1)
+    nrows = fid.RasterYSize
+    ncols = fid.RasterXSize
+
+    data_type = get_data_type(fid, data_type)
+    filename = '/vsimem/riab_%s/encoded.tif' % uuid.uuid4().hex
+    driver = osgeo.gdal.GetDriverByName('GTiff')
+    output = driver.Create(filename, ncols, nrows, 1,
+                           osgeo.gdal.GetDataTypeByName(data_type),
+                           get_creation_options(data_type))
+    if output is None:
+        msg = 'Could not create GeoTIFF %s' % filename
+        raise Exception(msg)
+
+    try:
+        output.SetGeoTransform(fid.GetGeoTransform())
+        output.SetProjection(fid.GetProjection())
+        output_band = output.GetRasterBand(1)
+        nodata_value = band.GetNoDataValue()
+        if nodata_value is not None:
+            output_band.SetNoDataValue(nodata_value)
+
+        # Copy strips of rows so that large rasters are never held in memory as a whole
+        step = TILE_SIZE or 256
+        for row in range(0, nrows, step):
+            n = min(step, nrows - row)
+            output_band.WriteArray(band.ReadAsArray(0, row, ncols, n), 0, row)
+
+        # Overviews are stored inside the GeoTIFF and compressed like the data
+        if OVERVIEWS:
+            levels = get_overview_levels(nrows, ncols)
+            if levels:
+                output.BuildOverviews('AVERAGE', levels)
+
+        output_band = None
+        output = None
+
+        return read_memory_file(filename)
+    finally:
+        output_band = output = None
+        osgeo.gdal.Unlink(filename)
+
+
+def encode_array(A, geotransform, projection, nodata_value=-9999, data_type=None):
+    """Encode numeric array as GeoTIFF for upload
+
+    Arguments
+        A = two dimensional numeric array. NaN is stored as NODATA.
+        geotransform = GDAL geotransform (x0, dx, 0, y0, 0, dy) of the upper left corner
+        projection = WKT of the coordinate reference system or a definition such as 'EPSG:4326'
+        nodata_value = NODATA value stored in the GeoTIFF
+        data_type = data type stored, e.g. 'Float32'. By default DATA_TYPE or else Float64.
+
+    Returns
+        string with GeoTIFF
+    """
+
+    A = numpy.array(A, dtype=numpy.float64)
+    msg = 'Raster data must be two dimensional. I got shape %s' % str(A.shape)
+    assert len(A.shape) == 2, msg
+    A[numpy.isnan(A)] = nodata_value
+
+    srs = osgeo.osr.SpatialReference()
+    if srs.SetFromUserInput(projection) != 0:
+        msg = 'Could not interpret projection %s' % projection
+        raise Exception(msg)
+
+    msg = 'Projection %s had no Coordinate/Spatial Reference System (CRS)' % projection
+    assert srs.ExportToWkt().startswith('GEOGCS'), msg
+
+    nrows, ncols = A.shape
+    dataset = osgeo.gdal.GetDriverByName('MEM').Create('', ncols, nrows, 1, osgeo.gdal.GDT_Float64)
+    dataset.SetGeoTransform(geotransform)
+    dataset.SetProjection(srs.ExportToWkt())
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(nodata_value)
+    band.WriteArray(A)
+    band = None
+
+    return encode_geotiff(dataset, data_type)
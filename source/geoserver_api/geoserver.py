@@ -2,21 +2,45 @@
 """
 
 import os
-from utilities import get_web_page, run, curl, get_pathname_from_package
+import time
+import threading
+from multiprocessing.pool import ThreadPool
+from utilities import run, curl, copy_to_cwd, zip_shapefile, get_pathname_from_package
+from rest_client import get_client, HTTPError
+from catalog import get_catalog
 import numpy
 import coverage
+import wcs_metadata
+import coverage_cache
+import mosaic
+import encoding
 import raster
 import sld_template
 import osgeo.gdal
-import pycurl
-import StringIO
 import json
-import re
+
+
+# Seconds for which a verified connection is trusted before get_geoserver verifies it again
+VERIFICATION_TTL = 300
+
+# REST directories of the kinds of store holding layers and the kinds listed in them
+STORE_TYPES = [('coveragestores', 'coverageStore'),
+               ('datastores', 'dataStore')]
+
+# Extensions of files uploaded as coverages and as vector layers
+RASTER_EXTENSIONS = ['.asc', '.txt', '.tif']
+VECTOR_EXTENSIONS = ['.zip', '.shp']
 
 class Geoserver:
     """Connection to one instance of a geoserver  
     """
     
+    # Large GeoTIFF downloads are split into chunks of at most this many cells (0 disables splitting)
+    DOWNLOAD_CHUNK_CELLS = 0
+    
+    # Maximal number of chunks downloaded concurrently
+    DOWNLOAD_THREADS = 4
+    
     def __init__(self, geoserver_url, geoserver_username, geoserver_userpass):
         """Instantiate class and verify connection to specified geoserver through the REST API.
         """
@@ -26,18 +50,30 @@ class Geoserver:
         self.geoserver_username = geoserver_username
         self.geoserver_userpass = geoserver_userpass
         
-        # Verify that Geoserver is running
+        # Connections are pooled and shared by all instances for the same geoserver
+        self.client = get_client(geoserver_url, geoserver_username, geoserver_userpass)
+        
+        # as is the cache of catalog lookups
+        self.catalog = get_catalog(geoserver_url)
+        
+        self.verify()
+        
+        
+    def verify(self):
+        """Verify that Geoserver is running and record the time of verification
+        """
+        
         found = False
-        page = get_web_page(os.path.join(geoserver_url, 'rest'), 
-                            username=geoserver_username, 
-                            password=geoserver_userpass)
-        for line in page:
+        status, page = self.client.request('GET', '')
+        for line in page.splitlines():
             if line.find('workspaces') > 0:
                 found = True
 
-        msg = 'Could not connect to geoserver at %s' % geoserver_url        
+        msg = 'Could not connect to geoserver at %s' % self.geoserver_url        
         assert found, msg
         
+        self.verified = time.time()
+        
         
     # Methods for manipulating the geoserver (e.g. add and delete workspaces)
     def create_workspace(self, name, verbose=False):
@@ -57,29 +93,29 @@ class Geoserver:
                  'text/xml', 
                  'workspaces', 
                  '--data-ascii', 
-                 '<workspace><name>%s</name></workspace>' % name, 
+                 get_workspace_xml(name), 
                  verbose=verbose)
         except Exception, e:
-            
-            if str(e).find('already exists') > 0:
-                # Workspace already exists, no worries
-                pass
-            else:
-                # Reraise
-                msg = 'Could not create workspace %s: %s' % (name, e)
-                raise Exception(msg)
+            # Workspace may already exist, no worries
+            check_existing(e, 'workspace', name)
              
+        self.catalog.set('workspace', name)
         
         # Record this workspace as default FIXME - obsolete?
         self.workspace = name
         
         
-    def get_workspace(self, name, verbose=False):
+    def get_workspace(self, name, verbose=False, use_cache=True):
         """Get workspace info from the geoserver
+        
+        Workspaces found recently are taken to exist unless use_cache is False
         """
 
         # FIXME(Ole): Unfortunate name as it doesn't return anything
         
+        if use_cache and self.catalog.get('workspace', name):
+            return
+        
         out = curl(self.geoserver_url, 
                    self.geoserver_username, 
                    self.geoserver_userpass, 
@@ -100,6 +136,8 @@ class Geoserver:
         if not succes:        
             msg = 'Could not find workspace %s in geoserver %s' % (name, self.geoserver_url)
             raise Exception(msg)
+            
+        self.catalog.set('workspace', name)
 
 
 
@@ -126,38 +164,70 @@ class Geoserver:
         if workspace is None:
             raise Exception('Default workspace not yet implemented')
         
-        if bounding_box is None:
-            bounding_box = [] # FIXME (Ole): Not sure about default value
-            
         if output_filename is None:
             output_filename = coverage_name + '.tif'
             
         if verbose:
             print 'Downloading coverage %s to %s' % (coverage_name, output_filename)        
             
-        # Get coverage    
-        wcs_url = os.path.join(self.geoserver_url, 'wcs')
-        layer_name = '%s:%s' % (workspace, coverage_name)
-
+        # Get coverage (the whole layer if bounding_box is None)
+        data = self.read_coverage(coverage_name, workspace, bounding_box, format=format)
+        fid = open(output_filename, 'wb')
         try:
-            c = coverage.Coverage(wcs_url, layer_name)
-        except KeyError, e:
-            msg = 'Could not download layer %s from %s' % (layer_name, wcs_url)
-            raise KeyError(msg)
-            
-        c.download(format=format, bounding_box=bounding_box, outputfile=output_filename)
+            fid.write(data)
+        finally:
+            fid.close()
 
-        # Convert downloaded data to ASCII (without FORCE_CELLSIZE we get a warning suggesting this option)
-        basename, _ = os.path.splitext(output_filename)
-        ascii_filename = basename + '.asc'   
-        cmd = 'gdal_translate -ot Float64 -of AAIGrid -co "FORCE_CELLSIZE=TRUE" -a_nodata -9999 %s %s' % (output_filename, ascii_filename)
+        return convert_to_ascii(output_filename, verbose=verbose)
         
-        if verbose:
-            run(cmd, verbose=verbose)
-        else:
-            run(cmd, stdout='/dev/null', stderr='/dev/null', verbose=verbose)
         
-        return ascii_filename
+    def get_coverage(self, coverage_name, workspace):
+        """Get Coverage object for downloading named raster layer through WCS
+        """
+        
+        return get_wcs_coverage(self.geoserver_url, coverage_name, workspace)
+        
+        
+    def read_coverage(self, coverage_name, workspace, bounding_box=None, format='GeoTIFF'):
+        """Get named raster layer as string in given format
+        
+        The bounding box is grown to the nearest cell boundaries of the layer so that all
+        coverages of a layer share one grid. If bounding_box is None the whole layer is returned.
+        
+        Coverages are served from the local coverage cache when possible. GeoTIFF coverages
+        overlapping cached ones are cut out of those and only the uncovered parts are downloaded.
+        If DOWNLOAD_CHUNK_CELLS is set, large GeoTIFF downloads are split into chunks on the
+        layer grid which are fetched concurrently and mosaicked.
+        """
+        
+        c = self.get_coverage(coverage_name, workspace)
+        
+        plan = get_read_plan(c, bounding_box, format, self.DOWNLOAD_CHUNK_CELLS)
+        if plan['data'] is not None:
+            return plan['data']
+            
+        return assemble_coverage(plan, self._read_parts(c, format, plan['parts']))
+        
+        
+    def _read_parts(self, c, format, bounding_boxes):
+        """Download parts of coverage c on a pool of at most DOWNLOAD_THREADS threads
+        
+        Returns
+            list of strings in the same order as bounding_boxes
+        """
+        
+        # Requests served entirely from cached coverages download nothing
+        # and single parts are read directly
+        if len(bounding_boxes) < 2:
+            return [c.read(format=format, bounding_box=bounding_box) for bounding_box in bounding_boxes]
+            
+        pool = ThreadPool(max(1, min(self.DOWNLOAD_THREADS, len(bounding_boxes))))
+        try:
+            return pool.map(lambda bounding_box: c.read(format=format, bounding_box=bounding_box), 
+                            bounding_boxes)
+        finally:
+            pool.close()
+            pool.join()
         
         
     def download_vector_layer(self, name):
@@ -176,20 +246,56 @@ class Geoserver:
         See docstrings for upload_coverage(0 and upload_vector_data() for more details.
         """
         
-        # FIXME: We should let GDAL take care of filetypes.
-        
-        _, extension = os.path.splitext(filename)        
-        
-        if extension in ['.asc', '.txt', '.tif']:
+        if get_layer_type(filename) == 'coverage':
             return self.upload_coverage(filename, workspace, verbose)
-        elif extension in ['.zip', '.shp']:
-            return self.upload_vector_layer(filename, workspace, verbose)        
         else:
-            msg = 'Unknown extention for spatial data: %s' % extension
-            raise Exception(msg)
+            return self.upload_vector_layer(filename, workspace, verbose)        
+            
+        
+    def upload_layers(self, filenames, workspace, max_workers=4, verbose=False):
+        """Upload several coverages or vector files to the same workspace concurrently
+        
+        Arguments
+            filenames = list of files accepted by upload_layer
+            workspace = name of existing workspace
+            max_workers = maximal number of files processed at the same time
             
+        Returns
+            list with a hash for each file in the order of filenames with fields
+                'filename': name of the file
+                'layer': name of the layer as workspace:layer or None if the upload failed
+                'error': error message if the upload failed, otherwise None
+                'seconds': time spent on the file
+                
+        Note
+            Each file is converted, uploaded and styled by upload_layer on a pool of at most 
+            max_workers threads, so local conversion and styling of some files overlap with 
+            network transfers of others. A failed file does not stop the others.
+        """
         
-    def upload_coverage(self, filename, workspace, verbose=False):
+        def upload(filename):
+            t0 = time.time()
+            result = {'filename': filename, 'layer': None, 'error': None}
+            try:
+                result['layer'] = self.upload_layer(filename, workspace, verbose=verbose)
+            except Exception, e:
+                result['error'] = get_error_message(e)
+            result['seconds'] = time.time() - t0
+            
+            return result
+            
+        if not filenames:
+            return []
+            
+        pool = ThreadPool(max(1, min(max_workers, len(filenames))))
+        try:
+            return pool.map(upload, filenames)
+        finally:
+            pool.close()
+            pool.join()
+            
+            
+    def upload_coverage(self, filename, workspace, verbose=False, data_type=None):
         """Upload raster file to named layer
         Valid file types are
         
@@ -200,81 +306,47 @@ class Geoserver:
         Otherwise an autogenerated sld will be made for ASCII rasters. 
                      Geotiffs will rely on their native styling.  (FIXME: Rethink semantics of all this)
         
+        All rasters are converted to a compressed and tiled GeoTIFF before upload.
+        Data type, compression, tiling and overviews follow the policy in encoding.py.
+        Floating point data is stored with data_type (e.g. 'Float32') if given.
         
-        Uploads are done using curl commands of the form
+        Uploads are done using requests of the form
         curl -u admin:geoserver -v -X PUT -H "Content-type: image/tif" "http://localhost:8080/geoserver/rest/workspaces/futnuh/coveragestores/population_padang_1/file.geotiff" --data-binary "@data/population_padang_1.tif
         """
         
-        # Form derived variables
-        pathname, extension = os.path.splitext(filename)
-        layername = os.path.split(pathname)[-1]
+        layername = get_layer_name(filename)
         
-        msg = 'Coverage must have extension asc, txt or tif'
-        assert extension in ['.asc', '.txt', '.tif'], msg
+        # Convert to compressed and tiled Geotiff in memory (see encoding.py) and upload it
+        data = encode_coverage(filename, data_type)
+        self.upload_geotiff(data, layername, workspace)
 
-        # Check to see if the dataset has a coordinate system
-        # FIXME: Do this for vector layers also
-        dataset = osgeo.gdal.Open(filename, osgeo.gdal.GA_ReadOnly)
-        msg = filename+' had no Coordinate/Spatial Reference System (CRS)'
-        assert dataset.GetProjectionRef().startswith('GEOGCS'), msg
+        # Take care of styling 
+        style_filename = prepare_style(filename)
+        if style_filename is not None:
+            self.apply_style(layername, style_filename, verbose=verbose)
 
-        # Style file in case it accompanies the file        
-        provided_style_filename = pathname + '.sld'
+        return '%s:%s' % (workspace, layername)
+        
         
-        # Locally stored                
-        upload_filename = layername + '.tif'             
-        style_filename = layername + '.sld'         
 
+    def upload_geotiff(self, data, layername, workspace):
+        """Upload GeoTIFF held in memory to named layer
         
-        if extension == '.tif':
-            generate_sld = False
-                    
-            cmd = 'cp %s %s' % (filename, os.getcwd()) # upload_filename)
-            run(cmd, verbose=False)            
-        else:
-            # Convert to Geotiff
-            generate_sld = True            
-            cmd = 'gdal_translate -ot Float64 -of GTiff -co "PROFILE=GEOTIFF" %s %s' % (filename, 
-                                                                                        upload_filename)
-            if verbose:
-                run(cmd, verbose=verbose)
-            else:
-                run(cmd, stdout='upload_raster.stdout', stderr='upload_raster.stderr', verbose=verbose)        
+        Arguments
+            data = string with GeoTIFF, e.g. from encoding.encode_geotiff
+            layername = name of coverage store and layer
+            workspace = name of workspace
         
-        # Upload raster data to Geoserver
-        curl(self.geoserver_url, 
-             self.geoserver_username, 
-             self.geoserver_userpass, 
-             'PUT', 
-             'image/tif', 
-             'workspaces/%s/coveragestores/%s/file.geotiff' % (workspace, layername), 
-             '--data-binary', 
-             '@%s' % upload_filename, 
-             verbose=verbose)
-
-
-        # Take care of styling 
-        if os.path.isfile(provided_style_filename):
-            # Use provided style file
-
-            # Copy provide file to local directory because the REST interface
-            # spits the dummy with pathnames.
-            cmd = 'cp %s %s' % (provided_style_filename, os.getcwd())
-            run(cmd, verbose=False)    
-        else:        
-            # Automatically create new style file for raster file
-            
-            self.create_raster_sld(upload_filename, quantiles=False, verbose=verbose)
- 
-            
-        if generate_sld:
-            # Upload style file to Geoserver    
-            self.upload_style(layername, style_filename, verbose=verbose)            
-            
-            # Make it the default for this layer
-            self.set_default_style(layername, layername, verbose=verbose)
-
-        return '%s:%s' % (workspace, layername)
+        Cached metadata and coverages of the layer are invalidated.
+        """
+        
+        self.client.request('PUT', 
+                            'workspaces/%s/coveragestores/%s/file.geotiff' % (workspace, layername), 
+                            data, 
+                            'image/tif')
+        
+        # Bounding box and resolution may have changed
+        invalidate_layer(self.geoserver_url, workspace, layername)
         
         
 
@@ -286,80 +358,30 @@ class Geoserver:
         Or it can be the name of the main shapefiel (*.shp) in which case it will be zipped up
         before upload.
                 
-        Uploads are done using curl commands of the form
+        Uploads are done using requests of the form
         curl -u admin:geoserver -v -X PUT -H "Content-type: application/zip" "http://localhost:8080/geoserver/rest/workspaces/futnuh/datastores/volcanoes/file.shp" --data-binary @volcanoes.zip
-        """
         
-        subdir = os.path.split(filename)[0]
-        local_filename = os.path.split(filename)[1]
-        
-        layername, extension = os.path.splitext(local_filename)
-        upload_filename = layername + '.zip'             
-        style_filename = layername + '.sld'         # Locally stored
-        provided_style_filename = os.path.join(subdir, style_filename) # In case it accompanies the file
-        
-        
-        msg = 'Vector data must have extension zip or shp'
-        assert extension in ['.zip', '.shp'], msg
-        
-        if extension == '.shp':
-            projection_filename = os.path.join(subdir,  layername) + '.prj'                     
-            try:
-                fid = open(projection_filename)
-            except:
-                msg = 'Could not open projection file %s' % projection_filename
-                raise Exception(msg)
-            else:
-                fid.close()
-        
-            # Zip shapefile and auxiliary files 
-            cmd = 'cd %s; zip %s %s*' % (subdir, upload_filename, layername)
-            run(cmd, stdout='zip.stdout', stderr='zip.stderr', verbose=verbose)
-            
-            # Move to cwd
-            # FIXME (Ole): For some reason geoserver won't accept the zip file unless
-            # located in CWD.       
-            # FIXME (Ole): If zip file already exists with different owner, this
-            # will silently wait for a newline. Annoying.     
-            cmd = 'mv %s/%s .' % (subdir, upload_filename)
-            run(cmd, stdout='mvzip.stdout', stderr='mvzip.stderr', verbose=verbose)            
-        else:
-            # Already zipped - FIXME: Need to test if it is indeed a zipped shape file
-            pass
+        Shapefiles are zipped into a private temporary file and archives are streamed from 
+        where they are, so nothing is written to the working directory.
+        """
         
+        layername = get_layer_name(filename)
+        fid = open_vector_data(filename)
         
         # Upload vector data to Geoserver        
-        curl(self.geoserver_url, 
-             self.geoserver_username, 
-             self.geoserver_userpass, 
-             'PUT', 
-             'application/zip', 
-             'workspaces/%s/datastores/%s/file.shp' % (workspace, layername), 
-             '--data-binary', 
-             '@%s' % upload_filename, 
-             verbose=verbose)
-             
+        rest_dir = 'workspaces/%s/datastores/%s/file.shp' % (workspace, layername)
+        if verbose:
+            print 'PUT %s to %s' % (filename, rest_dir)
+            
+        try:
+            self.client.request('PUT', rest_dir, fid, 'application/zip')
+        finally:
+            fid.close()
              
         # Take care of styling 
-        if os.path.isfile(provided_style_filename):
-            # Use provided style file
-                
-            # Copy provide file to local directory because the REST interface
-            # spits the dummy with pathnames.
-            cmd = 'cp %s %s' % (provided_style_filename, os.getcwd())
-            run(cmd, verbose=False)    
-        else:        
-            # Automatically create new style file for vector file (FIXME: Not yet implemented)
-            #self.create_vector_sld(upload_filename)
-            return '%s:%s' % (workspace, layername)        
-                        
- 
-        # Upload style file to Geoserver    
-        self.upload_style(layername, style_filename, verbose=verbose)            
-            
-        # Make it the default for this layer
-        self.set_default_style(layername, layername, verbose=verbose)
-             
+        style_filename = prepare_style(filename)
+        if style_filename is not None:
+            self.apply_style(layername, style_filename, verbose=verbose)
         
         return '%s:%s' % (workspace, layername)        
                 
@@ -373,22 +395,23 @@ class Geoserver:
                         verbose=False):
 
         """Retrieve named coverage layer as Python numpy struture
-        """
-
-        # Download coverage into ASCII file
-        ascii_filename = self.download_coverage(coverage_name, 
-                                                bounding_box=bounding_box, 
-                                                workspace=workspace, 
-                                                format='GeoTIFF',
-                                                verbose=verbose)
-
-        # Read resulting ASCII file into internal numerical structure and return
-        return raster.read_coverage(ascii_filename)
         
-        # FIXME (Ole): Include georef, projection info etc in return
-                
+        The GeoTIFF returned by the WCS server is kept in memory and opened
+        through GDAL's virtual file system so nothing touches the disk.
         
+        Returns
+            Raster object with data, georeference and projection of the layer
+        """
 
+        if workspace is None:
+            raise Exception('Default workspace not yet implemented')
+            
+        if verbose:
+            print 'Downloading coverage %s into memory' % coverage_name
+            
+        data = self.read_coverage(coverage_name, workspace, bounding_box)
+        
+        return raster.MemoryRaster(data, coverage_name)
         
         
     def get_vector_data(self, name):
@@ -398,11 +421,34 @@ class Geoserver:
         pass
         
         
-    def store_raster_data(self, name):
-        """
+    def store_raster_data(self, A, geotransform, projection, layername, workspace, 
+                          nodata_value=-9999, verbose=False, data_type=None):
+        """Publish numeric array as raster layer
+        
+        Arguments
+            A = two dimensional numeric array. NaN is stored as NODATA.
+            geotransform = GDAL geotransform (x0, dx, 0, y0, 0, dy) of the upper left corner
+            projection = WKT of the coordinate reference system or a definition such as 'EPSG:4326'
+            layername = name of layer
+            workspace = name of workspace
+            nodata_value = NODATA value stored in the GeoTIFF
+            data_type = data type stored, e.g. 'Float32' (see encoding.encode_array)
+            
+        Returns
+            'workspace:layername'
+            
+        The array is encoded as GeoTIFF in memory (see encoding.py) and uploaded in
+        a single request, so no raster files are written. A style is generated for the layer.
         """
         
-        pass
+        data = encoding.encode_array(A, geotransform, projection, nodata_value, data_type)
+        
+        self.upload_geotiff(data, layername, workspace)
+        
+        # Style from the encoded raster
+        self.apply_style(layername, write_memory_raster_sld(data, layername), verbose=verbose)
+        
+        return '%s:%s' % (workspace, layername)
 
         
         
@@ -415,18 +461,21 @@ class Geoserver:
 
     def find_style(self, name):
         """Does the style exist"""
-        c = pycurl.Curl()
-        url = ((self.geoserver_url+"/rest/styles/%s") % name)
-        c.setopt(pycurl.URL, url)
-        c.setopt(pycurl.HTTPHEADER, ["Accept: text/json"])
-        c.setopt(pycurl.USERPWD, "%s:%s" % (self.geoserver_username, self.geoserver_userpass))
-        c.setopt(pycurl.VERBOSE, 0)
-        b = StringIO.StringIO()
-        c.setopt(pycurl.WRITEFUNCTION, b.write)
-        c.perform()
-        m = re.match("No such style: ", b.getvalue())
-        if m: return None
-        d = json.loads(b.getvalue())
+        
+        d = self.catalog.get('style', name)
+        if isinstance(d, dict):
+            return d
+        
+        try:
+            status, body = self.client.request('GET', 'styles/%s' % name,
+                                               headers={'Accept': 'text/json'})
+        except HTTPError, e:
+            if e.status == 404:
+                return None
+            raise
+            
+        d = json.loads(body)
+        self.catalog.set('style', name, d)
         return d
 
 
@@ -463,47 +512,9 @@ class Geoserver:
         If quantiles is True, 10 quantiles will be used for colour coding. Othewise 10 equidistant intervals will be used.
         """
 
-        pathname, extension = os.path.splitext(filename)
-        layername = os.path.basename(pathname)
+        write_raster_sld(filename, quantiles=quantiles)
         
-        R = raster.read_coverage(filename)
-        levels = R.get_bins(N=10, quantiles=quantiles)
-        nodata = R.get_nodata_value()         
-
-
-        #if verbose:
-        #    print 'Styling %s' %layername        
-        #    print 'Levels', levels
-        #    print 'NoData', nodata    
         
-        # Write the SLD file    
-        sld = layername+'.sld'
-        text = sld_template.sld_template
-
-        text = text.replace('MIN',str(levels[0]))
-        text = text.replace('MAX',str(levels[-1]))
-        text = text.replace('TEN',str(levels[1]))
-        text = text.replace('TWENTY',str(levels[2]))
-        text = text.replace('THIRTY',str(levels[3]))
-        text = text.replace('FOURTY',str(levels[4]))
-        text = text.replace('FIFTY',str(levels[5]))
-        text = text.replace('SIXTY',str(levels[6]))
-        text = text.replace('SEVENTY',str(levels[7]))
-        text = text.replace('EIGHTY',str(levels[8]))
-        text = text.replace('NINETY',str(levels[9]))
-
-
-        # Getting round an sld parsing bug in geoserver
-        if nodata >= max:
-            text = text.replace('<!--Higher-->', '<ColorMapEntry color="#ffffff" quantity="NODATA" opacity="0"/>')
-        else:   
-            text = text.replace('<!--Lower-->', '<ColorMapEntry color="#ffffff" quantity="NODATA" opacity="0"/>')
-            
-        text = text.replace('NODATA', str(nodata))
-        fout = open(sld, 'w')
-        fout.write(text)
-        fout.close()
-    
     def upload_style(self, style_name, style_file, verbose=False):
         """Upload style file to geoserver
         """     
@@ -511,25 +522,21 @@ class Geoserver:
         # curl -u geoserver -XPOST -H 'Content-type: text/xml' -d 
         # '<style><name>sld_for_Pk50095_geotif_style</name><filename>Pk50095.sld</filename></style>' 
         # localhost:8080/geoserver/rest/styles/ 
-        try:
-            curl(self.geoserver_url, 
-                 self.geoserver_username, 
-                 self.geoserver_userpass, 
-                 'POST', 
-                 'text/xml', 
-                 'styles', 
-                 '--data-ascii', 
-                 '<style><name>%s</name><filename>%s</filename></style>' % (style_name, style_file),  
-                 verbose=verbose)
-        except Exception, e:
-            
-            if str(e).find('already exists') > 0:
-                # Style already exists, no worries
-                pass
-            else:
-                # Reraise
-                msg = 'Could not create style %s: %s' % (style_name, e)
-                raise Exception(msg)
+        # This step is skipped if the style is known to exist.
+        if not self.catalog.get('style', style_name):
+            try:
+                curl(self.geoserver_url, 
+                     self.geoserver_username, 
+                     self.geoserver_userpass, 
+                     'POST', 
+                     'text/xml', 
+                     'styles', 
+                     '--data-ascii', 
+                     get_style_xml(style_name, style_file),  
+                     verbose=verbose)
+            except Exception, e:
+                # Style may already exist, no worries
+                check_existing(e, 'style', style_name)
                 
 
         # curl -u geoserver -XPUT -H 'Content-type: application/vnd.ogc.sld+xml' -d @sld_for_Pk50095_geotif.sld
@@ -544,7 +551,19 @@ class Geoserver:
             '@%s' % style_file, 
             verbose=verbose)
 
+        # The style now exists but a description fetched by find_style
+        # before the PUT is stale
+        self.catalog.set('style', style_name)
 
+
+        
+    def apply_style(self, layer_name, style_file, verbose=False):
+        """Upload style file as style named after layer and make it the default of the layer
+        """
+        
+        self.upload_style(layer_name, style_file, verbose=verbose)
+        self.set_default_style(layer_name, layer_name, verbose=verbose)
+        
         
     def set_default_style(self, style_name, layer_name, verbose=False):
         """Set given style as default for specified layer"""
@@ -556,7 +575,7 @@ class Geoserver:
              'text/xml', 
              'layers/%s' % (layer_name), 
              '--data-ascii', 
-             '<layer><defaultStyle><name>%s</name></defaultStyle><enabled>true</enabled></layer>' % style_name,
+             get_default_style_xml(style_name),
              verbose=verbose)
         
         # curl -u admin:geoserver -XPUT -H 'Content-type: text/xml' -d 
@@ -568,20 +587,15 @@ class Geoserver:
         """docstring for delete_style"""
         
         # TODO: add test
-        run('curl -u %s:%s -d "purge=true" -X DELETE localhost:8080/geoserver/rest/styles/%s' % (self.geoserver_username, 
-                                                                                                 self.geoserver_userpass, 
-                                                                                                 style_name))            
-    def delete_layer(self, layer_name, workspace, verbose=False):
-        """Delete layer on server
+        self.catalog.invalidate('style', style_name)
+        self.client.request('DELETE', 'styles/%s?purge=true' % style_name)
         
-        This is done through REST in three steps with commands like this:
-        
-        curl -u admin:geoserver -v -X DELETE "http://localhost:8080/geoserver/rest/layers/shakemap_padang_20090930"
-        curl -u admin:geoserver -v -X DELETE "http://localhost:8080/geoserver/rest/workspaces/hazard/coveragestores/shakemap_padang_20090930/coverages/shakemap_padang_20090930"
-        curl -u admin:geoserver -v -X DELETE "http://localhost:8080/geoserver/rest/workspaces/hazard/coveragestores/shakemap_padang_20090930"
         
+    def delete_layer(self, layer_name, workspace, verbose=False):
+        """Delete layer on server
         
-        In newer versions of GeoServer it can done like this:
+        The coverage store, or data store if there is no coverage store of that name,
+        is deleted together with its coverage and layer in one request like this:
         curl -u admin:geoserver -v -X DELETE "http://localhost:8080/geoserver/rest/workspaces/hazard/coveragestores/shakemap_padang_20090930?recurse=true"        
         """
         
@@ -589,47 +603,555 @@ class Geoserver:
             msg = 'Valid layer name was not provided for deletion. I got "%s"' % str(layer_name)
             raise Exception(msg)
             
-        
-        # Delete layer
-        curl(self.geoserver_url, 
-             self.geoserver_username, 
-             self.geoserver_userpass, 
-             'DELETE', 
-             '', 
-             'layers/%s' % layer_name, 
-             '', 
-             '',
-             verbose=verbose)        
-             
-             
-        # Delete associated coverages
-        curl(self.geoserver_url, 
-             self.geoserver_username, 
-             self.geoserver_userpass, 
-             'DELETE', 
-             '', 
-             'workspaces/%s/coveragestores/%s/coverages/%s' % (workspace, layer_name, layer_name),
-             '', 
-             '',
-             verbose=verbose)                     
-             
-        # Delete associated coverage store
-        curl(self.geoserver_url, 
-             self.geoserver_username, 
-             self.geoserver_userpass, 
-             'DELETE', 
-             '', 
-             'workspaces/%s/coveragestores/%s' % (workspace, layer_name),
-             '', 
-             '',
-             verbose=verbose)                                  
-             
+        # Delete coverage store together with its coverage and layer.
+        # Vector layers are held in data stores instead.
+        try:
+            self._delete_store(workspace, 'coveragestores', layer_name)
+        except HTTPError, e:
+            if e.status != 404:
+                raise
+            self._delete_store(workspace, 'datastores', layer_name)
              
 
+    def layer_exists(self, layer_name, workspace):
+        """Check whether layer is published on server
         
-    def delete_all_layers(self, verbose=False):
+        The layer is looked up with one small request like this:
+        curl -u admin:geoserver -X GET "http://localhost:8080/geoserver/rest/layers/hazard:shakemap_padang_20090930"
+        """
+        
+        try:
+            self.client.request('GET', 'layers/%s:%s' % (workspace, layer_name))
+        except HTTPError, e:
+            if e.status != 404:
+                raise
+            return False
+            
+        return True
+        
+        
+    def get_names(self, rest_dir, kind):
+        """Get names of resources listed by REST resource
+        
+        Arguments
+            rest_dir = listing below the REST endpoint, e.g. 'workspaces/hazard/coveragestores'
+            kind = kind of resources in the listing, e.g. 'coverageStore'
+        """
+        
+        status, body = self.client.request('GET', rest_dir, headers={'Accept': 'text/json'})
+        
+        return parse_names(body, kind)
+        
+        
+    def delete_all_layers(self, workspace=None, max_workers=4, verbose=False):
         """Delete all layers on server
+        
+        Arguments
+            workspace = name of workspace to clear. All workspaces are cleared if None.
+            max_workers = maximal number of stores deleted at the same time
+            
+        Returns
+            list with a hash for each store in the order of the catalog with fields
+                'layer': name of the layer as workspace:layer
+                'style': name of the style removed with the layer or None
+                'error': error message if the layer could not be deleted, otherwise None
+                'style_error': error message if its style could not be removed, otherwise None
+                'seconds': time spent on the layer
+                
+        Note
+            Coverage and data stores are listed once per cleared workspace and deleted with
+            recurse=true, which removes their coverages, feature types and layers in a single
+            request. Deletions run on a pool of at most max_workers threads and a failed layer
+            does not stop the others.
+            
+            Styles named after a deleted layer are orphaned and removed too, unless a layer
+            of the same name remains in another workspace. Layers elsewhere are found from
+            one listing of all layers.
         """
         
-        # Get layers and associated workspaces
-        pass
+        if workspace is None:
+            workspaces = self.get_names('workspaces', 'workspace')
+        else:
+            workspaces = [workspace]
+            
+        stores = []
+        for name in workspaces:
+            for store_type, kind in STORE_TYPES:
+                for store in self.get_names('workspaces/%s/%s' % (name, store_type), kind):
+                    stores.append((name, store_type, store))
+                    
+        if not stores:
+            return []
+            
+        remaining = {}
+        if workspace is not None:
+            remaining = get_remaining_layers(self.get_names('layers', 'layer'), stores)
+            
+        styles = self.get_names('styles', 'style')
+        
+        def delete_store(args):
+            name, store_type, store = args
+            
+            t0 = time.time()
+            result = {'layer': '%s:%s' % (name, store), 'style': None, 'error': None, 'style_error': None}
+            try:
+                self._delete_store(name, store_type, store)
+            except Exception, e:
+                result['error'] = get_error_message(e)
+            result['seconds'] = time.time() - t0
+            
+            if verbose:
+                print 'Deleted %s in %.2f seconds' % (result['layer'], result['seconds'])
+                
+            return result
+            
+        def delete_style(result):
+            t0 = time.time()
+            style = result['layer'].split(':')[1]
+            try:
+                self.delete_style(style, verbose=verbose)
+                result['style'] = style
+            except Exception, e:
+                result['style_error'] = get_error_message(e)
+            result['seconds'] += time.time() - t0
+            
+        pool = ThreadPool(max(1, min(max_workers, len(stores))))
+        try:
+            results = pool.map(delete_store, stores)
+            
+            # Styles can only be removed once no layer uses them
+            pool.map(delete_style, get_orphaned_styles(results, styles, remaining))
+        finally:
+            pool.close()
+            pool.join()
+            
+        return results
+        
+        
+    def _delete_store(self, workspace, store_type, store):
+        """Delete store with its coverages or feature types and layers
+        """
+        
+        invalidate_layer(self.geoserver_url, workspace, store)
+        
+        self.client.request('DELETE', 'workspaces/%s/%s/%s?recurse=true' % (workspace, store_type, store))
+
+
+def get_wcs_coverage(geoserver_url, coverage_name, workspace):
+    """Get Coverage object for downloading named raster layer through the WCS of geoserver
+    """
+    
+    wcs_url = os.path.join(geoserver_url, 'wcs')
+    layer_name = '%s:%s' % (workspace, coverage_name)
+
+    try:
+        return coverage.Coverage(wcs_url, layer_name)
+    except KeyError, e:
+        msg = 'Could not download layer %s from %s' % (layer_name, wcs_url)
+        raise KeyError(msg)
+        
+        
+def get_layer_type(filename):
+    """Get type of layer ('coverage' or 'vector') uploaded from file with given extension
+    """
+    
+    # FIXME: We should let GDAL take care of filetypes.
+    
+    _, extension = os.path.splitext(filename)
+    
+    if extension in RASTER_EXTENSIONS:
+        return 'coverage'
+    elif extension in VECTOR_EXTENSIONS:
+        return 'vector'
+    else:
+        msg = 'Unknown extention for spatial data: %s' % extension
+        raise Exception(msg)
+        
+        
+def get_layer_name(filename):
+    """Get name of layer uploaded from file, i.e. its basename without extension
+    """
+    
+    return os.path.splitext(os.path.split(filename)[1])[0]
+    
+    
+def encode_coverage(filename, data_type=None):
+    """Convert raster file to compressed and tiled GeoTIFF held in memory (see encoding.py)
+    """
+    
+    _, extension = os.path.splitext(filename)
+    msg = 'Coverage must have extension asc, txt or tif'
+    assert extension in RASTER_EXTENSIONS, msg
+
+    # Check to see if the dataset has a coordinate system
+    # FIXME: Do this for vector layers also
+    dataset = osgeo.gdal.Open(filename, osgeo.gdal.GA_ReadOnly)
+    msg = filename+' had no Coordinate/Spatial Reference System (CRS)'
+    assert dataset.GetProjectionRef().startswith('GEOGCS'), msg
+    
+    return encoding.encode_geotiff(dataset, data_type)
+    
+    
+def open_vector_data(filename):
+    """Open vector file for upload as zipped shapefile
+    
+    Shapefiles (*.shp) are zipped together with their auxiliary files into a
+    private temporary file. Zip files are opened where they are.
+    """
+    
+    subdir, local_filename = os.path.split(filename)
+    layername, extension = os.path.splitext(local_filename)
+    
+    msg = 'Vector data must have extension zip or shp'
+    assert extension in VECTOR_EXTENSIONS, msg
+    
+    if extension == '.shp':
+        projection_filename = os.path.join(subdir,  layername) + '.prj'                     
+        try:
+            fid = open(projection_filename)
+        except:
+            msg = 'Could not open projection file %s' % projection_filename
+            raise Exception(msg)
+        else:
+            fid.close()
+    
+        # Zip shapefile and auxiliary files 
+        return zip_shapefile(filename)
+    else:
+        # Already zipped - FIXME: Need to test if it is indeed a zipped shape file
+        return open(filename, 'rb')
+        
+        
+def prepare_style(filename):
+    """Get style file in the working directory for layer uploaded from file
+    
+    A style file accompanying the data file is used if present. Otherwise a style 
+    is generated for rasters (FIXME: Not yet implemented for vector data).
+    
+    Returns
+        name of style file to upload or None if the layer keeps its native styling.
+        GeoTIFFs rely on their native styling (FIXME: Rethink semantics of all this).
+    """
+    
+    pathname, extension = os.path.splitext(filename)
+    style_filename = get_layer_name(filename) + '.sld'
+    provided_style_filename = pathname + '.sld'
+    
+    if os.path.isfile(provided_style_filename):
+        # Copy provided file to local directory because the REST interface
+        # spits the dummy with pathnames.
+        copy_to_cwd(provided_style_filename)
+    elif get_layer_type(filename) == 'coverage':
+        # Automatically create new style file for raster file
+        write_raster_sld(filename)
+    else:
+        return None
+        
+    if extension == '.tif':
+        return None
+        
+    return style_filename
+    
+    
+def write_memory_raster_sld(data, layername):
+    """Write style for raster held in memory as string and return the name of the style file
+    """
+    
+    R = raster.MemoryRaster(data, layername)
+    write_raster_sld(R.filename)
+    
+    return layername + '.sld'
+    
+    
+def get_workspace_xml(name):
+    """Get body of request creating workspace
+    """
+    
+    return '<workspace><name>%s</name></workspace>' % name
+    
+    
+def get_style_xml(style_name, style_file):
+    """Get body of request creating style
+    """
+    
+    return '<style><name>%s</name><filename>%s</filename></style>' % (style_name, style_file)
+    
+    
+def get_default_style_xml(style_name):
+    """Get body of request making style the default of a layer
+    """
+    
+    return '<layer><defaultStyle><name>%s</name></defaultStyle><enabled>true</enabled></layer>' % style_name
+    
+    
+def check_existing(e, kind, name):
+    """Accept error e from creating resource if the resource already exists, otherwise raise exception
+    """
+    
+    if str(e).find('already exists') < 0:
+        msg = 'Could not create %s %s: %s' % (kind, name, e)
+        raise Exception(msg)
+        
+        
+def get_error_message(e):
+    """Get message reported for exception in per layer results
+    """
+    
+    return '%s: %s' % (e.__class__.__name__, e)
+    
+    
+def invalidate_layer(geoserver_url, workspace, layername):
+    """Forget cached metadata and coverages of layer after it was uploaded or deleted
+    """
+    
+    wcs_url = os.path.join(geoserver_url, 'wcs')
+    wcs_metadata.cache.invalidate(wcs_url, '%s:%s' % (workspace, layername))
+    coverage_cache.cache.invalidate(wcs_url, '%s:%s' % (workspace, layername))
+    
+    
+def parse_names(body, kind):
+    """Get names of resources in JSON listing of REST resource
+    
+    Arguments
+        body = JSON document
+        kind = kind of resources in the listing, e.g. 'coverageStore'
+    """
+    
+    # Empty listings are given as empty strings and single resources may not be in a list
+    d = json.loads(body).get(kind + 's') or {}
+    resources = d.get(kind) or []
+    if isinstance(resources, dict):
+        resources = [resources]
+        
+    return [resource['name'] for resource in resources]
+    
+    
+def get_read_plan(c, bounding_box, format, chunk_cells):
+    """Work out how to read bounding box of coverage using the coverage cache
+    
+    Arguments
+        c = Coverage object of layer
+        bounding_box = requested bounding box or None for the whole layer
+        format = format requested from the server
+        chunk_cells = maximal number of cells of a GeoTIFF download (0 disables splitting)
+        
+    Returns
+        hash with fields
+            'data': cached coverage or None if it must be assembled
+            'key': key of the coverage in the cache
+            'bounding_box': bounding box snapped to the layer grid
+            'resolution': resx, resy
+            'overlapping': list of (bounding box, string) of cached coverages to cut it from
+            'parts': bounding boxes to download
+    """
+    
+    if bounding_box is None:
+        bounding_box = c.bbox
+        
+    resolution = (float(c.resx), float(c.resy))
+    bounding_box = mosaic.snap_bounding_box(bounding_box, c.bbox, resolution)
+        
+    key = coverage_cache.cache.get_key(c.base_url, '%s:%s' % (c.workspace, c.layername),
+                                       bounding_box, resolution, format)
+    plan = {'data': coverage_cache.cache.get(key),
+            'key': key,
+            'bounding_box': bounding_box,
+            'resolution': resolution,
+            'overlapping': [],
+            'parts': []}
+    if plan['data'] is not None:
+        return plan
+        
+    overlapping = []
+    if format.lower() == 'geotiff':
+        overlapping = coverage_cache.cache.get_overlapping(key)
+        
+    missing = mosaic.get_uncovered_parts(bounding_box, [b for b, _ in overlapping], resolution)
+    if len(missing) > mosaic.MAX_PARTS:
+        overlapping = []
+        missing = [bounding_box]
+        
+    # Split large downloads into chunks on the layer grid
+    parts = missing
+    if format.lower() == 'geotiff' and chunk_cells > 0:
+        parts = []
+        for part in missing:
+            parts += mosaic.split_bounding_box(part, resolution, chunk_cells)
+            
+    plan['overlapping'] = overlapping
+    plan['parts'] = parts
+    return plan
+    
+    
+def assemble_coverage(plan, downloads):
+    """Assemble and cache coverage planned by get_read_plan from the downloaded parts
+    
+    Returns
+        string with coverage
+    """
+    
+    if not plan['overlapping'] and len(downloads) == 1:
+        data = downloads[0]
+    else:
+        pieces = [d for _, d in plan['overlapping']] + downloads
+        data = mosaic.mosaic_coverages(plan['bounding_box'], plan['resolution'], pieces)
+        
+    coverage_cache.cache.put(plan['key'], data)
+    return data
+    
+    
+def get_remaining_layers(layers, stores):
+    """Count layers which are not removed with the given stores
+    
+    Arguments
+        layers = names of all layers on the server, with or without workspace prefix
+        stores = list of (workspace, store type, store) to be deleted
+        
+    Returns
+        hash of layer name (without workspace) -> number of layers of that name remaining
+        
+    Note
+        Each store is taken to hold one layer named after it, as for stores uploaded through this API.
+    """
+    
+    remaining = {}
+    for layer in layers:
+        name = layer.split(':')[-1]
+        remaining[name] = remaining.get(name, 0) + 1
+        
+    for _, _, store in stores:
+        if remaining.get(store, 0) > 0:
+            remaining[store] -= 1
+            
+    return remaining
+    
+    
+def get_orphaned_styles(results, styles, remaining):
+    """Get results of deleted layers whose style is no longer used
+    
+    Arguments
+        results = hashes returned for deleted stores by delete_all_layers
+        styles = names of styles on the server
+        remaining = hash of layer name -> number of layers of that name kept elsewhere
+        
+    Returns
+        list with one result per style to remove
+    """
+    
+    # Layers that could not be deleted still use their styles
+    failed = set([result['layer'].split(':')[1] for result in results if result['error'] is not None])
+    
+    orphans = {}
+    for result in results:
+        style = result['layer'].split(':')[1]
+        if result['error'] is None and style in styles and style not in failed and \
+               not remaining.get(style):
+            orphans.setdefault(style, result)
+            
+    return orphans.values()
+    
+    
+def write_raster_sld(filename, quantiles=False):
+    """Write style file named after raster file with a colour map of its values
+    
+    The style is written to the working directory using the template in sld_template.py.
+    If quantiles is True, 10 quantiles will be used for colour coding. Othewise 10 equidistant intervals will be used.
+    """
+
+    pathname, extension = os.path.splitext(filename)
+    layername = os.path.basename(pathname)
+    
+    R = raster.read_coverage(filename)
+    levels = R.get_bins(N=10, quantiles=quantiles)
+    nodata = R.get_nodata_value()         
+
+
+    #if verbose:
+    #    print 'Styling %s' %layername        
+    #    print 'Levels', levels
+    #    print 'NoData', nodata    
+    
+    # Write the SLD file    
+    sld = layername+'.sld'
+    text = sld_template.sld_template
+
+    text = text.replace('MIN',str(levels[0]))
+    text = text.replace('MAX',str(levels[-1]))
+    text = text.replace('TEN',str(levels[1]))
+    text = text.replace('TWENTY',str(levels[2]))
+    text = text.replace('THIRTY',str(levels[3]))
+    text = text.replace('FOURTY',str(levels[4]))
+    text = text.replace('FIFTY',str(levels[5]))
+    text = text.replace('SIXTY',str(levels[6]))
+    text = text.replace('SEVENTY',str(levels[7]))
+    text = text.replace('EIGHTY',str(levels[8]))
+    text = text.replace('NINETY',str(levels[9]))
+
+
+    # Getting round an sld parsing bug in geoserver
+    if nodata >= max:
+        text = text.replace('<!--Higher-->', '<ColorMapEntry color="#ffffff" quantity="NODATA" opacity="0"/>')
+    else:   
+        text = text.replace('<!--Lower-->', '<ColorMapEntry color="#ffffff" quantity="NODATA" opacity="0"/>')
+        
+    text = text.replace('NODATA', str(nodata))
+    fout = open(sld, 'w')
+    fout.write(text)
+    fout.close()
+
+
+def convert_to_ascii(filename, verbose=False):
+    """Convert raster file to ESRI ASCII file of the same name and return its name
+    """
+
+    # Convert downloaded data to ASCII (without FORCE_CELLSIZE we get a warning suggesting this option)
+    basename, _ = os.path.splitext(filename)
+    ascii_filename = basename + '.asc'   
+    cmd = 'gdal_translate -ot Float64 -of AAIGrid -co "FORCE_CELLSIZE=TRUE" -a_nodata -9999 %s %s' % (filename, ascii_filename)
+    
+    if verbose:
+        run(cmd, verbose=verbose)
+    else:
+        run(cmd, stdout='/dev/null', stderr='/dev/null', verbose=verbose)
+    
+    return ascii_filename
+
+
+_geoservers = {}
+_geoservers_lock = threading.Lock()
+
+def get_geoserver(geoserver_url, geoserver_username, geoserver_userpass, ttl=VERIFICATION_TTL,
+                  catalog_ttl=None):
+    """Get shared connection to geoserver
+    
+    Connections are kept per (url, username) and verified when created. They are 
+    verified again only if the last verification is older than ttl seconds or if
+    a request has since failed to reach the server.
+    
+    If catalog_ttl is given, it sets the number of seconds for which catalog
+    lookups (e.g. existence of workspaces) of this geoserver are cached.
+    """
+    
+    key = (geoserver_url.rstrip('/'), geoserver_username)
+    
+    _geoservers_lock.acquire()
+    try:
+        gs = _geoservers.get(key)
+    finally:
+        _geoservers_lock.release()
+        
+    if gs is None or gs.geoserver_userpass != geoserver_userpass:
+        gs = Geoserver(geoserver_url, geoserver_username, geoserver_userpass)
+        
+        _geoservers_lock.acquire()
+        try:
+            _geoservers[key] = gs
+        finally:
+            _geoservers_lock.release()
+    elif time.time() - gs.verified > ttl or not gs.client.healthy:
+        gs.verify()
+        
+    if catalog_ttl is not None:
+        gs.catalog.ttl = catalog_ttl
+        
+    return gs
@@ -0,0 +1,215 @@
+"""Assembly of coverages from pieces on a common grid
+
+Coverages are requested with bounding boxes snapped to the native grid
+of the layer. Rasters of the same layer and resolution then share one
+grid, so a request can be cut out of larger cached rasters and only the
+parts not covered by any of them need to be downloaded.
+
+Bounding boxes are [minx, miny, maxx, maxy] in WGS84.
+"""
+
+import uuid
+import numpy
+from osgeo import gdal
+
+from raster import MemoryRaster, RasterWriter, read_memory_file
+
+
+# Maximal number of uncovered parts downloaded separately before the whole request is downloaded
+MAX_PARTS = 8
+
+
+def snap_bounding_box(bounding_box, layer_bounding_box, resolution):
+    """Grow bounding box to the nearest cell boundaries of the layer grid
+
+    Arguments
+        bounding_box = requested bounding box
+        layer_bounding_box = bounding box of the whole layer. Its upper left corner is the grid origin.
+        resolution = resx, resy (both positive)
+
+    Returns
+        bounding box whose edges are cell boundaries of the layer grid
+    """
+
+    resx, resy = resolution
+    x0 = layer_bounding_box[0]
+    y0 = layer_bounding_box[3]
+
+    # Tolerate round off in the requested coordinates
+    eps = 1.0e-6
+
+    minx = x0 + numpy.floor((bounding_box[0] - x0)/resx + eps)*resx
+    maxx = x0 + numpy.ceil((bounding_box[2] - x0)/resx - eps)*resx
+    miny = y0 - numpy.ceil((y0 - bounding_box[1])/resy - eps)*resy
+    maxy = y0 - numpy.floor((y0 - bounding_box[3])/resy + eps)*resy
+
+    return [float(minx), float(miny), float(maxx), float(maxy)]
+
+
+def get_intersection(a, b):
+    """Get intersection of two bounding boxes or None if they do not overlap
+    """
+
+    minx = max(a[0], b[0])
+    miny = max(a[1], b[1])
+    maxx = min(a[2], b[2])
+    maxy = min(a[3], b[3])
+
+    if minx >= maxx or miny >= maxy:
+        return None
+
+    return [minx, miny, maxx, maxy]
+
+
+def subtract_bounding_box(a, b):
+    """Get parts of bounding box a not covered by bounding box b
+
+    Returns
+        list of at most four non-overlapping bounding boxes
+    """
+
+    c = get_intersection(a, b)
+    if c is None:
+        return [a]
+
+    parts = []
+    if c[3] < a[3]:
+        parts.append([a[0], c[3], a[2], a[3]])    # North strip
+    if a[1] < c[1]:
+        parts.append([a[0], a[1], a[2], c[1]])    # South strip
+    if a[0] < c[0]:
+        parts.append([a[0], c[1], c[0], c[3]])    # West strip
+    if c[2] < a[2]:
+        parts.append([c[2], c[1], a[2], c[3]])    # East strip
+
+    return parts
+
+
+def get_uncovered_parts(bounding_box, covered_bounding_boxes, resolution):
+    """Get parts of bounding box not covered by any of the given bounding boxes
+
+    Parts narrower than half a cell are due to round off and ignored.
+    """
+
+    resx, resy = resolution
+
+    parts = [bounding_box]
+    for covered in covered_bounding_boxes:
+        remaining = []
+        for part in parts:
+            for p in subtract_bounding_box(part, covered):
+                if p[2] - p[0] > resx/2 and p[3] - p[1] > resy/2:
+                    remaining.append(p)
+        parts = remaining
+
+    return parts
+
+
+def split_bounding_box(bounding_box, resolution, max_cells):
+    """Split bounding box into chunks of whole cells
+
+    Arguments
+        bounding_box = bounding box snapped to the grid
+        resolution = resx, resy
+        max_cells = maximal number of cells in a chunk
+
+    Returns
+        list of bounding boxes of square chunks (clipped at the edges) in row major order
+    """
+
+    resx, resy = resolution
+    minx, miny, maxx, maxy = bounding_box
+    nrows = int(round((maxy - miny)/resy))
+    ncols = int(round((maxx - minx)/resx))
+
+    size = max(1, int(numpy.sqrt(max_cells)))
+
+    chunks = []
+    for row in range(0, nrows, size):
+        for col in range(0, ncols, size):
+            # Outer edges are taken from bounding box to avoid round off
+            chunk_maxy = maxy - row*resy
+            chunk_miny = miny if row + size >= nrows else maxy - (row + size)*resy
+            chunk_minx = minx + col*resx
+            chunk_maxx = maxx if col + size >= ncols else minx + (col + size)*resx
+            chunks.append([chunk_minx, chunk_miny, chunk_maxx, chunk_maxy])
+
+    return chunks
+
+
+def mosaic_coverages(bounding_box, resolution, pieces):
+    """Assemble GeoTIFF covering bounding box from pieces on the same grid
+
+    Arguments
+        bounding_box = bounding box of the result, snapped to the grid
+        resolution = resx, resy
+        pieces = list of strings with rasters in any format readable by GDAL
+
+    Returns
+        string with GeoTIFF in the data type of the first piece.
+        Cells not covered by any piece are NODATA.
+    """
+
+    resx, resy = resolution
+    minx, miny, maxx, maxy = bounding_box
+    nrows = int(round((maxy - miny)/resy))
+    ncols = int(round((maxx - minx)/resx))
+
+    rasters = [MemoryRaster(data, 'piece') for data in pieces]
+    nodata_value = rasters[0].get_nodata_value()
+
+    # Window of result covered by each piece as (raster, row, col, r0, c0, r1, c1)
+    windows = []
+    for R in rasters:
+        geotransform = R.get_geotransform()
+        piece_rows, piece_cols = R.get_shape()
+
+        # Position of piece in result
+        row = int(round((maxy - geotransform[3])/resy))
+        col = int(round((geotransform[0] - minx)/resx))
+
+        # Clip to result
+        r0 = max(0, row)
+        c0 = max(0, col)
+        r1 = min(nrows, row + piece_rows)
+        c1 = min(ncols, col + piece_cols)
+        if r0 >= r1 or c0 >= c1:
+            continue
+
+        if (r0, c0, r1, c1) == (0, 0, nrows, ncols):
+            # One piece contains the result, so it is read as a single window
+            windows = [(R, row, col, r0, c0, r1, c1)]
+            break
+
+        windows.append((R, row, col, r0, c0, r1, c1))
+
+    # Cells not covered by any piece
+    covered = [[minx + c0*resx, maxy - r1*resy, minx + c1*resx, maxy - r0*resy]
+               for _, _, _, r0, c0, r1, c1 in windows]
+    uncovered = get_uncovered_parts(bounding_box, covered, resolution)
+
+    filename = '/vsimem/riab_%s/mosaic.tif' % uuid.uuid4().hex
+    writer = RasterWriter(filename, nrows, ncols,
+                          (minx, resx, 0, maxy, 0, -resy),
+                          rasters[0].get_projection(),
+                          nodata_value,
+                          rasters[0].get_data_type())
+    try:
+        for part in uncovered:
+            r0 = int(round((maxy - part[3])/resy))
+            r1 = int(round((maxy - part[1])/resy))
+            c0 = int(round((part[0] - minx)/resx))
+            c1 = int(round((part[2] - minx)/resx))
+            writer.write_block(numpy.ones((r1 - r0, c1 - c0))*nodata_value, r0, c0)
+
+        for R, row, col, r0, c0, r1, c1 in windows:
+            A = R.get_block(r0 - row, c0 - col, r1 - r0, c1 - c0)
+            writer.write_block(A, r0, c0)
+
+        writer.close()
+        writer = None
+
+        return read_memory_file(filename)
+    finally:
+        writer = None
+        gdal.Unlink(filename)
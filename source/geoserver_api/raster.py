@@ -2,6 +2,7 @@
 """
 
 import os 
+import uuid
 import numpy
 
 from osgeo import gdal
@@ -38,8 +39,19 @@ class Raster:
         self.name = coveragename
         self.band = band
 
-        # Backwards compatibility - remove
-        self.data = self.get_data(nan=True)
+
+    def __getattr__(self, name):
+        """Read the data attribute on first access only
+        
+        This keeps memory bounded for clients that only read blocks.
+        """
+        
+        if name == 'data':
+            # Backwards compatibility - remove
+            self.data = self.get_data(nan=True)
+            return self.data
+            
+        raise AttributeError(name)
 
 
     def get_data(self, nan=False):
@@ -58,8 +70,52 @@ class Raster:
          
         return A
             
+            
+    def get_block(self, row, col, nrows, ncols, out=None):
+        """Get window of raster data as numeric array
+        
+        Arguments
+            row, col = index of upper left cell of window
+            nrows, ncols = size of window
+            out = optional preallocated array of shape (nrows, ncols) to read into
+            
+        Returns
+            Array of shape (nrows, ncols). NODATA values are returned as they are.
+        """
+        
+        if out is None:
+            return self.band.ReadAsArray(col, row, ncols, nrows)
+        
+        return self.band.ReadAsArray(col, row, ncols, nrows, buf_obj=out)
+        
+        
+    def get_shape(self):
+        """Get number of rows and columns
+        """
+        
+        return self.fid.RasterYSize, self.fid.RasterXSize
+        
+        
+    def get_geotransform(self):
+        """Get geotransform (top left x, w-e resolution, 0, top left y, 0, n-s resolution)
+        """
+        
+        return self.fid.GetGeoTransform()
+        
+        
+    def get_projection(self):
+        """Get projection as WKT
+        """
+        
+        return self.fid.GetProjection()
         
         
+    def get_data_type(self):
+        """Get GDAL data type of band (e.g. gdal.GDT_Float32)
+        """
+        
+        return self.band.DataType
+        
 
     def __mul__(self, other):
         return self.data * other.data
@@ -141,6 +197,48 @@ class Raster:
         return levels    
          
 
+class MemoryRaster(Raster):
+    """Raster read from an in-memory buffer through GDAL's virtual file system
+    
+    Nothing is written to disk. The buffer is released when the object is deleted.
+    """
+    
+    def __init__(self, data, name, nodata_value=-9999):
+        """Create raster from data in any format readable by GDAL (e.g. GeoTIFF)
+        
+        Arguments
+            data = string with the content of the file
+            name = name of the raster
+            nodata_value = NODATA value used if data does not define one
+        """
+        
+        filename = get_memory_filename(name)
+        gdal.FileFromMemBuffer(filename, data)
+        self.memory_filename = filename
+        
+        # Record NODATA value in the buffer so that rasters reopened from it agree
+        fid = gdal.Open(filename, gdal.GA_Update)
+        if fid is None:
+            msg = 'Could not read raster %s from memory buffer' % name
+            raise Exception(msg)
+        
+        band = fid.GetRasterBand(1)
+        if band.GetNoDataValue() is None:
+            band.SetNoDataValue(nodata_value)
+            band.FlushCache()
+        band = fid = None
+        
+        Raster.__init__(self, filename)
+        
+        
+    def __del__(self):
+        # Close dataset before its buffer is released
+        self.__dict__.pop('band', None)
+        self.__dict__.pop('fid', None)
+        if 'memory_filename' in self.__dict__:
+            remove_memory_file(self.memory_filename)
+        
+        
 # FIXME: Here's how to get metadata out
 # See http://www.gdal.org/gdal_tutorial.html
 
@@ -203,6 +301,38 @@ class Raster:
 
         
             
+def get_memory_filename(name):
+    """Get unique name of GeoTIFF in GDAL's virtual file system (/vsimem)
+    """
+
+    return '/vsimem/riab_%s/%s.tif' % (uuid.uuid4().hex, name)
+
+
+def remove_memory_file(filename):
+    """Release file in GDAL's virtual file system
+    """
+
+    gdal.Unlink(filename)
+
+
+def read_memory_file(filename):
+    """Get content of file in GDAL's virtual file system as string
+    """
+
+    fid = gdal.VSIFOpenL(filename, 'rb')
+    if fid is None:
+        msg = 'Could not open %s' % filename
+        raise Exception(msg)
+
+    try:
+        gdal.VSIFSeekL(fid, 0, 2)
+        size = gdal.VSIFTellL(fid)
+        gdal.VSIFSeekL(fid, 0, 0)
+        return gdal.VSIFReadL(1, size, fid)
+    finally:
+        gdal.VSIFCloseL(fid)
+
+
 def read_coverage(filename, verbose=False):
     """Read coverage from file and return Coverage object
     All gdal formats are supported.
@@ -249,6 +379,73 @@ def write_coverage_to_ascii(A, filename, xllcorner, yllcorner,
     fid.close()
     
     
+
+class RasterWriter:
+    """Block-wise writer for single band GeoTIFF rasters
+    
+    Blocks can be written in any order so output never has to be held in memory as a whole.
+    """
+    
+    def __init__(self, filename, nrows, ncols, geotransform, projection, nodata_value=-9999,
+                 data_type=None):
+        """Create GeoTIFF of given GDAL data type (default gdal.GDT_Float64)
+        """
+        
+        if data_type is None:
+            data_type = gdal.GDT_Float64
+            
+        driver = gdal.GetDriverByName('GTiff')
+        fid = driver.Create(filename, ncols, nrows, 1, data_type, ['PROFILE=GEOTIFF'])
+        if fid is None:
+            msg = 'Could not create file %s' % filename
+            raise Exception(msg)
+            
+        fid.SetGeoTransform(geotransform)
+        fid.SetProjection(projection)
+        
+        band = fid.GetRasterBand(1)
+        band.SetNoDataValue(nodata_value)
+        
+        self.fid = fid
+        self.filename = filename
+        self.band = band
+        self.nodata_value = nodata_value
+        
+        
+    def write_block(self, A, row, col):
+        """Write array A with upper left cell at (row, col)
+        """
+        
+        self.band.WriteArray(A, col, row)
+        
+        
+    def close(self):
+        """Flush data to disk and close file
+        """
+        
+        self.band.FlushCache()
+        self.band = None
+        self.fid = None
+        
+        
+class RasterUpdater(RasterWriter):
+    """Block-wise writer patching an existing single band raster in place
+    """
+    
+    def __init__(self, filename):
+    
+        fid = gdal.Open(filename, gdal.GA_Update)
+        if fid is None:
+            msg = 'Could not open file %s for update' % filename
+            raise Exception(msg)
+            
+        band = fid.GetRasterBand(1)
+        
+        self.fid = fid
+        self.filename = filename
+        self.band = band
+        self.nodata_value = band.GetNoDataValue()
+        
       
 # Code based directly on ASCII files - used for testing of GDAL floating point precision   
     
@@ -0,0 +1,436 @@
+"""In-process HTTP client for the Geoserver REST API
+
+Requests are made over persistent (keep-alive) connections held in a
+pool per Geoserver, so consecutive calls avoid process creation and
+new TCP connections. Response bodies are kept in memory and HTTP
+status codes are checked directly.
+
+The module functions formatting requests and interpreting responses
+do no I/O, so the event loop client (see async_geoserver.py) speaks
+HTTP through them too.
+"""
+
+import os
+import base64
+import httplib
+import socket
+import threading
+import urlparse
+
+
+# Default maximal number of idle connections kept per Geoserver
+MAX_IDLE_CONNECTIONS = 4
+
+# Default socket timeout (seconds)
+TIMEOUT = 300
+
+# Methods that can be repeated safely if a reused connection turns out to be closed
+IDEMPOTENT_METHODS = ['GET', 'HEAD', 'DELETE', 'OPTIONS']
+
+
+class HTTPError(Exception):
+    """Error response from the server
+
+    The message contains the request, the status and the body of the
+    response so that callers can check for conditions such as 'already exists'.
+    """
+
+    def __init__(self, method, url, status, reason, body):
+
+        self.method = method
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+        msg = 'Request %s %s failed with HTTP status %i (%s): %s' % (method, url, status,
+                                                                     reason, body)
+        Exception.__init__(self, msg)
+
+
+def check_status(method, url, status, reason, body):
+    """Raise HTTPError if status is an error status (400 and above)
+    """
+
+    if status >= 400:
+        raise HTTPError(method, url, status, reason, body)
+
+
+def can_retry(method, reused):
+    """Check whether a request that failed without response may be sent again on a new connection
+
+    Only requests on reused connections, which the server may have closed while
+    they were idle, are repeated. Uploads may have been applied before the
+    connection failed, so only idempotent methods are repeated.
+    """
+
+    return reused and method in IDEMPOTENT_METHODS
+
+
+def encode_body(body):
+    """Get body as it is sent. Unicode (e.g. names from JSON listings) is sent as UTF-8.
+    """
+
+    if isinstance(body, unicode):
+        return body.encode('utf-8')
+
+    return body
+
+
+def get_address(url):
+    """Get (scheme, host, port) of server at URL. Connections are pooled per address.
+    """
+
+    url = urlparse.urlparse(url)
+    port = url.port
+    if port is None:
+        port = 443 if url.scheme == 'https' else 80
+
+    return url.scheme, url.hostname, port
+
+
+def get_request_path(url):
+    """Get path and query of URL as sent in the request line
+    """
+
+    url = urlparse.urlparse(url)
+    path = url.path or '/'
+    if url.query:
+        path += '?' + url.query
+
+    return path
+
+
+def format_request_head(method, path, address, body, headers):
+    """Get request line and headers of HTTP/1.1 request
+
+    Host and Content-Length headers are added.
+    """
+
+    scheme, host, port = address
+
+    headers = dict(headers)
+    headers['Host'] = host if port in [80, 443] else '%s:%i' % (host, port)
+    length = get_content_length(method, body)
+    if length is not None:
+        headers['Content-Length'] = length
+
+    lines = ['%s %s HTTP/1.1' % (method, path)]
+    lines += ['%s: %s' % (name, value) for name, value in headers.items()]
+
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+
+
+def parse_status_line(line):
+    """Get version, status and reason from status line of response
+
+    An empty line means that the server closed the connection and raises EOFError.
+    """
+
+    if not line:
+        raise EOFError('Connection closed by server')
+
+    fields = line.rstrip('\r\n').split(' ', 2)
+    if len(fields) > 2:
+        reason = fields[2]
+    else:
+        reason = ''
+
+    return fields[0], int(fields[1]), reason
+
+
+def parse_header(line, headers):
+    """Add header line of response to hash of headers with lower case names
+
+    Returns False for the empty line ending the headers, otherwise True.
+    """
+
+    line = line.rstrip('\r\n')
+    if not line:
+        return False
+
+    name, value = line.split(':', 1)
+    headers[name.strip().lower()] = value.strip()
+    return True
+
+
+def get_will_close(version, headers):
+    """Check whether server closes the connection after the response
+    """
+
+    connection = headers.get('connection', '').lower()
+    return connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive')
+
+
+def get_body_length(method, status, headers):
+    """Get length of response body from status and headers
+
+    Returns
+        number of bytes, 'chunked' for chunked transfer encoding or None
+        if the body ends when the server closes the connection.
+    """
+
+    if method == 'HEAD' or status in [204, 304] or 100 <= status < 200:
+        return 0
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        return 'chunked'
+    if 'content-length' in headers:
+        return int(headers['content-length'])
+
+    return None
+
+
+def parse_chunk_size(line):
+    """Get size of chunk from chunk header line of chunked response body
+    """
+
+    return int(line.split(';')[0].strip(), 16)
+
+
+def get_content_length(method, body):
+    """Get value of Content-Length header for body or None if it is not needed
+
+    Files are declared with their size so that they can be streamed.
+    """
+
+    if hasattr(body, 'read'):
+        return str(os.fstat(body.fileno()).st_size)
+    elif body is not None:
+        return str(len(body))
+    elif method in ['PUT', 'POST']:
+        return '0'
+
+    return None
+
+
+class RestClient:
+    """Client for the REST API of one Geoserver
+
+    It is safe to use from several threads. Each request uses a connection
+    of its own taken from the pool of idle connections (or a new one).
+    """
+
+    def __init__(self, geoserver_url, username, password,
+                 max_idle_connections=MAX_IDLE_CONNECTIONS, timeout=TIMEOUT):
+
+        url = urlparse.urlparse(geoserver_url)
+        if not url.scheme:
+            # Allow URLs like localhost:8080/geoserver
+            url = urlparse.urlparse('http://' + geoserver_url)
+
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.base_path = url.path.rstrip('/')
+
+        self.authorization = 'Basic ' + base64.b64encode('%s:%s' % (username, password))
+
+        self.max_idle_connections = max_idle_connections
+        self.timeout = timeout
+
+        self.address = get_address('%s://%s' % (self.scheme, self.get_netloc()))
+
+        # Address -> list of idle connections
+        self.idle_connections = {}
+        self.lock = threading.Lock()
+
+        # False if the last request failed to get a response from the server
+        self.healthy = True
+
+
+    def get_path(self, rest_dir):
+        """Get path of REST resource relative to the server
+        """
+
+        path = self.base_path + '/rest'
+        if rest_dir:
+            path += '/' + rest_dir.lstrip('/')
+        return path
+
+
+    def get_url(self, rest_dir):
+        """Get URL of REST resource
+        """
+
+        return '%s://%s%s' % (self.scheme, self.get_netloc(), self.get_path(rest_dir))
+
+
+    def get_headers(self, content_type=None, headers=None):
+        """Get headers of request with given content type and additional headers
+        """
+
+        all_headers = {'Authorization': self.authorization,
+                       'Accept': '*/*'}
+        if content_type:
+            all_headers['Content-type'] = content_type
+        if headers:
+            all_headers.update(headers)
+
+        return all_headers
+
+
+    def request(self, method, rest_dir, body=None, content_type=None, headers=None):
+        """Make request to REST resource and return status and body of the response
+
+        Arguments
+            method = HTTP method (e.g. 'GET', 'PUT', 'POST' or 'DELETE')
+            rest_dir = resource below the REST endpoint, e.g. 'workspaces/hazard'
+            body = string or open file to be sent. Files are streamed from disk.
+            content_type = value of Content-type header
+            headers = hash of additional headers
+
+        Returns
+            status, body
+
+        Raises HTTPError if the server responds with an error status (400 and above).
+        """
+
+        body = encode_body(body)
+        all_headers = self.get_headers(content_type, headers)
+
+        length = get_content_length(method, body)
+        if length is not None:
+            all_headers['Content-Length'] = length
+
+        path = self.get_path(rest_dir)
+        connection, reused = self._get_connection()
+        try:
+            try:
+                response = self._send(connection, method, path, body, all_headers)
+            except (httplib.HTTPException, socket.error):
+                if not can_retry(method, reused):
+                    raise
+
+                # Server closed the idle connection. Retry once on a new one.
+                connection.close()
+                connection = self._new_connection()
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+                response = self._send(connection, method, path, body, all_headers)
+
+            status = response.status
+            reason = response.reason
+            data = response.read()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            self.healthy = False
+            raise
+        except:
+            connection.close()
+            raise
+
+        self.healthy = True
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release_connection(connection)
+
+        check_status(method, self.get_url(rest_dir), status, reason, data)
+
+        return status, data
+
+
+    def get_netloc(self):
+        if self.port:
+            return '%s:%i' % (self.host, self.port)
+        return self.host
+
+
+    def close(self):
+        """Close all idle connections
+        """
+
+        self.lock.acquire()
+        try:
+            connections = self.idle_connections
+            self.idle_connections = {}
+        finally:
+            self.lock.release()
+
+        for idle in connections.values():
+            for connection in idle:
+                self._close_connection(connection)
+
+
+    def _send(self, connection, method, path, body, headers):
+        connection.request(method, path, body, headers)
+        return connection.getresponse()
+
+
+    def _new_connection(self):
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+
+    def _close_connection(self, connection):
+        connection.close()
+
+
+    def _get_connection(self):
+        """Get idle connection from the pool or a new one
+
+        Returns
+            connection, True if it was reused
+        """
+
+        connection = self._take_idle_connection(self.address)
+        if connection is not None:
+            return connection, True
+
+        return self._new_connection(), False
+
+
+    def _release_connection(self, connection, address=None):
+        """Return connection to the pool of idle connections to address (by default the geoserver)
+
+        The connection is closed if the pool is full.
+        """
+
+        if address is None:
+            address = self.address
+
+        self.lock.acquire()
+        try:
+            idle = self.idle_connections.setdefault(address, [])
+            if len(idle) < self.max_idle_connections:
+                idle.append(connection)
+                return
+        finally:
+            self.lock.release()
+
+        self._close_connection(connection)
+
+
+    def _take_idle_connection(self, address):
+        """Remove idle connection to address from the pool and return it, or None if there is none
+        """
+
+        self.lock.acquire()
+        try:
+            idle = self.idle_connections.get(address)
+            if idle:
+                return idle.pop()
+        finally:
+            self.lock.release()
+
+        return None
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(geoserver_url, username, password):
+    """Get shared client for Geoserver, creating it on first request
+    """
+
+    key = (geoserver_url.rstrip('/'), username, password)
+
+    _clients_lock.acquire()
+    try:
+        if key not in _clients:
+            _clients[key] = RestClient(geoserver_url, username, password)
+        return _clients[key]
+    finally:
+        _clients_lock.release()
@@ -2,8 +2,12 @@
 """
 
 import os
+import shutil
+import tempfile
+import zipfile
 import urllib, urllib2, osgeo
 from subprocess import Popen, PIPE	
+from rest_client import get_client
 
 
 def run(cmd, 
@@ -94,6 +98,40 @@ def makedir(newdir):
 
     
 
+def zip_shapefile(filename):
+    """Zip shapefile and its auxiliary files into a private temporary file
+    
+    Arguments
+        filename = name of main shapefile (*.shp)
+        
+    Returns
+        open file positioned at the start of the archive. It is deleted when closed.
+    """
+    
+    dirname, basename = os.path.split(filename)
+    layername = os.path.splitext(basename)[0]
+    
+    fid = tempfile.TemporaryFile()
+    archive = zipfile.ZipFile(fid, 'w', zipfile.ZIP_DEFLATED)
+    try:
+        # Auxiliary files share the name of the shapefile, e.g. .shx, .dbf, .prj and .shp.xml
+        for name in sorted(os.listdir(dirname or '.')):
+            if name.startswith(layername + '.'):
+                archive.write(os.path.join(dirname, name), name)
+    finally:
+        archive.close()
+        
+    fid.seek(0)
+    return fid
+    
+    
+def copy_to_cwd(filename):
+    """Copy file to current working directory unless it is already there
+    """
+    
+    if os.path.abspath(os.path.dirname(filename)) != os.getcwd():
+        shutil.copy(filename, os.getcwd())
+        
     	  
 def get_web_page(url, username=None, password=None):
     """Get url page possible with username and password
@@ -106,12 +144,14 @@ def get_web_page(url, username=None, password=None):
         passman.add_password(None, url, username, password)
 
         # create the handler
+        # (not installed globally so that concurrent calls can't interfere)
         authhandler = urllib2.HTTPBasicAuthHandler(passman)
         opener = urllib2.build_opener(authhandler)
-        urllib2.install_opener(opener)
+    else:
+        opener = urllib2.build_opener()
         
     try:
-        pagehandle = urllib2.urlopen(url)
+        pagehandle = opener.open(url)
     except urllib2.URLError, e:
         msg = 'Could not open URL "%s": %s' % (url, e)
         raise urllib2.URLError(msg)
@@ -122,7 +162,7 @@ def get_web_page(url, username=None, password=None):
 
     
 def curl(url, username, password, request, content_type, rest_dir, data_type, data, verbose=False):
-    """Aggregate and issue curl command:
+    """Issue request to the Geoserver REST API equivalent to the curl command
     
     curl -u username:password -X request -H type geoserver_url/rest/rest_dir data_type data
     For example:
@@ -133,47 +173,38 @@ def curl(url, username, password, request, content_type, rest_dir, data_type, da
     
     curl -u admin:geoserver -X PUT -H "image/tif" http://localhost:8080/geoserver/rest/workspaces/futnuh/coveragestores/shakemap_padang_20090930/file.geotiff  --data-binary @./data/shakemap_padang_20090930.tif
     
+    The request is made in-process over a pooled keep-alive connection (see rest_client.py).
+    Data of the form @filename is streamed from the named file.
+    
+    Returns
+        lines of the response body
+        
+    Raises HTTPError (with the response body in its message) if the server responds with an error.
     """
 
-    # Build curl command
-    # FIXME (Ole): Can we use flag -S to get more error messages?
-    
-    # FIXME (Ole): Make content_type an optional keyword arg (e.g. not necessary in case of DELETE).
+    client = get_client(url, username, password)
     
-    cmd = 'curl -u %s:%s' % (username, password)
-    cmd += ' -v' # Always add verbose flag to get error messages
+    if verbose:
+        print '%s %s' % (request, client.get_path(rest_dir))
     
-    cmd += ' -X %s' % request
-    cmd += ' -H "Content-type: %s"' % content_type     
-    cmd += ' "%s"' % os.path.join(url, 'rest', rest_dir)
+    fid = None
+    body = None
     if data_type:
-        cmd += ' %s' % data_type
-        
         assert len(data) > 0
-        cmd += ' "%s"' % data
-
-    curl_stdout = 'curl.stdout'    
-    curl_stderr = 'curl.stderr'
-    run(cmd, stdout=curl_stdout, stderr=curl_stderr, verbose=verbose)
-
-    out = open(curl_stdout).readlines()
-    err = open(curl_stderr).read()
-
-    # FIXME (Ole): Check for other error conditions 
-    
-    if err.find('HTTP/1.1 500') > 0:
-        msg = 'Curl command failed (Internal Server Error): %s, %s' % (cmd, out)        
-        raise Exception(msg)
         
-    if err.find('HTTP/1.1 404') > 0:
-        msg = 'Curl command failed (Not Exist): %s, %s' % (cmd, out)            
-        raise Exception(msg)                
-        
-    if err.find('HTTP/1.1 405') > 0:
-        msg = 'Curl command failed (Method Not Allowed): %s, %s' % (cmd, out)                
-        raise Exception(msg)        
-
-    return out
+        if data_type == '--data-binary' and data.startswith('@'):
+            fid = open(data[1:], 'rb')
+            body = fid
+        else:
+            body = data
+            
+    try:
+        status, out = client.request(request, rest_dir, body, content_type)
+    finally:
+        if fid is not None:
+            fid.close()
+            
+    return out.splitlines(True)
 
 def get_bounding_box(filename, verbose=False):
     """Get bounding box for specified file using gdalinfo
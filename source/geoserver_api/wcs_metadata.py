@@ -0,0 +1,280 @@
+"""Cache of WCS coverage metadata
+
+Downloading a coverage needs its bounding box, CRS, formats and grid
+resolution. They are read from a DescribeCoverage request for the one
+layer, so the cost does not grow with the number of layers published on
+the server. They are also cached per (WCS URL, layer) in memory and in a
+small on-disk store that survives restarts.
+
+Entries are fresh for a limited time (TTL). Stale entries are revalidated
+with a conditional request if the server supplied an ETag or
+Last-Modified header. Otherwise they are fetched again. Entries are
+invalidated when a coverage is uploaded to the layer.
+"""
+
+import os
+import time
+import json
+import hashlib
+import tempfile
+import threading
+import urllib
+import urllib2
+from xml.etree import ElementTree
+
+
+# Default number of seconds for which metadata is used without revalidation
+METADATA_TTL = 600
+
+# Default directory of the on-disk store
+METADATA_DIR = os.path.join(os.path.expanduser('~'), '.riab', 'wcs_metadata')
+
+# XML namespaces of WCS 1.0.0 documents
+WCS_NAMESPACE = '{http://www.opengis.net/wcs}'
+GML_NAMESPACE = '{http://www.opengis.net/gml}'
+
+
+def get_key(wcs_url, layername):
+    """Get cache key of layer, ignoring redundant slashes in the URL
+    """
+
+    head, sep, tail = wcs_url.partition('://')
+    while tail.find('//') >= 0:
+        tail = tail.replace('//', '/')
+
+    return (head + sep + tail).rstrip('/'), layername
+
+
+def get_describe_coverage_url(wcs_url, layername):
+    return wcs_url + '?' + urllib.urlencode([('service', 'WCS'),
+                                             ('version', '1.0.0'),
+                                             ('request', 'DescribeCoverage'),
+                                             ('coverage', layername)])
+
+
+def fetch_url(url, validators=None):
+    """Get document at url, optionally conditional on validators
+
+    Arguments
+        url = URL of document
+        validators = hash with fields 'etag' and 'last_modified' of a previous response
+
+    Returns
+        body, validators of the response. body is None if the server reports
+        that the document has not been modified.
+    """
+
+    request = urllib2.Request(url)
+    if validators:
+        if validators.get('etag'):
+            request.add_header('If-None-Match', validators['etag'])
+        if validators.get('last_modified'):
+            request.add_header('If-Modified-Since', validators['last_modified'])
+
+    try:
+        response = urllib2.urlopen(request)
+    except urllib2.HTTPError, e:
+        if e.code == 304:
+            return None, validators
+        raise
+
+    try:
+        body = response.read()
+    finally:
+        response.close()
+
+    headers = response.info()
+    validators = {'etag': headers.getheader('ETag'),
+                  'last_modified': headers.getheader('Last-Modified')}
+
+    return body, validators
+
+
+def parse_coverage_description(xml, layername):
+    """Get metadata of layer from WCS 1.0.0 DescribeCoverage response
+
+    Only the fields used by Coverage are read.
+
+    Returns
+        hash with fields 'bbox', 'crs', 'formats', 'resx' and 'resy'
+
+    Raises KeyError if the response does not describe the layer.
+    """
+
+    root = ElementTree.fromstring(xml)
+    offering = root.find(WCS_NAMESPACE + 'CoverageOffering')
+    if offering is None:
+        # E.g. ServiceExceptionReport for unknown layers
+        msg = 'Layer %s is not described by WCS response: %s' % (layername, xml[:200])
+        raise KeyError(msg)
+
+    # Bounding box in WGS84 as [minx, miny, maxx, maxy]
+    bbox = []
+    for pos in offering.findall(WCS_NAMESPACE + 'lonLatEnvelope/' + GML_NAMESPACE + 'pos'):
+        bbox += [float(x) for x in pos.text.split()]
+    bbox = [bbox[0], bbox[1], bbox[2], bbox[3]]
+
+    crs = None
+    for tag in ['requestResponseCRSs', 'responseCRSs', 'requestCRSs']:
+        element = offering.find(WCS_NAMESPACE + 'supportedCRSs/' + WCS_NAMESPACE + tag)
+        if element is not None:
+            crs = element.text.split()[0]
+            break
+    if crs is None:
+        # All data we are dealing with should have a CRS
+        crs = 'EPSG:4326'
+
+    formats = [element.text.strip() for element in
+               offering.findall(WCS_NAMESPACE + 'supportedFormats/' + WCS_NAMESPACE + 'formats')]
+
+    offset_vectors = [[float(x) for x in element.text.split()] for element in
+                      offering.iter(GML_NAMESPACE + 'offsetVector')]
+
+    return {'bbox': bbox,
+            'crs': crs,
+            'formats': formats,
+            'resx': offset_vectors[0][0],
+            'resy': abs(offset_vectors[1][1])} # Offset is negative since the grid origin is top-left
+
+
+def fetch_metadata(wcs_url, layername, validators=None):
+    """Fetch metadata of layer from the WCS server
+
+    Returns
+        metadata, validators. metadata is None if the document has not been
+        modified according to validators.
+    """
+
+    xml, validators = fetch_url(get_describe_coverage_url(wcs_url, layername), validators)
+    if xml is None:
+        return None, validators
+
+    return parse_coverage_description(xml, layername), validators
+
+
+class MetadataCache:
+    """Coverage metadata per (WCS URL, layer) held in memory and on disk
+
+    It is safe to use from several threads.
+    """
+
+    def __init__(self, ttl=METADATA_TTL, directory=METADATA_DIR):
+
+        self.ttl = ttl
+        self.directory = directory
+
+        self.entries = {}    # (wcs_url, layername) -> entry hash
+        self.lock = threading.Lock()
+
+
+    def get(self, wcs_url, layername):
+        """Get metadata of layer, fetching or revalidating it as needed
+
+        Returns
+            hash with fields 'bbox', 'crs', 'formats', 'resx' and 'resy'
+        """
+
+        key = get_key(wcs_url, layername)
+
+        entry = self._load(key)
+        if entry is not None and time.time() - entry['time'] <= self.ttl:
+            return entry['metadata']
+
+        if entry is not None and (entry['validators'].get('etag') or
+                                  entry['validators'].get('last_modified')):
+            metadata, validators = fetch_metadata(wcs_url, layername, entry['validators'])
+            if metadata is None:
+                metadata = entry['metadata']
+        else:
+            metadata, validators = fetch_metadata(wcs_url, layername)
+
+        self._store(key, {'time': time.time(),
+                          'validators': validators,
+                          'metadata': metadata})
+        return metadata
+
+
+    def invalidate(self, wcs_url, layername):
+        """Forget metadata of layer, e.g. after uploading new data to it
+        """
+
+        key = get_key(wcs_url, layername)
+
+        self.lock.acquire()
+        try:
+            if key in self.entries:
+                del self.entries[key]
+
+            filename = self._get_filename(key)
+            if filename is not None and os.path.isfile(filename):
+                os.remove(filename)
+        finally:
+            self.lock.release()
+
+
+    def _get_filename(self, key):
+        if not self.directory:
+            return None
+
+        return os.path.join(self.directory, hashlib.md5(repr(key)).hexdigest() + '.json')
+
+
+    def _load(self, key):
+        """Get entry from memory or, failing that, from disk
+        """
+
+        self.lock.acquire()
+        try:
+            if key in self.entries:
+                return self.entries[key]
+
+            filename = self._get_filename(key)
+            if filename is None or not os.path.isfile(filename):
+                return None
+
+            try:
+                fid = open(filename)
+                try:
+                    entry = json.load(fid)
+                finally:
+                    fid.close()
+            except (IOError, ValueError):
+                # Ignore unreadable entries, they will be overwritten
+                return None
+
+            self.entries[key] = entry
+            return entry
+        finally:
+            self.lock.release()
+
+
+    def _store(self, key, entry):
+        """Put entry in memory and on disk
+        """
+
+        self.lock.acquire()
+        try:
+            self.entries[key] = entry
+
+            filename = self._get_filename(key)
+            if filename is None:
+                return
+
+            try:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+
+                # Write to temporary file and rename so readers never see partial entries
+                fid, tmp_filename = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+                os.write(fid, json.dumps(entry))
+                os.close(fid)
+                os.rename(tmp_filename, filename)
+            except (IOError, OSError):
+                # The on-disk store is an optimisation only
+                pass
+        finally:
+            self.lock.release()
+
+
+# Cache used by Coverage
+cache = MetadataCache()
@@ -0,0 +1,308 @@
+"""Alignment and resampling of rasters onto a common grid
+
+Hazard and exposure layers generally differ in resolution and origin.
+For north-up grids the mapping from a source grid to a target grid is
+separable, so it is represented by one index/weight map per axis:
+
+    target[j] = sum_m source[idx[j, m]]*w[j, m]
+
+applied first along rows and then along columns. Supported methods are
+
+    nearest  - value of the source cell containing the target cell centre
+    bilinear - linear interpolation between the source cell centres
+               surrounding the target cell centre
+    sum      - sum of source cells weighted by the fraction of each source
+               cell covered by the target cell. This preserves totals and
+               is the method of choice for aggregating counts like population.
+
+Maps are cached per (source grid, target grid, method) so repeated
+alignments of the same grids pay the setup cost only once.
+"""
+
+import numpy
+import threading
+
+
+methods = ['nearest', 'bilinear', 'sum']
+
+# Maximal number of alignments kept in the cache
+MAX_CACHED_ALIGNMENTS = 32
+
+
+def get_grid(raster):
+    """Get grid of raster as hashable tuple (geotransform, shape)
+    """
+
+    return tuple(raster.get_geotransform()), tuple(raster.get_shape())
+
+
+class AxisMap:
+    """Index and weight map along one axis from source to target cells
+    """
+
+    def __init__(self, idx, w, valid):
+        self.idx = idx        # Source indices (n_target, k)
+        self.w = w            # Weights (n_target, k)
+        self.valid = valid    # Target cells covered by the source (n_target,)
+
+
+    def get_slice(self, start, stop):
+        """Get map for target cells start:stop and the source window it needs
+
+        Returns
+            AxisMap with indices relative to the source window, window start, window size
+        """
+
+        idx = self.idx[start:stop]
+        first = idx.min()
+        last = idx.max()
+
+        axis_map = AxisMap(idx - first, self.w[start:stop], self.valid[start:stop])
+        return axis_map, first, last - first + 1
+
+
+def get_axis_map(source_origin, source_res, source_n,
+                 target_origin, target_res, target_n, method):
+    """Build index and weight map along one axis
+
+    Arguments
+        *_origin = coordinate of the first cell edge
+        *_res = signed cell size (negative for the rows of north-up grids)
+        *_n = number of cells
+        method = one of 'nearest', 'bilinear' or 'sum'
+    """
+
+    j = numpy.arange(target_n, dtype=numpy.float64)
+
+    if method == 'nearest':
+        # Position of target cell centres in source cell units
+        p = (target_origin + (j + 0.5)*target_res - source_origin)/source_res
+        valid = (p >= 0) & (p < source_n)
+
+        idx = numpy.floor(p).clip(0, source_n - 1).astype(numpy.int_).reshape((target_n, 1))
+        w = numpy.ones((target_n, 1))
+
+    elif method == 'bilinear':
+        p = (target_origin + (j + 0.5)*target_res - source_origin)/source_res
+        valid = (p >= 0) & (p < source_n)
+
+        # Position relative to source cell centres
+        q = p - 0.5
+        i0 = numpy.floor(q)
+        f = q - i0
+
+        idx = numpy.zeros((target_n, 2), dtype=numpy.int_)
+        idx[:, 0] = i0.clip(0, source_n - 1)
+        idx[:, 1] = (i0 + 1).clip(0, source_n - 1)
+
+        w = numpy.zeros((target_n, 2))
+        w[:, 0] = 1 - f
+        w[:, 1] = f
+
+    elif method == 'sum':
+        # Target cell edges in source cell units
+        a = (target_origin + j*target_res - source_origin)/source_res
+        b = (target_origin + (j + 1)*target_res - source_origin)/source_res
+        lo = numpy.minimum(a, b).clip(0, source_n)
+        hi = numpy.maximum(a, b).clip(0, source_n)
+
+        first = numpy.floor(lo).astype(numpy.int_).clip(0, source_n - 1)
+        last = (numpy.ceil(hi).astype(numpy.int_) - 1).clip(0, source_n - 1)
+        k = max(1, int(numpy.max(last - first)) + 1)
+
+        idx = numpy.zeros((target_n, k), dtype=numpy.int_)
+        w = numpy.zeros((target_n, k))
+        for m in range(k):
+            i = (first + m).clip(0, source_n - 1)
+
+            # Fraction of source cell i covered by the target cell
+            overlap = numpy.minimum(hi, i + 1) - numpy.maximum(lo, i)
+            overlap = numpy.where(first + m <= last, overlap.clip(0, 1), 0)
+
+            idx[:, m] = i
+            w[:, m] = overlap
+
+        valid = hi > lo
+
+    else:
+        msg = 'Unknown resampling method %s. Valid methods are %s' % (method, methods)
+        raise Exception(msg)
+
+    return AxisMap(idx, w, valid)
+
+
+def apply_axis_map(A, axis_map, axis):
+    """Apply axis map to array A along given axis (0 or 1)
+    """
+
+    if axis == 0:
+        return apply_axis_map(A.T, axis_map, 1).T
+
+    # A[:, idx] has shape (rows, n_target, k)
+    return numpy.sum(A[:, axis_map.idx]*axis_map.w, axis=2)
+
+
+class Alignment:
+    """Separable map from a source grid to a target grid
+    """
+
+    def __init__(self, source_grid, target_grid, method):
+
+        source_geotransform, (source_rows, source_cols) = source_grid
+        target_geotransform, (target_rows, target_cols) = target_grid
+
+        for geotransform in [source_geotransform, target_geotransform]:
+            msg = 'Only north-up grids can be aligned. I got geotransform %s' % str(geotransform)
+            assert geotransform[2] == 0 and geotransform[4] == 0, msg
+
+        self.source_grid = source_grid
+        self.target_grid = target_grid
+        self.method = method
+
+        self.col_map = get_axis_map(source_geotransform[0], source_geotransform[1], source_cols,
+                                    target_geotransform[0], target_geotransform[1], target_cols,
+                                    method)
+        self.row_map = get_axis_map(source_geotransform[3], source_geotransform[5], source_rows,
+                                    target_geotransform[3], target_geotransform[5], target_rows,
+                                    method)
+
+
+    def resample(self, source, row, col, nrows, ncols, nodata_value=None):
+        """Resample window of target grid from source raster
+
+        Arguments
+            source = Raster on the source grid
+            row, col, nrows, ncols = window in the target grid
+            nodata_value = NODATA value of source (None if not set)
+
+        Returns
+            Array of shape (nrows, ncols). Cells without data are NaN.
+        """
+
+        row_map, source_row, source_nrows = self.row_map.get_slice(row, row + nrows)
+        col_map, source_col, source_ncols = self.col_map.get_slice(col, col + ncols)
+
+        A = numpy.array(source.get_block(source_row, source_col, source_nrows, source_ncols),
+                        dtype=numpy.float64)
+
+        # Resample data and data coverage separately so NODATA doesn't spread
+        valid = ~numpy.isnan(A)
+        if nodata_value is not None:
+            valid &= A != nodata_value
+        A[~valid] = 0
+
+        B = apply_axis_map(apply_axis_map(A, col_map, 1), row_map, 0)
+        C = apply_axis_map(apply_axis_map(valid.astype(numpy.float64), col_map, 1), row_map, 0)
+
+        nodata = (C == 0) | ~numpy.outer(row_map.valid, col_map.valid)
+        if self.method != 'sum':
+            # Renormalise interpolation weights where some source cells have no data
+            B[~nodata] /= C[~nodata]
+
+        B[nodata] = numpy.nan
+        return B
+
+
+_alignments = {}
+_alignment_keys = []
+_alignment_lock = threading.Lock()
+
+def get_alignment(source_grid, target_grid, method):
+    """Get alignment between grids, computing it on first request only
+
+    Note
+        Safe to call from several threads. The alignment is computed
+        outside the lock, so concurrent misses may each compute it,
+        but only the first one is cached.
+    """
+
+    key = (source_grid, target_grid, method)
+
+    _alignment_lock.acquire()
+    try:
+        alignment = _alignments.get(key)
+    finally:
+        _alignment_lock.release()
+
+    if alignment is not None:
+        return alignment
+
+    alignment = Alignment(source_grid, target_grid, method)
+
+    _alignment_lock.acquire()
+    try:
+        if key not in _alignments:
+            _alignments[key] = alignment
+            _alignment_keys.append(key)
+
+            if len(_alignment_keys) > MAX_CACHED_ALIGNMENTS:
+                del _alignments[_alignment_keys.pop(0)]
+
+        return _alignments[key]
+    finally:
+        _alignment_lock.release()
+
+
+class AlignedRaster:
+    """Raster resampled onto a target grid on the fly, block by block
+
+    Provides the block interface of Raster used by the impact engine.
+    """
+
+    def __init__(self, source, target_grid, method):
+
+        self.source = source
+        self.alignment = get_alignment(get_grid(source), target_grid, method)
+        self.geotransform, self.shape = target_grid
+        self.filename = source.filename
+        self.nodata_value = source.band.GetNoDataValue()
+
+        # Picklable description used to reopen this raster in worker processes
+        self.spec = ('aligned', source.filename, target_grid, method)
+
+
+    def get_shape(self):
+        return self.shape
+
+
+    def get_geotransform(self):
+        return self.geotransform
+
+
+    def get_projection(self):
+        return self.source.get_projection()
+
+
+    def get_block(self, row, col, nrows, ncols, out=None):
+        """Get resampled window of data. Cells without data are NaN.
+        """
+
+        B = self.alignment.resample(self.source, row, col, nrows, ncols,
+                                    nodata_value=self.nodata_value)
+        if out is None:
+            return B
+
+        out[:] = B
+        return out
+
+
+def align_raster(raster, target_grid, method):
+    """Get raster on target grid
+
+    The raster itself is returned if it is already on the target grid.
+    """
+
+    if get_grid(raster) == target_grid:
+        return raster
+
+    return AlignedRaster(raster, target_grid, method)
+
+
+def open_aligned_raster(spec):
+    """Reopen AlignedRaster from its spec (e.g. in a worker process)
+    """
+
+    from geoserver_api.raster import read_coverage
+
+    _, filename, target_grid, method = spec
+    return AlignedRaster(read_coverage(filename), target_grid, method)
@@ -0,0 +1,312 @@
+"""Memoization of impact calculations keyed by the content of their inputs
+
+A calculation is identified by the content fingerprints of its input
+layers, the impact function and its parameters, the bounding box and the
+output layer. If an identical calculation has already produced the output
+layer, it need not be downloaded, recomputed or uploaded again.
+
+Layer fingerprints are MD5 digests. They are recorded when layers are
+uploaded through the API, so the fingerprints of such layers are known
+without downloading them. Other layers are fingerprinted from their
+downloaded content.
+
+Cache entries are evicted in least recently used order once the cache
+is full and invalidated whenever one of their layers is uploaded again
+or deleted.
+
+The cache also keeps the tile record and result of the latest calculation
+of each impact layer, so that the layer can be updated incrementally when
+only the hazard is revised.
+"""
+
+import hashlib
+import threading
+import numpy
+
+
+# Default maximal number of impact results kept in the cache
+MAX_CACHED_IMPACTS = 64
+
+# Size of chunks used when fingerprinting files (bytes)
+CHUNK_SIZE = 1024*1024
+
+
+def get_layer_id(geoserver_url, workspace, layer_name):
+    """Get identifier of layer independent of the credentials used to access it
+    """
+
+    return '%s/%s/%s' % (geoserver_url.rstrip('/'), workspace, layer_name)
+
+
+def get_file_fingerprint(filename):
+    """Get MD5 digest of file content
+    """
+
+    digest = hashlib.md5()
+    fid = open(filename, 'rb')
+    try:
+        data = fid.read(CHUNK_SIZE)
+        while data:
+            digest.update(data)
+            data = fid.read(CHUNK_SIZE)
+    finally:
+        fid.close()
+
+    return digest.hexdigest()
+
+
+def get_raster_fingerprint(raster):
+    """Get MD5 digest of raster georeference and data
+
+    Data is read one row at a time so memory use does not depend on the size of the grid.
+    """
+
+    nrows, ncols = raster.get_shape()
+
+    digest = hashlib.md5()
+    digest.update(repr((tuple(raster.get_geotransform()), (nrows, ncols))))
+
+    row = numpy.empty((1, ncols), dtype=numpy.float64)
+    for i in range(nrows):
+        digest.update(raster.get_block(i, 0, 1, ncols, out=row).tostring())
+
+    return digest.hexdigest()
+
+
+def get_array_fingerprint(A, geotransform):
+    """Get MD5 digest of array and its georeference
+
+    The digest agrees with get_raster_fingerprint of a raster holding the same data.
+    """
+
+    digest = hashlib.md5()
+    digest.update(repr((tuple(geotransform), tuple(A.shape))))
+    digest.update(numpy.ascontiguousarray(A, dtype=numpy.float64).tostring())
+
+    return digest.hexdigest()
+
+
+def get_key(fingerprints, impact_function, bounding_box, impact_id, options=()):
+    """Get cache key of impact calculation
+
+    Arguments
+        fingerprints = list of fingerprints of the input layers in order
+        impact_function = ImpactFunction evaluated
+        bounding_box = bounding box of the calculation
+        impact_id = layer id of the output layer
+        options = any further settings affecting the result (e.g. resampling methods)
+    """
+
+    if bounding_box:
+        bounding_box = [float(x) for x in bounding_box]
+    else:
+        bounding_box = None
+
+    parameters = sorted(impact_function.parameters.items())
+    description = (tuple(fingerprints), impact_function.id, parameters,
+                   bounding_box, impact_id, tuple(options))
+
+    return hashlib.md5(repr(description)).hexdigest()
+
+
+class ImpactCache:
+    """Size-bounded LRU cache of impact results and registry of layer fingerprints
+
+    It is safe to use from several threads.
+    """
+
+    def __init__(self, max_entries=MAX_CACHED_IMPACTS):
+
+        self.max_entries = max_entries
+
+        self.fingerprints = {}  # Layer id -> fingerprint
+        self.entries = {}       # Key -> (impact layer id, list of input layer ids)
+        self.keys = []          # Keys in order of use, most recent last
+
+        # Tile records of the latest calculation of each impact layer allowing it
+        # to be updated incrementally (see impact_engine.update_impact)
+        self.records = {}       # Impact layer id -> (key, record)
+        self.record_ids = []    # Impact layer ids in order of storage
+
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.RLock()
+
+
+    def get_fingerprint(self, layer_id):
+        """Get recorded fingerprint of layer or None if unknown
+        """
+
+        self.lock.acquire()
+        try:
+            return self.fingerprints.get(layer_id)
+        finally:
+            self.lock.release()
+
+
+    def set_fingerprint(self, layer_id, fingerprint):
+        """Record fingerprint of layer after it has been uploaded
+
+        Entries computed from or into an earlier version of the layer are invalidated.
+        """
+
+        self.lock.acquire()
+        try:
+            self.invalidate(layer_id)
+            self.fingerprints[layer_id] = fingerprint
+        finally:
+            self.lock.release()
+
+
+    def invalidate(self, layer_id):
+        """Forget entries reading or writing layer and the fingerprint of layer
+        """
+
+        self.lock.acquire()
+        try:
+            if layer_id in self.fingerprints:
+                del self.fingerprints[layer_id]
+
+            for key in self.keys[:]:
+                impact_id, input_ids = self.entries[key]
+                if impact_id == layer_id or layer_id in input_ids:
+                    self._remove(key)
+
+            if layer_id in self.records:
+                self._remove_record(layer_id)
+        finally:
+            self.lock.release()
+
+
+    def get(self, key):
+        """Get id of impact layer computed for key or None if not cached
+        """
+
+        self.lock.acquire()
+        try:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.keys.remove(key)
+            self.keys.append(key)
+
+            return self.entries[key][0]
+        finally:
+            self.lock.release()
+
+
+    def put(self, key, impact_id, input_ids):
+        """Record that impact layer was computed for key from the given input layers
+        """
+
+        self.lock.acquire()
+        try:
+            if key in self.entries:
+                self._remove(key)
+
+            self.entries[key] = (impact_id, list(input_ids))
+            self.keys.append(key)
+
+            while len(self.keys) > self.max_entries:
+                self._remove(self.keys[0])
+        finally:
+            self.lock.release()
+
+
+    def discard(self, key):
+        """Forget entry of key, e.g. because its impact layer has been removed
+        """
+
+        self.lock.acquire()
+        try:
+            if key in self.entries:
+                self._remove(key)
+        finally:
+            self.lock.release()
+
+
+    def set_record(self, impact_id, key, record):
+        """Store tile record of the latest calculation of impact layer
+
+        Arguments
+            impact_id = layer id of the impact layer
+            key = key of everything the calculation depended on apart from the hazard
+            record = hash filled in by impact_engine.calculate_impact
+        """
+
+        self.lock.acquire()
+        try:
+            if impact_id in self.records:
+                self._remove_record(impact_id)
+
+            self.records[impact_id] = (key, record)
+            self.record_ids.append(impact_id)
+
+            while len(self.record_ids) > self.max_entries:
+                self._remove_record(self.record_ids[0])
+        finally:
+            self.lock.release()
+
+
+    def take_record(self, impact_id, key):
+        """Remove and return tile record of impact layer if it was stored with the given key
+
+        Returns None if there is no such record. The record is removed either way
+        as the impact layer is about to be overwritten.
+        """
+
+        self.lock.acquire()
+        try:
+            if impact_id not in self.records:
+                return None
+
+            record_key, record = self.records[impact_id]
+            self._remove_record(impact_id)
+
+            if record_key != key:
+                return None
+
+            return record
+        finally:
+            self.lock.release()
+
+
+    def clear(self):
+        """Forget all entries and fingerprints
+        """
+
+        self.lock.acquire()
+        try:
+            self.fingerprints.clear()
+            self.entries.clear()
+            self.keys = []
+            self.records.clear()
+            self.record_ids = []
+        finally:
+            self.lock.release()
+
+
+    def get_statistics(self):
+        """Get number of entries, hits and misses as a hash
+        """
+
+        self.lock.acquire()
+        try:
+            return {'entries': len(self.keys),
+                    'hits': self.hits,
+                    'misses': self.misses}
+        finally:
+            self.lock.release()
+
+
+    def _remove(self, key):
+        del self.entries[key]
+        self.keys.remove(key)
+
+
+    def _remove_record(self, impact_id):
+        del self.records[impact_id]
+        self.record_ids.remove(impact_id)
@@ -0,0 +1,504 @@
+"""Tiled, block-wise evaluation of impact functions
+
+Hazard and exposure rasters are read in aligned windows (tiles). The impact
+function is evaluated for each tile into preallocated buffers and the result
+is written straight to the output raster, so peak memory is bounded by the
+tile size rather than by the size of the grid.
+"""
+
+import os
+import numpy
+import shutil
+import hashlib
+import tempfile
+import multiprocessing
+
+
+# Default memory budget for the working buffers of one tile (bytes)
+DEFAULT_TILE_MEMORY = 32*1024*1024
+
+
+def get_tile_shape(nrows, ncols, nbuffers=3, memory=DEFAULT_TILE_MEMORY, min_tiles=1):
+    """Get the largest tile shape whose buffers fit in the given memory
+
+    Arguments
+        nrows, ncols = size of grid
+        nbuffers = number of float64 arrays held per tile cell
+        memory = memory budget in bytes
+        min_tiles = minimal number of tiles the grid should be split into
+                    (e.g. to keep a number of worker processes busy)
+
+    Returns
+        tile_rows, tile_cols
+
+    Note
+        Tiles span full rows whenever possible as this matches the
+        way raster formats are laid out on disk.
+    """
+
+    cells = max(1, memory/(8*nbuffers))
+
+    if cells >= ncols:
+        tile_cols = ncols
+        tile_rows = max(1, min(nrows, cells/ncols, -(-nrows/min_tiles)))
+    else:
+        tile_cols = cells
+        tile_rows = 1
+
+    return tile_rows, tile_cols
+
+
+def get_tiles(nrows, ncols, tile_rows, tile_cols):
+    """Split grid into tiles
+
+    Returns
+        list of windows (row, col, nrows, ncols) in row major order.
+        Tiles along the last row and column may be smaller than the rest.
+    """
+
+    tiles = []
+    for row in range(0, nrows, tile_rows):
+        for col in range(0, ncols, tile_cols):
+            tiles.append((row, col,
+                          min(tile_rows, nrows - row),
+                          min(tile_cols, ncols - col)))
+
+    return tiles
+
+
+def get_view(buffer, shape):
+    """Get contiguous view of the first elements in buffer with given shape
+
+    This allows one preallocated buffer to serve the smaller tiles along the edges.
+    """
+
+    n = 1
+    for size in shape:
+        n *= size
+    return buffer.ravel()[:n].reshape(shape)
+
+
+def get_workers(workers):
+    """Get number of worker processes
+
+    A value of None or 0 means one worker per CPU core.
+    """
+
+    if not workers:
+        workers = multiprocessing.cpu_count()
+
+    return workers
+
+
+def get_nodata_value(raster):
+    """Get NODATA value stored with raster
+
+    Returns None if no value is set or if the raster represents NODATA as NaN.
+    """
+
+    if hasattr(raster, 'band'):
+        return raster.band.GetNoDataValue()
+
+    return None
+
+
+def get_nodata_mask(A, nodata_value):
+    """Get mask of cells in A that are NaN or equal to nodata_value
+    """
+
+    mask = numpy.isnan(A)
+    if nodata_value is not None:
+        mask |= A == nodata_value
+
+    return mask
+
+
+def get_raster_spec(raster):
+    """Get picklable description of raster from which worker processes can reopen it
+    """
+
+    return getattr(raster, 'spec', raster.filename)
+
+
+def get_file_spec(raster, directory):
+    """Get raster spec that refers to a file on disk
+
+    Rasters in GDAL's in-memory file system (/vsimem) exist in this process only,
+    so they are copied to a GeoTIFF in directory from which workers can reopen them.
+    """
+
+    spec = get_raster_spec(raster)
+    if isinstance(spec, basestring):
+        filename = spec
+    else:
+        filename = spec[1]
+
+    if not filename.startswith('/vsimem/'):
+        return spec
+
+    from geoserver_api.raster import read_memory_file
+
+    fd, path = tempfile.mkstemp(suffix='.tif', dir=directory)
+    fid = os.fdopen(fd, 'wb')
+    try:
+        fid.write(read_memory_file(filename))
+    finally:
+        fid.close()
+
+    if isinstance(spec, basestring):
+        return path
+
+    return (spec[0], path) + tuple(spec[2:])
+
+
+def open_raster(spec):
+    """Open raster from description made by get_raster_spec
+    """
+
+    if isinstance(spec, basestring):
+        from geoserver_api.raster import read_coverage
+        return read_coverage(spec)
+
+    from grid_alignment import open_aligned_raster
+    return open_aligned_raster(spec)
+
+
+def get_block_digest(A):
+    """Get MD5 digest of the content of array A
+    """
+
+    return hashlib.md5(numpy.ascontiguousarray(A).tostring()).hexdigest()
+
+
+def evaluate_tile(hazard, exposure, window, kernel, buffers, nodata_value=-9999, digests=None,
+                  hazard_block=None):
+    """Evaluate impact function for one tile
+
+    Arguments
+        hazard, exposure = Raster objects on identical grids
+        window = (row, col, nrows, ncols)
+        kernel = callable(H, E, out) computing the impact in place,
+                 typically an ImpactFunction
+        buffers = three preallocated arrays at least as large as the window
+        nodata_value = value used for cells where either input is NODATA
+        digests = optional list to which the digest of the hazard block is appended
+        hazard_block = hazard block of the window if it has already been read
+
+    Returns
+        F, total where F is a view into the last buffer and total is the
+        impact summed over cells with data.
+    """
+
+    row, col, block_rows, block_cols = window
+    H_buffer, E_buffer, F_buffer = buffers
+
+    shape = (block_rows, block_cols)
+    H = hazard_block
+    if H is None:
+        H = hazard.get_block(row, col, block_rows, block_cols, out=get_view(H_buffer, shape))
+    if digests is not None:
+        digests.append(get_block_digest(H))
+
+    E = exposure.get_block(row, col, block_rows, block_cols, out=get_view(E_buffer, shape))
+    F = kernel(H, E, get_view(F_buffer, shape))
+
+    # Propagate NODATA
+    mask = get_nodata_mask(H, get_nodata_value(hazard))
+    mask |= get_nodata_mask(E, get_nodata_value(exposure))
+
+    total = numpy.sum(F[~mask])
+    numpy.putmask(F, mask, nodata_value)
+
+    return F, total
+
+
+# Pool of worker processes shared by all parallel calculations (see start_pool)
+_pool = None
+
+def start_pool(workers=None):
+    """Start pool of worker processes used by calculate_impact
+
+    Arguments
+        workers = number of worker processes. If None or 0, one per CPU core.
+
+    Note
+        Servers must call this before starting any threads. Forking a
+        multithreaded process copies locks held by other threads, which then
+        stay locked forever in the workers.
+    """
+
+    global _pool
+
+    if _pool is None:
+        _pool = multiprocessing.Pool(get_workers(workers))
+
+    return _pool
+
+
+# State of each worker process: open rasters and tile buffers
+_worker_state = {}
+
+def _evaluate_tile_in_worker(args):
+    """Evaluate one tile in a worker process
+
+    Rasters are opened once per worker and buffers are reused between
+    tiles. The resulting block is returned to the parent process.
+    """
+
+    hazard_spec, exposure_spec, kernel, window, tile_shape, nodata_value, record = args
+
+    key = (hazard_spec, exposure_spec, tile_shape)
+    if _worker_state.get('key') != key:
+        _worker_state['key'] = key
+        _worker_state['rasters'] = (open_raster(hazard_spec),
+                                    open_raster(exposure_spec))
+        _worker_state['buffers'] = [numpy.empty(tile_shape, dtype=numpy.float64)
+                                    for i in range(3)]
+
+    if record:
+        digests = []
+    else:
+        digests = None
+
+    hazard, exposure = _worker_state['rasters']
+    F, total = evaluate_tile(hazard, exposure, window, kernel,
+                             _worker_state['buffers'], nodata_value, digests)
+
+    return window, F.copy(), total, digests
+
+
+def calculate_impact(hazard, exposure, writer, kernel, tile_shape=None, workers=1, record=None,
+                     progress=None):
+    """Evaluate impact function tile by tile and write result block-wise
+
+    Arguments
+        hazard, exposure = Raster (or AlignedRaster) objects on identical grids
+        writer = RasterWriter for the output grid
+        kernel = callable(H, E, out) computing the impact in place, typically
+                 an ImpactFunction. Must be picklable if workers != 1.
+        tile_shape = (tile_rows, tile_cols). If None, it is derived from
+                     the default memory budget.
+        workers = number of worker processes. If 1, tiles are evaluated
+                  serially in this process. Otherwise the pool made by start_pool is
+                  used if there is one, or a pool of this many workers is started
+                  (one per CPU core if None or 0).
+        record = optional hash. If given, it is filled with the tiling, the digest
+                 of each hazard block and the impact total of each tile so that the
+                 result can later be updated with update_impact.
+        progress = optional callable(fraction) called as tiles are completed
+
+    Returns
+        Total impact summed over all cells with data
+
+    Note
+        Cells where either input is NODATA or NaN are set to NODATA in the output.
+    """
+
+    nrows, ncols = hazard.get_shape()
+
+    msg = 'Hazard and exposure grids must have the same shape. '
+    msg += 'I got %s and %s' % (str((nrows, ncols)), str(exposure.get_shape()))
+    assert exposure.get_shape() == (nrows, ncols), msg
+
+    if tile_shape is None:
+        tile_shape = get_tile_shape(nrows, ncols)
+    tile_rows, tile_cols = tile_shape
+
+    tiles = get_tiles(nrows, ncols, tile_rows, tile_cols)
+
+    if record is not None:
+        digests = []
+    else:
+        digests = None
+
+    totals = []
+    if workers == 1:
+        # Serial evaluation using one set of preallocated buffers for the largest tile
+        buffers = [numpy.empty((tile_rows, tile_cols), dtype=numpy.float64)
+                   for i in range(3)]
+
+        for window in tiles:
+            F, subtotal = evaluate_tile(hazard, exposure, window, kernel,
+                                        buffers, writer.nodata_value, digests)
+            totals.append(subtotal)
+            writer.write_block(F, window[0], window[1])
+
+            if progress is not None:
+                progress(float(len(totals))/len(tiles))
+    else:
+        # Parallel evaluation. Results arrive in tile order so the
+        # output is identical to that of the serial evaluation.
+        # Workers reopen the inputs, so in-memory rasters are copied to disk first.
+        directory = tempfile.mkdtemp(prefix='riab_inputs_')
+        pool = _pool
+        try:
+            specs = (get_file_spec(hazard, directory), get_file_spec(exposure, directory))
+            tasks = [specs + (kernel, window, (tile_rows, tile_cols), writer.nodata_value,
+                              record is not None)
+                     for window in tiles]
+
+            if pool is None:
+                pool = multiprocessing.Pool(get_workers(workers))
+
+            for window, F, subtotal, tile_digests in pool.imap(_evaluate_tile_in_worker, tasks):
+                totals.append(subtotal)
+                if digests is not None:
+                    digests.extend(tile_digests)
+                writer.write_block(F, window[0], window[1])
+
+                if progress is not None:
+                    progress(float(len(totals))/len(tiles))
+        finally:
+            if pool is not None and pool is not _pool:
+                pool.terminate()
+                pool.join()
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if record is not None:
+        record['shape'] = (nrows, ncols)
+        record['tile_shape'] = (tile_rows, tile_cols)
+        record['digests'] = digests
+        record['totals'] = totals
+
+    total = 0.0
+    for subtotal in totals:
+        total += subtotal
+
+    return total
+
+
+def update_impact(hazard, exposure, writer, kernel, record, progress=None):
+    """Update impact calculated by calculate_impact after the hazard has changed
+
+    Tiles whose hazard block is unchanged are skipped. Changed tiles are
+    recomputed and patched into the existing output.
+
+    Arguments
+        hazard = revised hazard Raster on the same grid as before
+        exposure = Raster object unchanged since the previous calculation
+        writer = RasterUpdater (or RasterWriter) for the existing output
+        kernel = callable(H, E, out) computing the impact in place
+        record = hash filled in by calculate_impact (or a previous update).
+                 It is updated to reflect the revised hazard.
+        progress = optional callable(fraction) called as tiles are completed
+
+    Returns
+        total, changed where total is the impact summed over all cells with
+        data and changed is the list of windows (row, col, nrows, ncols) recomputed.
+
+    Note
+        Cost is proportional to the size of the grid for reading and comparing
+        the hazard and to the size of the changed area for everything else.
+    """
+
+    nrows, ncols = hazard.get_shape()
+
+    msg = 'Hazard grid has shape %s, but the previous calculation was for %s' % (str((nrows, ncols)),
+                                                                                str(record['shape']))
+    assert (nrows, ncols) == record['shape'], msg
+
+    msg = 'Hazard and exposure grids must have the same shape. '
+    msg += 'I got %s and %s' % (str((nrows, ncols)), str(exposure.get_shape()))
+    assert exposure.get_shape() == (nrows, ncols), msg
+
+    tile_rows, tile_cols = record['tile_shape']
+    tiles = get_tiles(nrows, ncols, tile_rows, tile_cols)
+
+    buffers = [numpy.empty((tile_rows, tile_cols), dtype=numpy.float64)
+               for i in range(3)]
+
+    changed = []
+    for i, window in enumerate(tiles):
+        row, col, block_rows, block_cols = window
+
+        if progress is not None:
+            progress(float(i)/len(tiles))
+
+        H = hazard.get_block(row, col, block_rows, block_cols,
+                             out=get_view(buffers[0], (block_rows, block_cols)))
+        digest = get_block_digest(H)
+        if digest == record['digests'][i]:
+            continue
+
+        # Hazard block is evaluated as read for the comparison
+        F, subtotal = evaluate_tile(hazard, exposure, window, kernel,
+                                    buffers, writer.nodata_value, hazard_block=H)
+        writer.write_block(F, row, col)
+
+        record['digests'][i] = digest
+        record['totals'][i] = subtotal
+        changed.append(window)
+
+    total = 0.0
+    for subtotal in record['totals']:
+        total += subtotal
+
+    return total, changed
+
+
+def calculate_scenarios(hazards, exposure, writers, kernel, tile_shape=None):
+    """Evaluate impact function for several hazard scenarios in one pass
+
+    Arguments
+        hazards = list of N Raster objects on the same grid as exposure
+        exposure = Raster object shared by all scenarios
+        writers = list of N RasterWriters, one per scenario
+        kernel = callable(H, E, out) computing the impact in place. It is
+                 called with a stack of N hazard blocks, the exposure block
+                 (broadcast across the stack) and an output stack.
+        tile_shape = (tile_rows, tile_cols). If None, it is derived from
+                     the default memory budget.
+
+    Returns
+        list of total impact per scenario summed over all cells with data
+
+    Note
+        The exposure is read once per tile irrespective of the number of scenarios.
+    """
+
+    nrows, ncols = exposure.get_shape()
+    N = len(hazards)
+
+    msg = 'There must be one writer per hazard. I got %i hazards and %i writers' % (N, len(writers))
+    assert len(writers) == N, msg
+
+    for hazard in hazards:
+        msg = 'Hazard and exposure grids must have the same shape. '
+        msg += 'I got %s and %s' % (str(hazard.get_shape()), str((nrows, ncols)))
+        assert hazard.get_shape() == (nrows, ncols), msg
+
+    if tile_shape is None:
+        tile_shape = get_tile_shape(nrows, ncols, nbuffers=2*N + 1)
+    tile_rows, tile_cols = tile_shape
+
+    hazard_nodata = [get_nodata_value(hazard) for hazard in hazards]
+    exposure_nodata = get_nodata_value(exposure)
+
+    # Preallocate buffers for the largest tile
+    H_buffer = numpy.empty((N, tile_rows, tile_cols), dtype=numpy.float64)
+    E_buffer = numpy.empty((tile_rows, tile_cols), dtype=numpy.float64)
+    F_buffer = numpy.empty((N, tile_rows, tile_cols), dtype=numpy.float64)
+
+    totals = [0.0]*N
+    for row, col, block_rows, block_cols in get_tiles(nrows, ncols, tile_rows, tile_cols):
+        shape = (block_rows, block_cols)
+        E = exposure.get_block(row, col, block_rows, block_cols, out=get_view(E_buffer, shape))
+
+        H = get_view(H_buffer, (N,) + shape)
+        for k, hazard in enumerate(hazards):
+            hazard.get_block(row, col, block_rows, block_cols, out=H[k])
+
+        F = kernel(H, E, get_view(F_buffer, (N,) + shape))
+
+        # Propagate NODATA
+        exposure_mask = get_nodata_mask(E, exposure_nodata)
+
+        for k in range(N):
+            mask = exposure_mask | get_nodata_mask(H[k], hazard_nodata[k])
+
+            totals[k] += numpy.sum(F[k][~mask])
+            numpy.putmask(F[k], mask, writers[k].nodata_value)
+
+            writers[k].write_block(F[k], row, col)
+
+    return totals
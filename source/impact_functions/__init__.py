@@ -0,0 +1,85 @@
+"""Registry of impact functions
+
+Impact functions are plugins: every module in this package defines
+subclasses of ImpactFunction and registers instances of them with
+register_impact_function. Modules are discovered and their functions
+compiled once by load_impact_functions, normally when the server starts.
+"""
+
+import os
+from core import ImpactFunction
+from lookup_table import LookupTable, get_lookup_table, tabulate
+
+# Used when clients don't specify an impact function (e.g. id 0 or '')
+DEFAULT_IMPACT_FUNCTION = 'earthquake_fatality'
+
+# Modules in this package that are not plugins
+_support_modules = ['core', 'lookup_table']
+
+_registry = {}
+_loaded = False
+
+
+def register_impact_function(impact_function):
+    """Register instance of ImpactFunction under its id
+    """
+
+    msg = 'Impact function must have an id. I got %s' % str(impact_function.id)
+    assert impact_function.id, msg
+
+    _registry[impact_function.id] = impact_function
+
+
+def load_impact_functions():
+    """Discover and import all impact function modules in this package
+    """
+
+    global _loaded
+
+    path = os.path.dirname(__file__)
+    for filename in sorted(os.listdir(path)):
+        modname, extension = os.path.splitext(filename)
+        if extension != '.py' or modname.startswith('_') or modname in _support_modules:
+            continue
+
+        __import__('%s.%s' % (__name__, modname))
+
+    _loaded = True
+
+
+def get_impact_function(impact_function_id):
+    """Get registered impact function by id
+
+    An empty id (or 0) gives the default impact function.
+    """
+
+    if not _loaded:
+        load_impact_functions()
+
+    if not impact_function_id:
+        impact_function_id = DEFAULT_IMPACT_FUNCTION
+
+    try:
+        return _registry[impact_function_id]
+    except KeyError:
+        msg = 'Unknown impact function %s. ' % str(impact_function_id)
+        msg += 'Available impact functions are %s' % sorted(_registry.keys())
+        raise KeyError(msg)
+
+
+def get_all_impact_functions():
+    """Get all registered impact functions sorted by id
+    """
+
+    if not _loaded:
+        load_impact_functions()
+
+    return [_registry[key] for key in sorted(_registry.keys())]
+
+
+def suggest_impact_functions(hazard_names, exposure_names):
+    """Get impact functions applicable to the named hazard and exposure layers
+    """
+
+    return [impact_function for impact_function in get_all_impact_functions()
+            if impact_function.accepts(hazard_names, exposure_names)]
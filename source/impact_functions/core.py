@@ -0,0 +1,120 @@
+"""Base class for impact functions
+"""
+
+
+class ImpactFunction:
+    """Impact function evaluated block-wise on numeric arrays
+
+    Subclasses declare their inputs and cost and implement __call__ as a
+    vectorised kernel that works in place on NumPy blocks:
+
+        F = impact_function(H, E, out)
+
+    where H and E are hazard and exposure blocks of the same shape and the
+    result is written into the preallocated array out (which is also returned).
+
+    Instances must be picklable as they are shipped to worker processes.
+    """
+
+    # Unique identifier used by clients to select this function
+    id = None
+
+    # Details reported to clients
+    name = ''
+    description = ''
+    author = ''
+
+    # Inputs: layers are matched by keywords occurring in their names
+    hazard_keywords = []
+    exposure_keywords = []
+
+    # Default parameters. Can be overridden when instantiating.
+    parameters = {}
+
+    # Cost estimate per cell: number of float64 arrays held while evaluating
+    # a block (including inputs and output) and relative number of floating
+    # point operations. Used to size tiles and decide on parallel evaluation.
+    buffers = 3
+    flops = 1
+
+    # Functions of the form F = T(H)*E may implement the hazard transfer
+    # function T as method transfer(H, out) and declare the range of hazard
+    # intensities it is defined on. This allows T to be tabulated
+    # (see lookup_table.py).
+    hazard_range = None
+
+
+    def __init__(self, **parameters):
+
+        for key in parameters:
+            if key not in self.parameters:
+                msg = 'Unknown parameter %s for impact function %s. ' % (key, self.id)
+                msg += 'Valid parameters are %s' % self.parameters.keys()
+                raise Exception(msg)
+
+        params = self.parameters.copy()
+        params.update(parameters)
+        self.parameters = params
+
+        self.compile()
+
+
+    def compile(self):
+        """Prepare kernel for evaluation, e.g. bind parameters to constants
+
+        This is done once when the function is instantiated.
+        """
+
+        pass
+
+
+    def __call__(self, H, E, out):
+        """Evaluate impact function in place into out and return out
+        """
+
+        msg = 'Impact function %s has no kernel' % self.id
+        raise NotImplementedError(msg)
+
+
+    def transfer(self, H, out):
+        """Evaluate hazard transfer function T(H) in place into out and return out
+        """
+
+        msg = 'Impact function %s has no transfer function' % self.id
+        raise NotImplementedError(msg)
+
+
+    def accepts(self, hazard_names, exposure_names):
+        """Check whether this function applies to the named layers
+
+        Each hazard and each exposure layer must contain one of the declared keywords.
+        """
+
+        if not hazard_names or not exposure_names:
+            return False
+
+        for names, keywords in [(hazard_names, self.hazard_keywords),
+                                (exposure_names, self.exposure_keywords)]:
+            for name in names:
+                found = False
+                for keyword in keywords:
+                    if name.lower().find(keyword.lower()) >= 0:
+                        found = True
+                if not found:
+                    return False
+
+        return True
+
+
+    def get_details(self):
+        """Get details of this impact function as a hash
+        """
+
+        return {'Id': self.id,
+                'Name': self.name,
+                'Description': self.description,
+                'Author': self.author,
+                'Hazards': list(self.hazard_keywords),
+                'Exposures': list(self.exposure_keywords),
+                'Parameters': self.parameters.copy(),
+                'Cost': {'buffers': self.buffers, 'flops': self.flops}}
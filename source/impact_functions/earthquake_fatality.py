@@ -0,0 +1,53 @@
+"""Earthquake fatality model
+
+F = 10**(a*H-b)*E
+
+where H is ground shaking (MMI) and E is population.
+"""
+
+import numpy
+from core import ImpactFunction
+from impact_functions import register_impact_function
+
+
+class EarthquakeFatalityFunction(ImpactFunction):
+
+    id = 'earthquake_fatality'
+    name = 'Earthquake fatalities'
+    description = 'Estimated fatalities F = 10**(a*H-b)*E from ground shaking H (MMI) and population E'
+    author = 'AIFDR'
+
+    hazard_keywords = ['shakemap', 'mmi', 'earthquake', 'shaking']
+    exposure_keywords = ['population']
+
+    parameters = {'a': 0.97429,
+                  'b': 11.037}
+
+    buffers = 3
+    flops = 4
+
+    # Modified Mercalli Intensity scale
+    hazard_range = (1.0, 12.0)
+
+
+    def compile(self):
+        self.a = float(self.parameters['a'])
+        self.b = float(self.parameters['b'])
+
+
+    def transfer(self, H, out):
+        numpy.multiply(H, self.a, out)
+        numpy.subtract(out, self.b, out)
+        numpy.power(10, out, out)
+
+        return out
+
+
+    def __call__(self, H, E, out):
+        self.transfer(H, out)
+        numpy.multiply(out, E, out)
+
+        return out
+
+
+register_impact_function(EarthquakeFatalityFunction())
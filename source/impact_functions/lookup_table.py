@@ -0,0 +1,158 @@
+"""Lookup table evaluation of hazard transfer functions
+
+Impact functions of the form F = T(H)*E spend most of their time
+evaluating the transcendental transfer function T. Hazard intensities
+are bounded (and often quantised), so T can be precomputed at a given
+resolution and evaluated by indexing or linear interpolation instead.
+
+Tables are cached per (function, parameters, resolution, mode) for the
+life of the process.
+"""
+
+import numpy
+from core import ImpactFunction
+
+
+# Number of sample points per table interval used to estimate the error
+ERROR_SAMPLES = 64
+
+
+class LookupTable:
+    """Tabulated hazard transfer function of an impact function
+    """
+
+    def __init__(self, impact_function, resolution, interpolate=True):
+        """Precompute transfer function
+
+        Arguments
+            impact_function = ImpactFunction implementing transfer and hazard_range
+            resolution = number of table entries per unit of hazard intensity
+            interpolate = if True, values are interpolated linearly between
+                          table entries. Otherwise the nearest entry is used.
+        """
+
+        if impact_function.hazard_range is None:
+            msg = 'Impact function %s does not support lookup tables' % impact_function.id
+            raise Exception(msg)
+
+        msg = 'Lookup table resolution must be positive. I got %s' % str(resolution)
+        assert resolution > 0, msg
+
+        x0, x1 = impact_function.hazard_range
+        n = int(round((x1 - x0)*resolution)) + 1
+
+        self.impact_function = impact_function
+        self.resolution = float(resolution)
+        self.interpolate = interpolate
+        self.x0 = float(x0)
+        self.n = n
+
+        x = self.x0 + numpy.arange(n)/self.resolution
+        self.x = x
+        self.y = impact_function.transfer(x, numpy.empty(n))
+        self.dy = numpy.diff(self.y)
+
+        # Error bound against exact evaluation: maximal error observed on a
+        # dense sample of hazard values across the table
+        xs = self.x0 + numpy.arange((n-1)*ERROR_SAMPLES + 1)/(self.resolution*ERROR_SAMPLES)
+        exact = impact_function.transfer(xs, numpy.empty(xs.shape))
+        approx = self(xs, numpy.empty(xs.shape))
+        err = numpy.abs(approx - exact)
+
+        self.max_absolute_error = numpy.max(err)
+        self.max_relative_error = numpy.max(err/numpy.abs(exact))
+
+
+    def __call__(self, H, out):
+        """Evaluate tabulated transfer function in place into out and return out
+
+        Hazard values outside the tabulated range (including NODATA)
+        are evaluated exactly.
+        """
+
+        # Fractional table position
+        numpy.subtract(H, self.x0, out)
+        numpy.multiply(out, self.resolution, out)
+        outside = ~((out >= 0) & (out <= self.n - 1))
+
+        # Positions outside the table (including NaN and infinity) cannot be cast to
+        # indices. They are set to a valid one here and evaluated exactly below.
+        out[outside] = 0
+
+        if self.interpolate:
+            i = numpy.floor(out).clip(0, self.n - 2).astype(numpy.int_)
+            numpy.subtract(out, i, out)
+            numpy.multiply(out, self.dy.take(i), out)
+            numpy.add(out, self.y.take(i), out)
+        else:
+            i = numpy.floor(out + 0.5).clip(0, self.n - 1).astype(numpy.int_)
+            self.y.take(i, out=out)
+
+        if numpy.any(outside):
+            h = H[outside]
+            out[outside] = self.impact_function.transfer(h, numpy.empty(h.shape))
+
+        return out
+
+
+    def get_error_bound(self):
+        """Get maximal absolute and relative error against exact evaluation
+        """
+
+        return {'max_absolute_error': float(self.max_absolute_error),
+                'max_relative_error': float(self.max_relative_error)}
+
+
+class TabulatedImpactFunction(ImpactFunction):
+    """Impact function F = T(H)*E with T evaluated from a lookup table
+    """
+
+    def __init__(self, impact_function, table):
+
+        self.impact_function = impact_function
+        self.table = table
+
+        self.id = impact_function.id
+        self.name = impact_function.name
+        self.description = impact_function.description
+        self.author = impact_function.author
+        self.hazard_keywords = impact_function.hazard_keywords
+        self.exposure_keywords = impact_function.exposure_keywords
+        self.parameters = impact_function.parameters
+        self.hazard_range = impact_function.hazard_range
+        self.buffers = impact_function.buffers
+        self.flops = 3
+
+
+    def transfer(self, H, out):
+        return self.table(H, out)
+
+
+    def __call__(self, H, E, out):
+        self.table(H, out)
+        numpy.multiply(out, E, out)
+
+        return out
+
+
+_tables = {}
+
+def get_lookup_table(impact_function, resolution, interpolate=True):
+    """Get lookup table for impact function, computing it on first request only
+    """
+
+    params = tuple(sorted(impact_function.parameters.items()))
+    key = (impact_function.id, params, float(resolution), bool(interpolate))
+
+    if key not in _tables:
+        _tables[key] = LookupTable(impact_function, resolution, interpolate=interpolate)
+
+    return _tables[key]
+
+
+def tabulate(impact_function, resolution, interpolate=True):
+    """Get impact function evaluating its transfer function from a cached lookup table
+    """
+
+    table = get_lookup_table(impact_function, resolution, interpolate=interpolate)
+    return TabulatedImpactFunction(impact_function, table)
@@ -0,0 +1,249 @@
+"""Background execution of long-running API calls
+
+Calls are submitted as jobs to a bounded queue and executed by a fixed
+number of worker threads, so a server can return a job id immediately
+and clients can poll for status and result.
+
+Code running inside a job can report its progress through report_stage
+and report_progress. Outside of jobs these functions do nothing.
+"""
+
+import sys
+import time
+import uuid
+import Queue
+import threading
+import traceback
+import logging
+
+
+# Default number of jobs executed concurrently
+MAX_RUNNING_JOBS = 2
+
+# Default number of jobs waiting for execution before submissions are refused
+MAX_QUEUED_JOBS = 16
+
+# Number of finished jobs whose results are kept
+MAX_FINISHED_JOBS = 100
+
+
+# Job currently executed by each worker thread
+_current = threading.local()
+
+
+def report_stage(stage):
+    """Report that the current job has entered a new stage (e.g. 'download')
+    """
+
+    job = getattr(_current, 'job', None)
+    if job is not None:
+        job.set_stage(stage)
+
+
+def report_progress(fraction):
+    """Report fraction of the current stage of the current job that is done
+    """
+
+    job = getattr(_current, 'job', None)
+    if job is not None:
+        job.progress = float(fraction)
+
+
+class Job:
+    """Call of func(*args) executed in the background
+    """
+
+    def __init__(self, func, args, name):
+
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.name = name
+
+        self.status = 'queued'    # One of queued, running, finished or failed
+        self.stage = ''
+        self.progress = 0.0
+        self.timings = {}         # Stage -> seconds
+        self.result = None
+        self.error = ''
+
+        self.submitted = time.time()
+        self.started = None
+        self.stage_started = None
+        self.finished = None
+
+
+    def set_stage(self, stage):
+        """Enter new stage, recording the time spent in the previous one
+        """
+
+        now = time.time()
+        if self.stage:
+            self.timings[self.stage] = self.timings.get(self.stage, 0.0) + now - self.stage_started
+
+        self.stage = stage
+        self.stage_started = now
+        self.progress = 0.0
+
+
+    def run(self):
+        """Execute job in the calling thread
+        """
+
+        self.status = 'running'
+        self.started = time.time()
+        self.timings['queued'] = self.started - self.submitted
+
+        _current.job = self
+        try:
+            try:
+                self.result = self.func(*self.args)
+            except:
+                exc_type, exc_value, _ = sys.exc_info()
+                self.error = '%s: %s' % (exc_type.__name__, exc_value)
+                self.status = 'failed'
+
+                logging.debug('Job %s (%s) failed:\n%s' % (self.id, self.name, traceback.format_exc()))
+            else:
+                self.status = 'finished'
+        finally:
+            _current.job = None
+
+            self.set_stage('')
+            self.finished = time.time()
+            self.timings['total'] = self.finished - self.started
+
+
+    def get_status(self):
+        """Get status of job as a hash that can be marshalled by XMLRPC
+        """
+
+        status = {'id': self.id,
+                  'name': self.name,
+                  'status': self.status,
+                  'stage': self.stage,
+                  'progress': self.progress,
+                  'timings': self.timings.copy(),
+                  'error': self.error}
+
+        if self.status == 'running' and self.stage:
+            timings = status['timings']
+            timings[self.stage] = timings.get(self.stage, 0.0) + time.time() - self.stage_started
+
+        return status
+
+
+class JobManager:
+    """Bounded queue of jobs served by a fixed number of worker threads
+
+    Worker threads are started when the first job is submitted.
+    """
+
+    def __init__(self, max_running=MAX_RUNNING_JOBS, max_queued=MAX_QUEUED_JOBS,
+                 max_finished=MAX_FINISHED_JOBS):
+
+        msg = 'Number of concurrently running jobs must be positive. I got %s' % str(max_running)
+        assert max_running > 0, msg
+
+        self.max_running = max_running
+        self.max_finished = max_finished
+
+        self.queue = Queue.Queue(max_queued)
+        self.jobs = {}            # Job id -> Job
+        self.finished_ids = []    # Ids of finished jobs in order of completion
+        self.workers = []
+        self.lock = threading.Lock()
+
+
+    def submit(self, func, args=(), name=''):
+        """Queue call of func(*args) and return job id
+
+        An exception is raised if the queue is full.
+        """
+
+        job = Job(func, args, name)
+
+        self.lock.acquire()
+        try:
+            if not self.workers:
+                self._start_workers()
+
+            try:
+                self.queue.put_nowait(job)
+            except Queue.Full:
+                msg = 'Job queue is full (%i jobs waiting). Try again later.' % self.queue.maxsize
+                raise Exception(msg)
+
+            self.jobs[job.id] = job
+        finally:
+            self.lock.release()
+
+        return job.id
+
+
+    def get_job(self, job_id):
+        """Get job with given id
+        """
+
+        self.lock.acquire()
+        try:
+            if job_id not in self.jobs:
+                msg = 'Unknown job %s. It may have expired.' % job_id
+                raise Exception(msg)
+
+            return self.jobs[job_id]
+        finally:
+            self.lock.release()
+
+
+    def get_status(self, job_id):
+        """Get status of job as a hash (see Job.get_status)
+        """
+
+        return self.get_job(job_id).get_status()
+
+
+    def get_result(self, job_id):
+        """Get result of finished job
+
+        The exception message of a failed job is raised as an exception.
+        """
+
+        job = self.get_job(job_id)
+
+        if job.status == 'failed':
+            msg = 'Job %s failed with %s' % (job_id, job.error)
+            raise Exception(msg)
+
+        if job.status != 'finished':
+            msg = 'Job %s has not finished. Its status is %s' % (job_id, job.status)
+            raise Exception(msg)
+
+        return job.result
+
+
+    def _start_workers(self):
+
+        for i in range(self.max_running):
+            worker = threading.Thread(target=self._work, name='job-worker-%i' % i)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
+
+    def _work(self):
+        """Execute jobs from the queue until the process exits
+        """
+
+        while True:
+            job = self.queue.get()
+            job.run()
+
+            # Forget the oldest finished jobs
+            self.lock.acquire()
+            try:
+                self.finished_ids.append(job.id)
+                while len(self.finished_ids) > self.max_finished:
+                    del self.jobs[self.finished_ids.pop(0)]
+            finally:
+                self.lock.release()
@@ -5,11 +5,52 @@
 # Created: 01/16/2011
 
 import os, string
-from geoserver_api import geoserver
-from geoserver_api.raster import write_coverage_to_ascii
+from multiprocessing.pool import ThreadPool
+import impact_engine
+import impact_functions
+import impact_cache
+import jobs
+import grid_alignment
+from geoserver_api import geoserver, catalog, coverage_cache
+from geoserver_api.raster import RasterWriter, read_coverage, get_memory_filename, remove_memory_file
 
 class RiabAPI():
     API_VERSION='0.1a'
+    
+    # Memory budget for working buffers of each tile in calculate (bytes)
+    TILE_MEMORY = impact_engine.DEFAULT_TILE_MEMORY
+    
+    # Number of worker processes used by calculate (1: serial, 0: one per CPU core)
+    WORKERS = 1
+    
+    # Maximal number of layers downloaded concurrently by calculate
+    FETCH_THREADS = 4
+    
+    # Calculations with fewer floating point operations than this are not worth parallelising
+    MIN_PARALLEL_FLOPS = 10**7
+    
+    # If set, hazard transfer functions are evaluated from lookup tables with this 
+    # many entries per unit of hazard intensity (interpolated linearly or nearest entry).
+    LOOKUP_TABLE_RESOLUTION = None
+    LOOKUP_TABLE_INTERPOLATE = True
+    
+    # Grid on which impact is calculated ('exposure' or 'hazard') and methods
+    # used to resample layers onto it (see grid_alignment.py)
+    TARGET_GRID = 'exposure'
+    HAZARD_RESAMPLING = 'bilinear'
+    EXPOSURE_RESAMPLING = 'sum'
+    
+    # Results of previous calculations and fingerprints of uploaded layers (see impact_cache.py)
+    IMPACT_CACHE = impact_cache.ImpactCache()
+    
+    # Background execution of calculations submitted with submit_calculation (see jobs.py)
+    JOBS = jobs.JobManager()
+    
+    # Seconds for which shared geoserver connections are trusted without verifying them again
+    GEOSERVER_TTL = geoserver.VERIFICATION_TTL
+    
+    # Seconds for which catalog lookups such as existence of workspaces are cached
+    CATALOG_TTL = catalog.CATALOG_TTL
         
     def version(self):
         return self.API_VERSION
@@ -115,7 +156,7 @@ class RiabAPI():
         username, userpass, geoserver_url, layer_name, workspace =\
             self.split_geoserver_layer_handle(geoserver_layer_handle)
         
-        gs = geoserver.Geoserver(geoserver_url, username, userpass)      
+        gs = self._get_geoserver(geoserver_url, username, userpass)      
         gs.get_workspace(workspace, verbose=False)        
         
         return 'SUCCESS'
@@ -141,17 +182,17 @@ class RiabAPI():
             return 'SUCCESS'
         
         # Connect to Geoserver
-        gs = geoserver.Geoserver(geoserver_url, username, userpass)                  
+        gs = self._get_geoserver(geoserver_url, username, userpass)                  
         gs.create_workspace(workspace_name, verbose=False)
                     
-        # Check that it was indeed created 
-        if not self.workspace_exists(username, userpass, geoserver_url, workspace_name):
+        # Check that it was indeed created (asking the server rather than the catalog cache)
+        if not self.workspace_exists(username, userpass, geoserver_url, workspace_name, use_cache=False):
             msg = 'Workspace %s was not created succesfully on geoserver %s' % (workspace_name, geoserver_url)
             raise Exception(msg)
             
         return 'SUCCESS'    
                     
-    def workspace_exists(self, username, userpass, geoserver_url, workspace_name):
+    def workspace_exists(self, username, userpass, geoserver_url, workspace_name, use_cache=True):
         """Check that workspace exists on geoserver
         
         Arguments
@@ -159,6 +200,7 @@ class RiabAPI():
             userpass=password 
             geoserver_url=The URL of the geoserver   
             workspace=name of geoserver workspace        
+            use_cache=False forces a request to geoserver
             
         Returns
             True or False
@@ -166,9 +208,9 @@ class RiabAPI():
         
         # FIXME(Ole): Should this use the handle even though layername would be ignored?
         
-        gs = geoserver.Geoserver(geoserver_url, username, userpass)                  
+        gs = self._get_geoserver(geoserver_url, username, userpass)                  
         try:
-            gs.get_workspace(workspace_name, verbose=False)
+            gs.get_workspace(workspace_name, verbose=False, use_cache=use_cache)
         except:
             return False
         else:
@@ -198,6 +240,10 @@ class RiabAPI():
                      
         Note
             hazards and exposure may be lists of handles or just a single handle each.             
+            If the same calculation has already produced the impact layer, none
+            of its layers have been uploaded again since and the impact layer is
+            still on geoserver, nothing is recomputed.
+            If only the hazard has been revised, only tiles where it changed are recomputed.
         """
         
         # Make sure hazards and exposures are lists
@@ -207,54 +253,342 @@ class RiabAPI():
         if type(exposures) != type([]):
             exposures = [exposures]            
         
-        # Download data - FIXME(Ole): Currently only raster
-        
-        hazard_layers = []
-        for hazard in hazards:
-            raster = self.get_raster_data(hazard, bounding_box)
-            H = raster.get_data()
-            hazard_layers.append(H)
-
-        exposure_layers = []
-        for exposure in exposures:
-            raster = self.get_raster_data(exposure, bounding_box)
-            E = raster.get_data()
-            exposure_layers.append(E)
+        impact_function = self._get_impact_function(impact_function_id)
+        
+        # Return straight away if this calculation has already produced the impact layer.
+        # Fingerprints of layers uploaded through this API are known without downloading them.
+        input_ids = [self._get_layer_id(name) for name in hazards + exposures]
+        impact_id = self._get_layer_id(impact)
+        
+        fingerprints = [self.IMPACT_CACHE.get_fingerprint(layer_id) for layer_id in input_ids]
+        if None not in fingerprints:
+            key = self._get_impact_key(fingerprints, impact_function, bounding_box, impact_id)
+            if self._is_cached(key, impact):
+                return 'SUCCES'
+        
+        # Download all data concurrently - FIXME(Ole): Currently only raster
+        jobs.report_stage('download')
+        rasters = self._get_raster_layers(hazards + exposures, bounding_box)
+        hazard_layers = rasters[:len(hazards)]
+        exposure_layers = rasters[len(hazards):]
+        
+        # Layers of unknown origin are fingerprinted by their content
+        if None in fingerprints:
+            for i, raster in enumerate(rasters):
+                if fingerprints[i] is None:
+                    fingerprints[i] = impact_cache.get_raster_fingerprint(raster)
+                    
+            key = self._get_impact_key(fingerprints, impact_function, bounding_box, impact_id)
+            if self._is_cached(key, impact):
+                return 'SUCCES'
                         
-        # Pass hazard and exposure arrays on to plugin    
-        # FIXME, for the time being we just calculate the fatality function assuming only one of each layer.
-        
+        # Pass hazard and exposure rasters on to plugin    
+        # FIXME, for the time being we assume only one of each layer.
+        jobs.report_stage('compute')
         H = hazard_layers[0]
         E = exposure_layers[0]
+        
+        # Bring hazard and exposure onto a common grid
+        if self.TARGET_GRID == 'hazard':
+            target_grid = grid_alignment.get_grid(H)
+        else:
+            target_grid = grid_alignment.get_grid(E)
+            
+        H = grid_alignment.align_raster(H, target_grid, self.HAZARD_RESAMPLING)
+        E = grid_alignment.align_raster(E, target_grid, self.EXPOSURE_RESAMPLING)
+        
+        # Output raster takes its georeference from the target grid. It is assembled
+        # in GDAL's in-memory file system, so nothing is written to disk.
+        layer_name = self.split_geoserver_layer_handle(impact)[3]
+        
+        nrows, ncols = H.get_shape()
+        geotransform = H.get_geotransform()
+        projection = E.get_projection()
+        output_file = get_memory_filename(layer_name)
+        writer = RasterWriter(output_file, nrows, ncols, geotransform, projection,
+                              nodata_value=-9999)
+        try:
+            # If only the hazard has been revised since the impact layer was last calculated,
+            # start from the previous result and recompute the tiles where the hazard changed.
+            update_key = self._get_impact_key(fingerprints[len(hazards):], impact_function, 
+                                              bounding_box, impact_id)
+            record = self.IMPACT_CACHE.take_record(impact_id, update_key)
+            if record is not None and record['grid'] == target_grid:
+                writer.write_block(record['data'], 0, 0)
+                impact_engine.update_impact(H, E, writer, impact_function, record,
+                                            progress=jobs.report_progress)
+            else:
+                record = {'grid': target_grid}
 
-        # Calculate impact
-        a = 0.97429
-        b = 11.037
-        F = 10**(a*H-b)*E    
+                # Calculate impact tile by tile, writing each block straight to the output raster.
+                # Tiles are sized from the cost estimate of the impact function and, 
+                # in parallel mode, so that there are enough of them to keep all workers busy.
+                workers = impact_engine.get_workers(self.WORKERS)
+                if nrows*ncols*impact_function.flops < self.MIN_PARALLEL_FLOPS:
+                    workers = 1
+                    
+                if workers > 1:
+                    min_tiles = 4*workers
+                else:
+                    min_tiles = 1
+                    
+                tile_shape = impact_engine.get_tile_shape(nrows, ncols, 
+                                                          nbuffers=impact_function.buffers,
+                                                          memory=self.TILE_MEMORY,
+                                                          min_tiles=min_tiles)
+                impact_engine.calculate_impact(H, E, writer, 
+                                               impact_function, 
+                                               tile_shape=tile_shape,
+                                               workers=workers,
+                                               record=record,
+                                               progress=jobs.report_progress)
+            writer.close()
+            F = read_coverage(output_file).get_data()
+        finally:
+            remove_memory_file(output_file)
+        
+        # Publish result
+        jobs.report_stage('upload')
+        self._publish_impact_layer(F, geotransform, projection, impact)
+        self.IMPACT_CACHE.put(key, impact_id, input_ids)
+        
+        # Keep the result for the next revision of the hazard
+        record['data'] = F
+        self.IMPACT_CACHE.set_record(impact_id, update_key, record)
+        
+        return 'SUCCES'
+    
+    
+    def submit_calculation(self, hazards, exposures, impact_function_id, impact, bounding_box, comment):
+        """Start calculation in the background and return immediately
+        
+        Arguments are as for calculate.
+        
+        Returns
+            job id to be passed to job_status and job_result
+            
+        Note
+            Jobs wait in a bounded queue and only a limited number of them run
+            concurrently. An exception is raised if the queue is full.
+        """
+        
+        return self.JOBS.submit(self.calculate, 
+                                (hazards, exposures, impact_function_id, impact, bounding_box, comment),
+                                name='calculate %s' % impact_function_id)
+        
+        
+    def job_status(self, job_id):
+        """Get status of job started with submit_calculation
+        
+        Arguments
+            job_id = id returned by submit_calculation
+            
+        Returns
+            a hash with fields
+                'status': one of 'queued', 'running', 'finished' or 'failed'
+                'stage': current stage of a running job ('download', 'compute' or 'upload')
+                'progress': fraction of the current stage completed
+                'timings': hash of seconds spent in each stage, waiting in the queue ('queued') 
+                           and running in total ('total')
+                'error': error message of a failed job
+        """
+        
+        return self.JOBS.get_status(job_id)
         
-        # Upload result (FIXME(Ole): still super hacky and not at all general)
-        username, userpass, geoserver_url, layer_name, workspace = self.split_geoserver_layer_handle(impact)
         
-        output_file = 'data/%s.asc' % layer_name
-        write_coverage_to_ascii(F, output_file, 
-                                xllcorner = bounding_box[0],
-                                yllcorner = bounding_box[1],
-                                cellsize=0.030741064,
-                                nodata_value=-9999,
-                                # FIXME(Ole): Need to get projection for haz and exp from GeoServer. For now use example.
-                                projection=open('data/test_grid.prj').read()) 
-                                                
-        # And upload it again
-        lh = self.create_geoserver_layer_handle(username, 
-                                                userpass, 
-                                                geoserver_url, 
-                                                '',
-                                                workspace)
+    def job_result(self, job_id):
+        """Get result of job started with submit_calculation
+        
+        Arguments
+            job_id = id returned by submit_calculation
+            
+        Returns
+            the value calculate would have returned. If the calculation failed or
+            has not finished yet, an Exception is raised.
+        """
+        
+        return self.JOBS.get_result(job_id)
+    
+    
+    def get_cache_statistics(self):
+        """Get statistics of the impact and coverage caches
+        
+        Returns
+            a hash with fields 'impacts' and 'coverages', each a hash with the
+            number of entries, hits and misses. Coverage statistics also include
+            the number of bytes cached.
+        """
+        
+        return {'impacts': self.IMPACT_CACHE.get_statistics(),
+                'coverages': coverage_cache.cache.get_statistics()}
+        
+        
+    def calculate_scenarios(self, hazards, exposure, impact_function_id, impacts, bounding_box, comment):
+        """Calculate impact of several hazard scenarios on the same exposure
+        
+        Arguments
+            hazards = A list of hazard layer handles, one per scenario. 
+                      They are resampled onto the grid of the exposure layer.
+            exposure = Exposure layer handle. It is downloaded and read only once.
+            impact_function_id = Id of the impact function to be run 
+            impacts = A list of handles to the output impact layers, one per hazard
+            bounding_box = ...
+            comment = String with comment for output metadata
+        
+        Returns
+            list of hashes, one per scenario, with fields
+                'layer': name of impact layer as workspace:layer_name
+                'total': impact summed over the bounding box 
+                
+        Note
+            All scenarios are evaluated together tile by tile in one vectorised pass
+            over a stack of hazard blocks.
+        """
+        
+        if type(hazards) != type([]):
+            hazards = [hazards]
+            
+        if type(impacts) != type([]):
+            impacts = [impacts]            
+            
+        msg = 'There must be one impact layer per hazard layer. '
+        msg += 'I got %i hazards and %i impacts' % (len(hazards), len(impacts))
+        assert len(hazards) == len(impacts), msg
+        
+        # Download all data concurrently
+        rasters = self._get_raster_layers(hazards + [exposure], bounding_box)
+        hazard_layers = rasters[:-1]
+        E = rasters[-1]
+        
+        impact_function = self._get_impact_function(impact_function_id)
+        
+        # Bring hazards onto the exposure grid
+        target_grid = grid_alignment.get_grid(E)
+        hazard_layers = [grid_alignment.align_raster(H, target_grid, self.HAZARD_RESAMPLING)
+                         for H in hazard_layers]
+        
+        # Output rasters take their georeference from the exposure layer. 
+        # They are assembled in GDAL's in-memory file system.
+        nrows, ncols = E.get_shape()
+        geotransform = E.get_geotransform()
+        projection = E.get_projection()
+        writers = []
+        try:
+            for impact in impacts:
+                layer_name = self.split_geoserver_layer_handle(impact)[3]
+                writers.append(RasterWriter(get_memory_filename(layer_name), nrows, ncols,
+                                            geotransform, projection,
+                                            nodata_value=-9999))
 
-        self.upload_geoserver_layer(output_file, lh)
+            # Each tile holds a stack of hazard and impact blocks and one exposure block
+            nbuffers = (impact_function.buffers - 1)*len(hazards) + 1
+            tile_shape = impact_engine.get_tile_shape(nrows, ncols, 
+                                                      nbuffers=nbuffers,
+                                                      memory=self.TILE_MEMORY)
+            totals = impact_engine.calculate_scenarios(hazard_layers, E, writers,
+                                                       impact_function, 
+                                                       tile_shape=tile_shape)
+            
+            result = []
+            for impact, writer, total in zip(impacts, writers, totals):
+                writer.close()
+                F = read_coverage(writer.filename).get_data()
+                result.append({'layer': self._publish_impact_layer(F, geotransform, projection, impact),
+                               'total': float(total)})
+        finally:
+            for writer in writers:
+                remove_memory_file(writer.filename)
+            
+        return result
         
         
-        return 'SUCCES'
+    def _get_impact_function(self, impact_function_id):
+        """Get impact function to be evaluated by the impact engine
+        
+        If a lookup table resolution is configured, the transfer function is tabulated.
+        """
+        
+        impact_function = impact_functions.get_impact_function(impact_function_id)
+        if self.LOOKUP_TABLE_RESOLUTION and impact_function.hazard_range is not None:
+            impact_function = impact_functions.tabulate(impact_function, 
+                                                        self.LOOKUP_TABLE_RESOLUTION,
+                                                        self.LOOKUP_TABLE_INTERPOLATE)
+        return impact_function
+        
+        
+    def _publish_impact_layer(self, A, geotransform, projection, impact):
+        """Publish calculated impact as styled raster layer
+        
+        Arguments
+            A = array with calculated impact. NODATA is -9999.
+            geotransform, projection = georeference of A
+            impact = handle to output impact level layer
+            
+        Returns
+            name of published layer as workspace:layer_name
+            
+        Note
+            The array is encoded and uploaded in memory and styled from its 
+            own range of values (see Geoserver.store_raster_data).
+        """
+        
+        username, userpass, geoserver_url, layer_name, workspace = self.split_geoserver_layer_handle(impact)
+        
+        gs = self._get_geoserver(geoserver_url, username, userpass)
+        gs.get_workspace(workspace)
+        name = gs.store_raster_data(A, geotransform, projection, layer_name, workspace,
+                                    nodata_value=-9999)
+        
+        # Results previously computed into or from this layer are no longer valid
+        self.IMPACT_CACHE.set_fingerprint(self._get_layer_id(impact), 
+                                          impact_cache.get_array_fingerprint(A, geotransform))
+        
+        return name
+    
+    
+    def _get_geoserver(self, geoserver_url, username, userpass):
+        """Get shared, verified connection to geoserver
+        """
+        
+        return geoserver.get_geoserver(geoserver_url, username, userpass, 
+                                       ttl=self.GEOSERVER_TTL,
+                                       catalog_ttl=self.CATALOG_TTL)
+        
+        
+    def _get_layer_id(self, name):
+        """Get identifier of layer independent of the credentials in its handle
+        """
+        
+        username, userpass, geoserver_url, layer_name, workspace = self.split_geoserver_layer_handle(name)
+        return impact_cache.get_layer_id(geoserver_url, workspace, layer_name)
+        
+        
+    def _is_cached(self, key, impact):
+        """Check whether impact layer computed for key is cached and still published
+        
+        If the layer has been removed from geoserver by other means, 
+        the cache entry is dropped so that the layer is published again.
+        """
+        
+        if self.IMPACT_CACHE.get(key) is None:
+            return False
+            
+        username, userpass, geoserver_url, layer_name, workspace = self.split_geoserver_layer_handle(impact)
+        gs = self._get_geoserver(geoserver_url, username, userpass)
+        if gs.layer_exists(layer_name, workspace):
+            return True
+            
+        self.IMPACT_CACHE.discard(key)
+        return False
+        
+        
+    def _get_impact_key(self, fingerprints, impact_function, bounding_box, impact_id):
+        """Get cache key of impact calculation including the settings that affect its result
+        """
+        
+        options = (self.TARGET_GRID, self.HAZARD_RESAMPLING, self.EXPOSURE_RESAMPLING,
+                   self.LOOKUP_TABLE_RESOLUTION, self.LOOKUP_TABLE_INTERPOLATE)
+        return impact_cache.get_key(fingerprints, impact_function, bounding_box, impact_id, options)
     
     
     def suggest_impact_func_ids(self, hazards, exposures):
@@ -266,8 +600,23 @@ class RiabAPI():
         
         Returns
             impact_function_ids = array of ids of the impact function that can be run
+            
+        Note
+            Impact functions are matched by keywords in the layer names.
         """
-        return 'ERROR: NO IMPLEMENTATION'
+        
+        # Make sure hazards and exposures are lists
+        if type(hazards) != type([]):
+            hazards = [hazards]
+            
+        if type(exposures) != type([]):
+            exposures = [exposures]            
+        
+        hazard_names = [self.split_geoserver_layer_handle(h)[3] for h in hazards]
+        exposure_names = [self.split_geoserver_layer_handle(e)[3] for e in exposures]
+        
+        return [f.id for f in impact_functions.suggest_impact_functions(hazard_names, 
+                                                                        exposure_names)]
 
             
     def get_impact_func_details(self, impact_function_id):
@@ -280,20 +629,42 @@ class RiabAPI():
             a hash containing details of the impact function:
             mandatory fields are: 'Name', 'Description', 'Author'
         """
-        return 'ERROR: NO IMPLEMENTATION'
+        
+        return impact_functions.get_impact_function(impact_function_id).get_details()
     
     
-    def get_all_impact_functions(self):
-        """Return a list of all impact functions 
+    def get_lookup_table_error(self, impact_function_id, resolution):
+        """Return error of lookup table evaluation against exact evaluation
         
         Arguments
             impact_function_id = id of the impact function
+            resolution = number of table entries per unit of hazard intensity
+                         (0 means the resolution configured for calculate)
         
         Returns
-            a hash containing details of the impact function:
-            mandatory fields are: 'Name', 'Description', 'Author'
+            a hash with fields 'max_absolute_error' and 'max_relative_error'
+            for the hazard transfer function.
         """
-        return 'ERROR: NO IMPLEMENTATION'
+        
+        if not resolution:
+            resolution = self.LOOKUP_TABLE_RESOLUTION
+        
+        impact_function = impact_functions.get_impact_function(impact_function_id)
+        table = impact_functions.get_lookup_table(impact_function, 
+                                                  resolution, 
+                                                  self.LOOKUP_TABLE_INTERPOLATE)
+        return table.get_error_bound()
+        
+        
+    def get_all_impact_functions(self):
+        """Return a list of all impact functions 
+        
+        Returns
+            a list of hashes containing details of each impact function:
+            mandatory fields are: 'Id', 'Name', 'Description', 'Author'
+        """
+        
+        return [f.get_details() for f in impact_functions.get_all_impact_functions()]
     
     
     #----------------------
@@ -318,7 +689,7 @@ class RiabAPI():
 
         # Unpack and connect
         username, userpass, geoserver_url, layer_name, workspace = self.split_geoserver_layer_handle(name)
-        gs = geoserver.Geoserver(geoserver_url, username, userpass)                                  
+        gs = self._get_geoserver(geoserver_url, username, userpass)                                  
         
         # Check that workspace exists
         gs.get_workspace(workspace)
@@ -326,6 +697,14 @@ class RiabAPI():
         # Upload
         gs.upload_layer(filename=data, workspace=workspace, verbose=False)
         
+        # Record fingerprint of the new content, invalidating results computed from earlier versions
+        uploaded_name = os.path.splitext(os.path.basename(data))[0]
+        layer_id = impact_cache.get_layer_id(geoserver_url, workspace, uploaded_name)
+        if os.path.splitext(data)[1] in ['.asc', '.txt', '.tif']:
+            self.IMPACT_CACHE.set_fingerprint(layer_id, impact_cache.get_file_fingerprint(data))
+        else:
+            self.IMPACT_CACHE.invalidate(layer_id)
+        
         return 'SUCCESS'
 
     
@@ -354,7 +733,7 @@ class RiabAPI():
         
         # Unpack and connect
         username, userpass, geoserver_url, layer_name, workspace = self.split_geoserver_layer_handle(name)
-        gs = geoserver.Geoserver(geoserver_url, username, userpass)                                  
+        gs = self._get_geoserver(geoserver_url, username, userpass)                                  
 
         # Check that workspace exists
         gs.get_workspace(workspace)
@@ -402,7 +781,7 @@ class RiabAPI():
 
         # Unpack and connect
         username, userpass, geoserver_url, layer_name, workspace = self.split_geoserver_layer_handle(name)
-        gs = geoserver.Geoserver(geoserver_url, username, userpass)                                  
+        gs = self._get_geoserver(geoserver_url, username, userpass)                                  
         
         # Check that workspace exists
         gs.get_workspace(workspace)
@@ -416,6 +795,39 @@ class RiabAPI():
         return raster
         
             
+
+    def _get_raster_layers(self, names, bounding_box):
+        """Get several raster layers concurrently
+        
+        Arguments
+            names = list of fully qualified layer names
+            bounding box = array bounds of the downloaded maps
+            
+        Returns
+            list of Raster objects in the same order as names
+            
+        Note
+            Layers are fetched on a pool of at most FETCH_THREADS threads and each
+            distinct layer is fetched only once. The first exception raised by any
+            of the downloads is propagated.
+        """
+        
+        unique_names = []
+        for name in names:
+            if name not in unique_names:
+                unique_names.append(name)
+                
+        pool = ThreadPool(max(1, min(self.FETCH_THREADS, len(unique_names))))
+        try:
+            rasters = pool.map(lambda name: self.get_raster_data(name, bounding_box), 
+                               unique_names)
+        finally:
+            pool.close()
+            pool.join()
+            
+        layers = dict(zip(unique_names, rasters))    
+        return [layers[name] for name in names]
+            
     
     def download_geoserver_vector_layer(self):
         """Download data to the specified geoserver
@@ -433,10 +845,11 @@ class RiabAPI():
         
         # Unpack and connect
         username, userpass, geoserver_url, layer_name, workspace = self.split_geoserver_layer_handle(name)
-        gs = geoserver.Geoserver(geoserver_url, username, userpass)                                  
+        gs = self._get_geoserver(geoserver_url, username, userpass)                                  
         
         # Delete layer
         gs.delete_layer(layer_name, workspace, verbose=False)
+        self.IMPACT_CACHE.invalidate(impact_cache.get_layer_id(geoserver_url, workspace, layer_name))
 
         # Delete style
         #gs.delete_style(layer_name, verbose=False)        
@@ -449,10 +862,16 @@ class RiabAPI():
         """
         
         # Connect
-        gs = geoserver.Geoserver(geoserver_url, username, userpass)                                  
+        gs = self._get_geoserver(geoserver_url, username, userpass)                                  
         
-        # Delete layer
-        gs.delete_all_layers(verbose=False)
+        # Delete layers
+        results = gs.delete_all_layers(verbose=False)
+        self.IMPACT_CACHE.clear()
+        
+        errors = ['%s: %s' % (result['layer'], result['error']) for result in results if result['error']]
+        if errors:
+            msg = 'Could not delete layers on geoserver %s: %s' % (geoserver_url, '; '.join(errors))
+            raise Exception(msg)
 
         return 'SUCCESS'        
     
@@ -8,6 +8,11 @@ import sys
 import unittest
 import common
 import riab_api
+import impact_functions
+import impact_cache
+import impact_engine
+import jobs
+from geoserver_api import geoserver, wcs_metadata, coverage_cache, encoding
 import argparse
 
 from rpc_server import RPCServer, stop_server
@@ -17,6 +22,40 @@ class RiabServer(RPCServer):
     """Base class for the Risk-in-a-Box server"""
     
     def __init__(self, server_url, port):
+        
+        # Fork the worker processes of the impact engine before any threads are started
+        if common.workers != 1:
+            impact_engine.start_pool(common.workers)
+        
+        # Configure the impact engine
+        riab_api.RiabAPI.TILE_MEMORY = common.tile_memory
+        riab_api.RiabAPI.WORKERS = common.workers
+        riab_api.RiabAPI.FETCH_THREADS = common.fetch_threads
+        riab_api.RiabAPI.LOOKUP_TABLE_RESOLUTION = common.lookup_table_resolution
+        riab_api.RiabAPI.LOOKUP_TABLE_INTERPOLATE = common.lookup_table_interpolate
+        riab_api.RiabAPI.TARGET_GRID = common.target_grid
+        riab_api.RiabAPI.HAZARD_RESAMPLING = common.hazard_resampling
+        riab_api.RiabAPI.EXPOSURE_RESAMPLING = common.exposure_resampling
+        riab_api.RiabAPI.IMPACT_CACHE = impact_cache.ImpactCache(common.impact_cache_size)
+        riab_api.RiabAPI.JOBS = jobs.JobManager(common.max_running_jobs, common.max_queued_jobs)
+        riab_api.RiabAPI.GEOSERVER_TTL = common.geoserver_ttl
+        riab_api.RiabAPI.CATALOG_TTL = common.catalog_ttl
+
+        # Configure caching of WCS metadata (an empty directory gives the default)
+        wcs_metadata.cache = wcs_metadata.MetadataCache(common.wcs_metadata_ttl,
+                                                        common.wcs_metadata_dir or wcs_metadata.METADATA_DIR)
+        coverage_cache.cache = coverage_cache.CoverageCache(common.coverage_cache_size)
+        geoserver.Geoserver.DOWNLOAD_CHUNK_CELLS = common.download_chunk_cells
+        geoserver.Geoserver.DOWNLOAD_THREADS = common.download_threads
+        
+        # Configure encoding of uploaded rasters
+        encoding.DATA_TYPE = common.upload_data_type or None
+        encoding.COMPRESSION = common.upload_compression
+        encoding.TILE_SIZE = common.upload_tile_size
+        encoding.OVERVIEWS = common.upload_overviews
+        
+        # Discover and compile impact functions once
+        impact_functions.load_impact_functions()
            
         # Register the api
         RPCServer.__init__(self, server_url, port, riab_api.RiabAPI, riab_api)
@@ -5,6 +5,7 @@
 # Created: 01/16/2011
 
 from SimpleXMLRPCServer import SimpleXMLRPCServer
+from SocketServer import ThreadingMixIn
 from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler
 import xmlrpclib
 import socket
@@ -35,12 +36,17 @@ class APITest():
         print 'Hello'
         return True
         
-class XMLRPCServer_overload(SimpleXMLRPCServer):
+class XMLRPCServer_overload(ThreadingMixIn, SimpleXMLRPCServer):
     """Subclass to allow clean exit
     
     Taken from http://code.activestate.com/recipes/114579-remotely-exit-a-xmlrpc-server-cleanly/
+    
+    Each request is handled in its own thread so that a long call does not 
+    hold up other clients.
     """
     
+    daemon_threads = True
+    
     def serve_forever(self):
 	self.quit = 0
 	while not self.quit:
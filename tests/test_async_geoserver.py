@@ -0,0 +1,200 @@
+import sys, os
+import time
+import unittest
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+# The event loop variant is optional and needs trollius
+try:
+    import trollius as asyncio
+    from trollius import From, Return
+except ImportError:
+    asyncio = None
+else:
+    from geoserver_api.async_geoserver import AsyncRestClient, get_async_client, get_async_geoserver
+
+from geoserver_api.rest_client import HTTPError
+from utilities import RestHandler, RestServer
+
+
+class SlowHandler(RestHandler):
+    """Imitation of the Geoserver REST API that is slow to answer requests for 'slow' resources
+    """
+
+    def do_request(self):
+        if self.path.find('slow') > 0:
+            time.sleep(0.5)
+        RestHandler.do_request(self)
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_request
+
+
+class QuietServer(RestServer):
+    """Server accepting bursts of connections and ignoring clients that disconnect before the response is sent
+    """
+
+    request_queue_size = 64
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+@unittest.skipIf(asyncio is None, 'trollius is not installed')
+class Test_async_geoserver(unittest.TestCase):
+
+    def setUp(self):
+        self.server = QuietServer(SlowHandler)
+        self.url = self.server.url
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        # Let the loop close the pooled connections so the server threads serving them finish
+        get_async_client(self.url, 'admin', 'geoserver', loop=self.loop).close()
+        self.loop.run_until_complete(asyncio.sleep(0.1, loop=self.loop))
+        self.loop.close()
+
+        self.server.stop()
+
+
+    def test_concurrent_requests(self):
+        """Test that concurrent requests share a bounded pool of keep-alive connections
+        """
+
+        client = AsyncRestClient(self.url, 'admin', 'geoserver', max_connections=8, loop=self.loop)
+        requests = [client.request('GET', 'workspaces/hazard') for i in range(200)]
+        results = self.loop.run_until_complete(asyncio.gather(*requests, loop=self.loop))
+
+        for status, body in results:
+            assert status == 200
+            assert body.startswith('Workspace "hazard"')
+
+        assert len(self.server.requests) == 200
+        assert self.server.requests[0][1] == '/geoserver/rest/workspaces/hazard'
+        assert len(set([request[4] for request in self.server.requests])) <= 8
+
+        # Sequential requests reuse one connection
+        self.server.requests = []
+        for i in range(3):
+            self.loop.run_until_complete(client.request('GET', 'workspaces/hazard'))
+        assert len(set([request[4] for request in self.server.requests])) == 1
+        client.close()
+
+
+    def test_errors(self):
+        """Test that error statuses raise HTTPError and known conditions are tolerated
+        """
+
+        gs = self.loop.run_until_complete(get_async_geoserver(self.url, 'admin', 'geoserver', loop=self.loop))
+
+        try:
+            self.loop.run_until_complete(gs.client.request('GET', 'workspaces/missing'))
+        except HTTPError, e:
+            assert e.status == 404
+            assert str(e).find('No such resource') > 0
+        else:
+            msg = 'Missing resource should have raised HTTPError'
+            raise Exception(msg)
+
+        # Existing workspaces are accepted
+        self.loop.run_until_complete(gs.create_workspace('existing'))
+
+        try:
+            self.loop.run_until_complete(gs.get_workspace('missing'))
+        except Exception, e:
+            assert str(e).find('Could not find workspace missing') == 0
+        else:
+            msg = 'Missing workspace should have raised an exception'
+            raise Exception(msg)
+
+
+    def test_cancellation(self):
+        """Test that cancelled requests close their connection
+        """
+
+        client = AsyncRestClient(self.url, 'admin', 'geoserver', loop=self.loop)
+        self.loop.run_until_complete(client.request('GET', 'workspaces/hazard'))
+        assert len(client.idle_connections.values()[0]) == 1
+
+        @asyncio.coroutine
+        def cancel():
+            task = asyncio.Task(client.request('GET', 'workspaces/slow'), loop=self.loop)
+            yield From(asyncio.sleep(0.1, loop=self.loop))
+            task.cancel()
+            try:
+                yield From(task)
+            except asyncio.CancelledError:
+                raise Return(True)
+            raise Return(False)
+
+        assert self.loop.run_until_complete(cancel())
+        assert client.idle_connections.values()[0] == []
+
+        # Client remains usable
+        status, body = self.loop.run_until_complete(client.request('GET', 'workspaces/hazard'))
+        assert status == 200
+        client.close()
+
+
+    def test_upload_and_delete(self):
+        """Test that layers are uploaded and deleted concurrently with per layer results
+        """
+
+        filenames = ['async_upload_test_%i.zip' % i for i in range(20)]
+        for filename in filenames:
+            fid = open(filename, 'wb')
+            fid.write('zipped shapefile %s' % filename)
+            fid.close()
+
+        gs = self.loop.run_until_complete(get_async_geoserver(self.url, 'admin', 'geoserver', loop=self.loop))
+        try:
+            results = self.loop.run_until_complete(gs.upload_layers(filenames + ['unknown.xyz'], 'exposure'))
+        finally:
+            for filename in filenames:
+                os.remove(filename)
+
+        assert [result['layer'] for result in results[:-1]] == ['exposure:async_upload_test_%i' % i
+                                                                for i in range(20)]
+        assert results[-1]['error'].find('Unknown extention') > 0
+
+        body = [r[2] for r in self.server.requests
+                if r[1] == '/geoserver/rest/workspaces/exposure/datastores/async_upload_test_3/file.shp'][0]
+        assert body == 'zipped shapefile async_upload_test_3.zip'
+
+        rest = '/geoserver/rest/'
+        self.server.listings = {
+            rest + 'workspaces': '{"workspaces": {"workspace": [{"name": "scratch"}]}}',
+            rest + 'workspaces/scratch/coveragestores':
+                '{"coverageStores": {"coverageStore": [{"name": "impact"}, {"name": "missing_grid"}]}}',
+            rest + 'workspaces/scratch/datastores': '{"dataStores": ""}',
+            rest + 'styles': '{"styles": {"style": [{"name": "impact"}, {"name": "raster"}]}}'}
+
+        results = self.loop.run_until_complete(gs.delete_all_layers())
+        assert [result['layer'] for result in results] == ['scratch:impact', 'scratch:missing_grid']
+        assert results[0]['style'] == 'impact'
+        assert results[1]['error'].find('No such resource') > 0
+        assert results[1]['style_error'] is None
+
+        deletions = sorted([r[1] for r in self.server.requests if r[0] == 'DELETE'])
+        assert deletions == [rest + 'styles/impact?purge=true',
+                             rest + 'workspaces/scratch/coveragestores/impact?recurse=true',
+                             rest + 'workspaces/scratch/coveragestores/missing_grid?recurse=true']
+
+        # Vector layers are deleted with their data store
+        self.server.failures = {rest + 'workspaces/exposure/coveragestores/roads?recurse=true': (404, 'No such store')}
+        self.server.requests = []
+        self.loop.run_until_complete(gs.delete_layer('roads', 'exposure'))
+        assert [r[1] for r in self.server.requests] == [
+            rest + 'workspaces/exposure/coveragestores/roads?recurse=true',
+            rest + 'workspaces/exposure/datastores/roads?recurse=true']
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_async_geoserver, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,86 @@
+import sys, os
+import unittest
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+from geoserver_api.rest_client import get_client
+from geoserver_api.geoserver import get_geoserver
+from geoserver_api.catalog import CatalogCache
+from utilities import RestServer
+
+
+class Test_catalog(unittest.TestCase):
+
+    def setUp(self):
+        self.server = RestServer()
+        self.url = self.server.url
+
+    def tearDown(self):
+        # Close pooled connections so the server threads serving them finish
+        get_client(self.url, 'admin', 'geoserver').close()
+
+        self.server.stop()
+
+
+    def test_catalog_cache(self):
+        """Test that catalog lookups are cached until they expire or are invalidated
+        """
+
+        def count(path):
+            return len([r for r in self.server.requests if r[1] == '/geoserver/rest/' + path])
+
+        gs = get_geoserver(self.url, 'admin', 'geoserver', catalog_ttl=60)
+        for i in range(3):
+            gs.get_workspace('hazard')
+        assert count('workspaces/hazard') == 1
+
+        # Known styles are not created again
+        gs.upload_style('shakemap', 'data/test_grid.asc')
+        gs.upload_style('shakemap', 'data/test_grid.asc')
+        assert count('styles') == 1
+        assert count('styles/shakemap') == 2
+
+        gs.delete_style('shakemap')
+        gs.upload_style('shakemap', 'data/test_grid.asc')
+        assert count('styles') == 2
+
+        # Style descriptions are fetched again after the style is replaced
+        self.server.listings['/geoserver/rest/styles/shakemap'] = '{"style": {"name": "shakemap"}}'
+        assert gs.find_style('shakemap') == {'style': {'name': 'shakemap'}}
+        gs.find_style('shakemap')
+        assert count('styles/shakemap') == 4
+        gs.upload_style('shakemap', 'data/test_grid.asc')
+        gs.find_style('shakemap')
+        assert count('styles/shakemap') == 6
+
+        # Checks bypassing the cache are always sent to the server
+        gs.get_workspace('hazard', use_cache=False)
+        assert count('workspaces/hazard') == 2
+
+        # Expired entries are looked up again
+        gs = get_geoserver(self.url, 'admin', 'geoserver', catalog_ttl=-1)
+        gs.get_workspace('hazard')
+        assert count('workspaces/hazard') == 3
+
+        cache = CatalogCache()
+        cache.set('workspace', 'a')
+        cache.set('workspace', 'b')
+        cache.set('style', 'a', {'name': 'a'})
+        cache.invalidate('workspace', 'a')
+        assert cache.get('workspace', 'a') is None
+        assert cache.get('workspace', 'b')
+        cache.invalidate('workspace')
+        assert cache.get('workspace', 'b') is None
+        assert cache.get('style', 'a') == {'name': 'a'}
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_catalog, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,113 @@
+import sys, os
+import cgi
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import urlparse
+import BaseHTTPServer
+from multiprocessing.pool import ThreadPool
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+from geoserver_api import wcs_metadata
+from geoserver_api.coverage import Coverage
+from geoserver_api.mosaic import split_bounding_box
+from test_wcs_metadata import Server, describe
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Imitation of a WCS server answering GetCoverage requests with the requested bounding box
+    """
+
+    def do_GET(self):
+        query = cgi.parse_qs(urlparse.urlparse(self.path)[4])
+
+        if query['request'][0] == 'DescribeCoverage':
+            data = describe([96.0, -1.0, 100.0, 4.0], 0.5)
+        else:
+            # Give concurrent requests time to interleave
+            time.sleep(0.01)
+            data = query['bbox'][0]
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/tiff')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class Test_coverage(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('localhost', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+        self.url = 'http://localhost:%i/geoserver/wcs' % self.server.server_address[1]
+
+        # Keep metadata of the imitated server out of the shared cache
+        self.directory = tempfile.mkdtemp()
+        self.metadata_cache = wcs_metadata.cache
+        wcs_metadata.cache = wcs_metadata.MetadataCache(directory=self.directory)
+
+    def tearDown(self):
+        wcs_metadata.cache = self.metadata_cache
+        shutil.rmtree(self.directory)
+
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def test_concurrent_reads(self):
+        """Test that chunks read concurrently from one coverage each get their own bounding box
+        """
+
+        c = Coverage(self.url, 'hazard:shakemap')
+        chunks = split_bounding_box(c.bbox, (c.resx, c.resy), 4)
+        assert len(chunks) == 20
+
+        pool = ThreadPool(8)
+        try:
+            results = pool.map(lambda bounding_box: c.read(bounding_box=bounding_box), chunks*5)
+        finally:
+            pool.close()
+            pool.join()
+
+        for bounding_box, data in zip(chunks*5, results):
+            assert data == '%.12f,%.12f,%.12f,%.12f' % tuple(bounding_box)
+
+        # The object is not modified
+        assert c.bbox == [96.0, -1.0, 100.0, 4.0]
+
+        # URLs built concurrently are not mixed up, even if threads switch as often as possible
+        bounding_boxes = [[96.0 + i*0.0001, -1.0, 100.0, 4.0] for i in range(20000)]
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        pool = ThreadPool(8)
+        try:
+            urls = pool.map(lambda bounding_box: c.get_url(bounding_box=bounding_box), bounding_boxes, 10)
+        finally:
+            pool.close()
+            pool.join()
+            sys.setcheckinterval(interval)
+
+        for bounding_box, url in zip(bounding_boxes, urls):
+            assert url.find('&bbox=%.12f,' % bounding_box[0]) > 0
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_coverage, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,154 @@
+import sys, os
+import unittest
+import subprocess
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+from geoserver_api.coverage_cache import CoverageCache
+
+
+URL = 'http://localhost:8080/geoserver/wcs'
+BBOX = [96.0, -1.0, 100.0, 4.0]
+RESOLUTION = (0.5, 0.5)
+
+
+class Test_coverage_cache(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+
+    def test_hits_and_misses(self):
+        """Test that coverages are returned from the cache and counted
+        """
+
+        cache = CoverageCache()
+        key = cache.get_key(URL, 'hazard:shakemap', BBOX, RESOLUTION)
+        assert cache.get(key) is None
+
+        cache.put(key, 'GeoTIFF data')
+        assert cache.get(key) == 'GeoTIFF data'
+
+        # Equivalent URLs and numeric types give the same key
+        assert cache.get(cache.get_key(URL + '/', 'hazard:shakemap',
+                                       [96, -1, 100, 4], RESOLUTION)) == 'GeoTIFF data'
+
+        # Other bounding boxes, resolutions and formats are different coverages
+        assert cache.get(cache.get_key(URL, 'hazard:shakemap', [96, -1, 99, 4], RESOLUTION)) is None
+        assert cache.get(cache.get_key(URL, 'hazard:shakemap', BBOX, (1.0, 1.0))) is None
+        assert cache.get(cache.get_key(URL, 'hazard:shakemap', BBOX, RESOLUTION, 'ArcGrid')) is None
+
+        statistics = cache.get_statistics()
+        assert statistics == {'entries': 1, 'bytes': 12, 'hits': 2, 'misses': 4, 'partial_hits': 0}
+        cache.clear()
+
+
+    def test_overlapping(self):
+        """Test that cached coverages overlapping a request are found
+        """
+
+        cache = CoverageCache()
+        west = cache.get_key(URL, 'hazard:shakemap', [96.0, -1.0, 98.0, 4.0], RESOLUTION)
+        east = cache.get_key(URL, 'hazard:shakemap', [98.0, -1.0, 100.0, 4.0], RESOLUTION)
+        cache.put(west, 'west')
+        cache.put(east, 'east')
+        cache.put(cache.get_key(URL, 'hazard:shakemap', BBOX, (1.0, 1.0)), 'coarse')
+        cache.put(cache.get_key(URL, 'exposure:population', BBOX, RESOLUTION), 'population')
+
+        # Only the same layer and resolution qualify, most recently used first
+        key = cache.get_key(URL, 'hazard:shakemap', [97.0, 0.0, 99.0, 3.0], RESOLUTION)
+        assert cache.get_overlapping(key) == [([98.0, -1.0, 100.0, 4.0], 'east'),
+                                              ([96.0, -1.0, 98.0, 4.0], 'west')]
+
+        # A containing coverage suffices
+        key = cache.get_key(URL, 'hazard:shakemap', [96.5, 0.0, 97.5, 3.0], RESOLUTION)
+        assert cache.get_overlapping(key) == [([96.0, -1.0, 98.0, 4.0], 'west')]
+
+        key = cache.get_key(URL, 'hazard:shakemap', [100.0, 0.0, 101.0, 3.0], RESOLUTION)
+        assert cache.get_overlapping(key) == []
+
+        assert cache.get_statistics()['partial_hits'] == 2
+        cache.clear()
+
+
+    def test_byte_budget(self):
+        """Test that least recently used coverages are evicted to stay within the byte budget
+        """
+
+        cache = CoverageCache(max_bytes=25)
+        keys = [cache.get_key(URL, 'exposure:population_%i' % i, BBOX, RESOLUTION)
+                for i in range(3)]
+
+        cache.put(keys[0], 'a'*10)
+        cache.put(keys[1], 'b'*10)
+        assert cache.get(keys[0]) == 'a'*10
+
+        cache.put(keys[2], 'c'*10)
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]) == 'a'*10
+        assert cache.get(keys[2]) == 'c'*10
+        assert cache.get_statistics()['bytes'] == 20
+
+        # Coverages exceeding the budget are not cached
+        cache.put(keys[1], 'b'*26)
+        assert cache.get(keys[1]) is None
+        cache.clear()
+
+
+    def test_invalidation(self):
+        """Test that uploading a layer makes its cached coverages unreachable
+        """
+
+        cache = CoverageCache()
+        key = cache.get_key(URL, 'hazard:shakemap', BBOX, RESOLUTION)
+        other = cache.get_key(URL, 'exposure:population', BBOX, RESOLUTION)
+        cache.put(key, 'old')
+        cache.put(other, 'population')
+
+        cache.invalidate(URL, 'hazard:shakemap')
+        assert cache.get(key) is None
+        assert cache.get(other) == 'population'
+
+        # The new revision gives a new key
+        new_key = cache.get_key(URL, 'hazard:shakemap', BBOX, RESOLUTION)
+        assert new_key != key
+
+        # Downloads started before the upload are not cached
+        cache.put(key, 'old')
+        assert cache.get_statistics()['entries'] == 1
+
+        cache.put(new_key, 'new')
+        assert cache.get(new_key) == 'new'
+        cache.clear()
+
+
+    def test_cleanup_at_exit(self):
+        """Test that the cache directory is removed when the process exits
+        """
+
+        script = ('import sys; sys.path.append(%r)\n'
+                  'from geoserver_api.coverage_cache import CoverageCache\n'
+                  'cache = CoverageCache()\n'
+                  'cache.put(cache.get_key(%r, "hazard:shakemap", %r, %r), "data")\n'
+                  'print cache.directory\n' % (source_path, URL, BBOX, RESOLUTION))
+
+        process = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE)
+        directory = process.communicate()[0].strip()
+        assert process.returncode == 0
+        assert directory
+        assert not os.path.exists(directory)
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_coverage_cache, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,120 @@
+import sys, os
+import numpy
+import unittest
+from osgeo import gdal
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+from geoserver_api.encoding import get_creation_options, get_overview_levels, encode_geotiff, encode_array
+from geoserver_api.raster import read_coverage, MemoryRaster
+
+
+class Test_encoding(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+
+    def test_creation_options(self):
+        """Test that compression, predictor and tiling follow the data type
+        """
+
+        options = get_creation_options('Float32', 'deflate', 256)
+        assert options == ['PROFILE=GEOTIFF', 'COMPRESS=DEFLATE', 'PREDICTOR=3',
+                           'TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256']
+
+        assert 'PREDICTOR=2' in get_creation_options('Int16', 'LZW', 256)
+        assert get_creation_options('Float64', 'NONE', 0) == ['PROFILE=GEOTIFF']
+
+
+    def test_overview_levels(self):
+        """Test that overviews are added down to about the size of a tile
+        """
+
+        assert get_overview_levels(7, 5, 256) == []
+        assert get_overview_levels(256, 100, 256) == []
+        assert get_overview_levels(300, 100, 256) == [2]
+        assert get_overview_levels(1000, 3000, 256) == [2, 4, 8, 16]
+
+
+    def test_encode_geotiff(self):
+        """Test that encoded rasters keep values, georeference and NODATA
+        """
+
+        filename = 'data/test_grid.asc'
+        R = MemoryRaster(encode_geotiff(filename), 'encoded_test_grid')
+        reference = read_coverage(filename)
+        assert gdal.GetDataTypeName(R.band.DataType) == 'Float32'
+        assert R.fid.GetMetadataItem('COMPRESSION', 'IMAGE_STRUCTURE') == 'DEFLATE'
+        assert numpy.allclose(R.get_data(), reference.get_data())
+        assert numpy.allclose(R.get_geotransform(), reference.get_geotransform())
+        assert R.get_nodata_value() == -9999
+
+
+    def test_encode_dataset(self):
+        """Test that datasets held in memory are encoded with overviews
+        """
+
+        nrows, ncols = 600, 300
+        A = numpy.arange(nrows*ncols, dtype=numpy.float64).reshape((nrows, ncols))
+        A[0, 0] = -9999
+        geotransform = (96.0, 0.01, 0, 4.0, 0, -0.01)
+
+        dataset = gdal.GetDriverByName('MEM').Create('', ncols, nrows, 1, gdal.GDT_Float64)
+        dataset.SetGeoTransform(geotransform)
+        dataset.SetProjection(read_coverage('data/test_grid.asc').get_projection())
+        dataset.GetRasterBand(1).SetNoDataValue(-9999)
+        dataset.GetRasterBand(1).WriteArray(A)
+
+        R = MemoryRaster(encode_geotiff(dataset), 'encoded_dataset')
+        assert R.get_shape() == (nrows, ncols)
+        assert numpy.allclose(R.get_data(), A)
+        assert numpy.allclose(R.get_geotransform(), geotransform)
+        assert R.get_nodata_value() == -9999
+        assert R.band.GetOverviewCount() == 2
+
+        # Data type is kept unless floating point data is explicitly downcast
+        assert gdal.GetDataTypeName(R.band.DataType) == 'Float64'
+        R = MemoryRaster(encode_geotiff(dataset, 'Float32'), 'downcast_dataset')
+        assert gdal.GetDataTypeName(R.band.DataType) == 'Float32'
+        assert numpy.allclose(R.get_data(), A)
+
+
+    def test_encode_array(self):
+        """Test that arrays are encoded with NaN stored as NODATA
+        """
+
+        A = numpy.array([[1.0, 2.0, 3.0], [4.0, numpy.nan, 6.0]])
+        geotransform = (96.0, 0.5, 0, 4.0, 0, -0.5)
+
+        R = MemoryRaster(encode_array(A, geotransform, 'EPSG:4326'), 'encoded_array')
+        assert R.get_projection().startswith('GEOGCS')
+        assert numpy.allclose(R.get_geotransform(), geotransform)
+
+        B = R.get_data()
+        assert B[1, 1] == -9999
+        assert numpy.allclose(B[0], A[0])
+
+        # Arrays must be two dimensional
+        try:
+            encode_array(numpy.zeros(5), geotransform, 'EPSG:4326')
+        except AssertionError:
+            pass
+        else:
+            msg = 'One dimensional array should have raised AssertionError'
+            raise Exception(msg)
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_encoding, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
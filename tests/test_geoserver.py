@@ -0,0 +1,214 @@
+import sys, os
+import zipfile
+import StringIO
+import unittest
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+from geoserver_api.rest_client import HTTPError, get_client
+from geoserver_api.geoserver import get_geoserver
+from utilities import RestServer
+
+
+class Test_geoserver(unittest.TestCase):
+
+    def setUp(self):
+        self.server = RestServer()
+        self.url = self.server.url
+
+    def tearDown(self):
+        # Close pooled connections so the server threads serving them finish
+        for password in ['geoserver', 'wrong']:
+            get_client(self.url, 'admin', password).close()
+
+        self.server.stop()
+
+
+    def test_geoserver_registry(self):
+        """Test that verified geoserver connections are shared and verified again when stale
+        """
+
+        def count_verifications():
+            return len([r for r in self.server.requests if r[1] == '/geoserver/rest'])
+
+        gs = get_geoserver(self.url, 'admin', 'geoserver')
+        assert count_verifications() == 1
+
+        for i in range(3):
+            assert get_geoserver(self.url, 'admin', 'geoserver') is gs
+        assert count_verifications() == 1
+
+        # Expired verification
+        get_geoserver(self.url, 'admin', 'geoserver', ttl=-1)
+        assert count_verifications() == 2
+
+        # Failed request
+        gs.client.healthy = False
+        get_geoserver(self.url, 'admin', 'geoserver')
+        assert count_verifications() == 3
+        assert gs.client.healthy
+
+        # Changed password gives a new connection
+        try:
+            get_geoserver(self.url, 'admin', 'wrong')
+        except HTTPError:
+            pass
+        else:
+            msg = 'Wrong password should have raised HTTPError'
+            raise Exception(msg)
+
+
+    def test_upload_layers(self):
+        """Test that several files are uploaded concurrently with per file results
+        """
+
+        filenames = ['upload_test_%i.zip' % i for i in range(5)]
+        for filename in filenames:
+            fid = open(filename, 'wb')
+            fid.write('zipped shapefile %s' % filename)
+            fid.close()
+
+        try:
+            gs = get_geoserver(self.url, 'admin', 'geoserver')
+            results = gs.upload_layers(filenames + ['unknown.xyz'], 'exposure', max_workers=3)
+        finally:
+            for filename in filenames:
+                os.remove(filename)
+
+        assert len(results) == 6
+        for i, result in enumerate(results[:5]):
+            assert result['filename'] == filenames[i]
+            assert result['layer'] == 'exposure:upload_test_%i' % i
+            assert result['error'] is None
+            assert result['seconds'] >= 0
+
+        # Failed files are reported without stopping the others
+        assert results[-1]['layer'] is None
+        assert results[-1]['error'].find('Unknown extention') > 0
+
+        paths = [r[1] for r in self.server.requests if r[0] == 'PUT']
+        for i in range(5):
+            assert '/geoserver/rest/workspaces/exposure/datastores/upload_test_%i/file.shp' % i in paths
+
+
+    def test_upload_shapefile(self):
+        """Test that shapefiles are zipped in memory and sent without files in the working directory
+        """
+
+        files = os.listdir('.')
+
+        gs = get_geoserver(self.url, 'admin', 'geoserver')
+        layer = gs.upload_vector_layer('data/bridge_S68_WestJava.shp', 'exposure')
+        assert layer == 'exposure:bridge_S68_WestJava'
+        assert os.listdir('.') == files
+
+        method, path, body, content_type, address = self.server.requests[-1]
+        assert method == 'PUT'
+        assert path == '/geoserver/rest/workspaces/exposure/datastores/bridge_S68_WestJava/file.shp'
+        assert content_type == 'application/zip'
+
+        # The archive is described in test_utilities.py
+        archive = zipfile.ZipFile(StringIO.StringIO(body))
+        assert 'bridge_S68_WestJava.shp' in archive.namelist()
+
+
+    def test_delete_all_layers(self):
+        """Test that stores are deleted recursively with per layer results and orphaned styles removed
+        """
+
+        rest = '/geoserver/rest/'
+        self.server.listings = {
+            rest + 'workspaces/scratch/coveragestores':
+                '{"coverageStores": {"coverageStore": [{"name": "impact"}, {"name": "shakemap"}, {"name": "missing_grid"}]}}',
+            rest + 'workspaces/scratch/datastores': '{"dataStores": {"dataStore": {"name": "buildings"}}}',
+            rest + 'layers': '{"layers": {"layer": [{"name": "impact"}, {"name": "shakemap"}, {"name": "missing_grid"}, '
+                             '{"name": "buildings"}, {"name": "shakemap"}]}}',
+            rest + 'styles': '{"styles": {"style": [{"name": "impact"}, {"name": "shakemap"}, {"name": "buildings"}, '
+                             '{"name": "raster"}]}}'}
+        self.server.failures = {rest + 'styles/buildings?purge=true': (500, 'Style in use')}
+
+        gs = get_geoserver(self.url, 'admin', 'geoserver')
+        self.server.requests = []
+        results = gs.delete_all_layers(workspace='scratch', max_workers=3)
+
+        assert [result['layer'] for result in results] == ['scratch:impact', 'scratch:shakemap',
+                                                          'scratch:missing_grid', 'scratch:buildings']
+        assert results[0]['style'] == 'impact'
+        assert results[0]['error'] is None
+
+        # Styles of layers remaining in other workspaces are kept
+        assert results[1]['style'] is None
+
+        # Failed layers are reported without stopping the others
+        assert results[2]['error'].find('No such resource') > 0
+
+        # Failures to remove a style are reported apart from the deleted layer
+        assert results[3]['error'] is None
+        assert results[3]['style'] is None
+        assert results[3]['style_error'].find('Style in use') > 0
+
+        # Only the cleared workspace is listed
+        assert len([r for r in self.server.requests if r[0] == 'GET']) == 4
+
+        deletions = sorted([r[1] for r in self.server.requests if r[0] == 'DELETE'])
+        assert deletions == [rest + 'styles/buildings?purge=true',
+                             rest + 'styles/impact?purge=true',
+                             rest + 'workspaces/scratch/coveragestores/impact?recurse=true',
+                             rest + 'workspaces/scratch/coveragestores/missing_grid?recurse=true',
+                             rest + 'workspaces/scratch/coveragestores/shakemap?recurse=true',
+                             rest + 'workspaces/scratch/datastores/buildings?recurse=true']
+
+        self.server.listings[rest + 'workspaces'] = '{"workspaces": ""}'
+        assert gs.delete_all_layers() == []
+
+
+    def test_delete_layer(self):
+        """Test that vector layers are deleted with their data store
+        """
+
+        rest = '/geoserver/rest/'
+        self.server.failures = {rest + 'workspaces/exposure/coveragestores/roads?recurse=true': (404, 'No such store')}
+
+        gs = get_geoserver(self.url, 'admin', 'geoserver')
+        self.server.requests = []
+        gs.delete_layer('roads', 'exposure')
+        gs.delete_layer('shakemap', 'hazard')
+
+        assert [r[1] for r in self.server.requests] == [
+            rest + 'workspaces/exposure/coveragestores/roads?recurse=true',
+            rest + 'workspaces/exposure/datastores/roads?recurse=true',
+            rest + 'workspaces/hazard/coveragestores/shakemap?recurse=true']
+
+        # Other errors are not taken to mean a vector layer
+        self.server.failures = {rest + 'workspaces/hazard/coveragestores/shakemap?recurse=true': (500, 'Error')}
+        self.assertRaises(HTTPError, gs.delete_layer, 'shakemap', 'hazard')
+
+
+    def test_layer_exists(self):
+        """Test that layers are looked up with one request
+        """
+
+        gs = get_geoserver(self.url, 'admin', 'geoserver')
+        self.server.requests = []
+        assert gs.layer_exists('shakemap', 'hazard')
+        assert not gs.layer_exists('missing_impact', 'impact')
+
+        assert [r[:2] for r in self.server.requests] == [
+            ('GET', '/geoserver/rest/layers/hazard:shakemap'),
+            ('GET', '/geoserver/rest/layers/impact:missing_impact')]
+
+        # Other errors are raised
+        self.server.failures = {'/geoserver/rest/layers/hazard:shakemap': (500, 'Error')}
+        self.assertRaises(HTTPError, gs.layer_exists, 'shakemap', 'hazard')
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_geoserver, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
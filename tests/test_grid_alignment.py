@@ -0,0 +1,171 @@
+import sys, os
+import numpy
+import unittest
+import threading
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+import grid_alignment
+from grid_alignment import get_grid, get_alignment, align_raster, AlignedRaster
+from geoserver_api.raster import read_coverage, RasterWriter
+
+
+def make_raster(A, geotransform, filename):
+    """Write array to GeoTIFF and read it back as Raster
+    """
+
+    nrows, ncols = A.shape
+    projection = open('data/test_grid.prj').read()
+    writer = RasterWriter(filename, nrows, ncols, geotransform, projection)
+    writer.write_block(A, 0, 0)
+    writer.close()
+
+    return read_coverage(filename)
+
+
+class Test_grid_alignment(unittest.TestCase):
+
+    def setUp(self):
+        self.A = numpy.arange(40*30, dtype=numpy.float64).reshape((40, 30)) % 97
+        self.geotransform = (100.0, 0.1, 0, 2.0, 0, -0.1)
+        self.source = make_raster(self.A, self.geotransform, 'alignment_source.tif')
+
+    def tearDown(self):
+        self.source = None
+        os.remove('alignment_source.tif')
+
+
+    def test_identical_grids(self):
+        """Test that rasters already on the target grid are not resampled
+        """
+
+        grid = get_grid(self.source)
+        assert grid == (self.geotransform, (40, 30))
+        assert align_raster(self.source, grid, 'bilinear') is self.source
+
+
+    def test_nearest(self):
+        """Test that nearest neighbour refinement replicates cells
+        """
+
+        target_grid = ((100.0, 0.05, 0, 2.0, 0, -0.05), (80, 60))
+        B = align_raster(self.source, target_grid, 'nearest').get_block(0, 0, 80, 60)
+
+        assert numpy.alltrue(B == self.A.repeat(2, axis=0).repeat(2, axis=1))
+
+
+    def test_bilinear(self):
+        """Test that bilinear interpolation reproduces linear fields
+        """
+
+        rows, cols = numpy.mgrid[0:40, 0:30]
+        L = 3.0*cols + 2.0*rows + 1.0
+        source = make_raster(L, self.geotransform, 'alignment_linear.tif')
+
+        target_grid = ((100.3, 0.07, 0, 1.7, 0, -0.07), (30, 30))
+        B = align_raster(source, target_grid, 'bilinear').get_block(0, 0, 30, 30)
+
+        # Positions of target cell centres relative to source cell centres
+        j = numpy.arange(30)
+        x = (0.3 + (j + 0.5)*0.07)/0.1 - 0.5
+        y = (0.3 + (j + 0.5)*0.07)/0.1 - 0.5
+        R = 3.0*x[numpy.newaxis, :] + 2.0*y[:, numpy.newaxis] + 1.0
+
+        assert numpy.allclose(B, R, rtol=1.0e-12)
+
+        source = None
+        os.remove('alignment_linear.tif')
+
+
+    def test_sum_preserves_totals(self):
+        """Test that aggregation preserves totals for arbitrary grids covering the source
+        """
+
+        for geotransform, shape in [((100.0, 0.2, 0, 2.0, 0, -0.2), (20, 15)),
+                                    ((99.93, 0.27, 0, 2.05, 0, -0.27), (17, 13)),
+                                    ((99.99, 0.03, 0, 2.01, 0, -0.03), (140, 110))]:
+            aligned = align_raster(self.source, (geotransform, shape), 'sum')
+            B = aligned.get_block(0, 0, shape[0], shape[1])
+
+            assert numpy.allclose(numpy.nansum(B), numpy.sum(self.A), rtol=1.0e-12)
+
+            # Tiles give the same result as the whole grid
+            tiled = numpy.zeros(shape)
+            for row in range(0, shape[0], 4):
+                for col in range(0, shape[1], 5):
+                    nrows = min(4, shape[0] - row)
+                    ncols = min(5, shape[1] - col)
+                    tiled[row:row+nrows, col:col+ncols] = aligned.get_block(row, col, nrows, ncols)
+
+            assert numpy.alltrue(numpy.isnan(tiled) == numpy.isnan(B))
+            assert numpy.allclose(tiled[~numpy.isnan(B)], B[~numpy.isnan(B)], rtol=1.0e-12)
+
+
+    def test_cells_outside_source(self):
+        """Test that target cells not covered by the source have no data
+        """
+
+        target_grid = ((99.0, 0.1, 0, 2.0, 0, -0.1), (40, 40))
+        for method in ['nearest', 'bilinear', 'sum']:
+            B = align_raster(self.source, target_grid, method).get_block(0, 0, 40, 40)
+
+            assert numpy.alltrue(numpy.isnan(B[:, :10]))
+            assert not numpy.any(numpy.isnan(B[:, 10:]))
+            assert numpy.allclose(B[:, 10:], self.A[:, :30], rtol=1.0e-12)
+
+
+    def test_alignments_are_cached(self):
+        """Test that index maps are computed once per pair of grids
+        """
+
+        target_grid = ((100.0, 0.05, 0, 2.0, 0, -0.05), (80, 60))
+        a1 = get_alignment(get_grid(self.source), target_grid, 'bilinear')
+        a2 = get_alignment(get_grid(self.source), target_grid, 'bilinear')
+        a3 = get_alignment(get_grid(self.source), target_grid, 'nearest')
+
+        assert a1 is a2
+        assert a1 is not a3
+
+        aligned = align_raster(self.source, target_grid, 'bilinear')
+        assert isinstance(aligned, AlignedRaster)
+        assert aligned.alignment is a1
+
+
+    def test_concurrent_alignments(self):
+        """Test that the alignment cache can be used from several threads
+        """
+
+        source_grid = get_grid(self.source)
+        target_grids = [((100.0, 0.05, 0, 2.0, 0, -0.05), (80, 60 + i))
+                        for i in range(2*grid_alignment.MAX_CACHED_ALIGNMENTS)]
+        errors = []
+
+        def align():
+            try:
+                for target_grid in target_grids:
+                    alignment = get_alignment(source_grid, target_grid, 'nearest')
+                    assert alignment.target_grid == target_grid
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=align) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == [], errors
+        assert len(grid_alignment._alignment_keys) <= grid_alignment.MAX_CACHED_ALIGNMENTS
+        assert len(set(grid_alignment._alignment_keys)) == len(grid_alignment._alignment_keys)
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_grid_alignment, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,140 @@
+import sys, os
+import numpy
+import unittest
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+from impact_cache import ImpactCache, get_key, get_layer_id, get_file_fingerprint, get_raster_fingerprint, \
+    get_array_fingerprint
+from impact_functions import get_impact_function
+from geoserver_api.raster import read_coverage
+
+
+class Test_impact_cache(unittest.TestCase):
+
+    def setUp(self):
+        self.f = get_impact_function('earthquake_fatality')
+        self.bbox = [96.956, -5.519, 104.641, 2.289]
+        self.hazard = get_layer_id('http://localhost:8080/geoserver', 'hazard', 'shakemap_padang_20090930')
+        self.exposure = get_layer_id('http://localhost:8080/geoserver', 'exposure', 'population_padang_1')
+        self.impact = get_layer_id('http://localhost:8080/geoserver', 'impact', 'fatality_padang')
+
+    def tearDown(self):
+        pass
+
+
+    def test_keys(self):
+        """Test that cache keys change with every input of the calculation
+        """
+
+        key = get_key(['a', 'b'], self.f, self.bbox, self.impact)
+        assert key == get_key(['a', 'b'], get_impact_function('earthquake_fatality'),
+                              [str(x) for x in self.bbox], self.impact)
+
+        other_keys = [get_key(['a', 'c'], self.f, self.bbox, self.impact),
+                      get_key(['b', 'a'], self.f, self.bbox, self.impact),
+                      get_key(['a', 'b'], self.f.__class__(a=1.0), self.bbox, self.impact),
+                      get_key(['a', 'b'], self.f, self.bbox[:3] + [3.0], self.impact),
+                      get_key(['a', 'b'], self.f, None, self.impact),
+                      get_key(['a', 'b'], self.f, self.bbox, self.hazard),
+                      get_key(['a', 'b'], self.f, self.bbox, self.impact, options=('sum',))]
+
+        for other_key in other_keys:
+            assert other_key != key
+        assert len(set(other_keys)) == len(other_keys)
+
+
+    def test_fingerprints(self):
+        """Test that fingerprints reflect content of files and rasters
+        """
+
+        f1 = get_file_fingerprint('data/population_padang_1.asc')
+        f2 = get_file_fingerprint('data/population_padang_2.asc')
+        assert f1 == get_file_fingerprint('data/population_padang_1.asc')
+        assert f1 != f2
+
+        r1 = get_raster_fingerprint(read_coverage('data/population_padang_1.asc'))
+        r2 = get_raster_fingerprint(read_coverage('data/population_padang_2.asc'))
+        assert r1 == get_raster_fingerprint(read_coverage('data/population_padang_1.asc'))
+        assert r1 != r2
+
+        # Arrays published from memory agree with rasters holding the same data
+        R = read_coverage('data/population_padang_1.asc')
+        A = R.get_data().astype(numpy.float64)
+        assert get_array_fingerprint(A, R.get_geotransform()) == r1
+        assert get_array_fingerprint(A + 1, R.get_geotransform()) != r1
+
+
+    def test_lru_eviction(self):
+        """Test that least recently used entries are evicted first
+        """
+
+        cache = ImpactCache(max_entries=3)
+        for key in ['k1', 'k2', 'k3']:
+            cache.put(key, self.impact, [self.hazard, self.exposure])
+
+        # Use k1 so that k2 becomes the least recently used entry
+        assert cache.get('k1') == self.impact
+        cache.put('k4', self.impact, [self.hazard, self.exposure])
+
+        assert cache.get('k2') is None
+        for key in ['k1', 'k3', 'k4']:
+            assert cache.get(key) == self.impact
+
+        statistics = cache.get_statistics()
+        assert statistics['entries'] == 3
+        assert statistics['hits'] == 4
+        assert statistics['misses'] == 1
+
+
+    def test_invalidation(self):
+        """Test that uploading a layer invalidates results computed from or into it
+        """
+
+        cache = ImpactCache()
+        cache.set_fingerprint(self.hazard, 'h1')
+        cache.set_fingerprint(self.exposure, 'e1')
+
+        other_impact = get_layer_id('http://localhost:8080/geoserver', 'impact', 'other')
+        cache.put('k1', self.impact, [self.hazard, self.exposure])
+        cache.put('k2', other_impact, [self.exposure])
+
+        # New version of hazard invalidates k1 only
+        cache.set_fingerprint(self.hazard, 'h2')
+        assert cache.get_fingerprint(self.hazard) == 'h2'
+        assert cache.get('k1') is None
+        assert cache.get('k2') == other_impact
+
+        # Overwriting an impact layer invalidates entries that produced it
+        cache.set_fingerprint(other_impact, 'i1')
+        assert cache.get('k2') is None
+
+        # Deleted layers are forgotten
+        cache.put('k3', self.impact, [self.exposure])
+        cache.invalidate(self.exposure)
+        assert cache.get_fingerprint(self.exposure) is None
+        assert cache.get('k3') is None
+
+        # Entries whose impact layer has gone missing can be dropped one by one
+        cache.put('k4', self.impact, [self.hazard])
+        cache.put('k5', self.impact, [self.exposure])
+        cache.discard('k4')
+        cache.discard('k4')
+        assert cache.get('k4') is None
+        assert cache.get('k5') == self.impact
+
+        cache.clear()
+        assert cache.get_fingerprint(self.hazard) is None
+        assert cache.get_statistics()['entries'] == 0
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_impact_cache, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,266 @@
+import sys, os
+import numpy
+import unittest
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+from impact_engine import get_tiles, get_tile_shape, calculate_impact, calculate_scenarios, update_impact
+from impact_functions import get_impact_function
+from geoserver_api.raster import read_coverage, RasterWriter, RasterUpdater, MemoryRaster
+
+fatality_kernel = get_impact_function('earthquake_fatality')
+
+
+class Test_impact_engine(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+
+    def test_tiles_cover_grid(self):
+        """Test that tiles cover the grid exactly once
+        """
+
+        for nrows, ncols in [(1, 1), (7, 5), (254, 250)]:
+            for tile_rows, tile_cols in [(1, 1), (3, 2), (64, 64), (300, 300)]:
+                count = numpy.zeros((nrows, ncols))
+                for row, col, block_rows, block_cols in get_tiles(nrows, ncols, tile_rows, tile_cols):
+                    assert 0 < block_rows <= tile_rows
+                    assert 0 < block_cols <= tile_cols
+                    count[row:row+block_rows, col:col+block_cols] += 1
+
+                assert numpy.alltrue(count == 1)
+
+
+    def test_tile_shape_within_budget(self):
+        """Test that tile buffers stay within the memory budget
+        """
+
+        for nrows, ncols in [(10, 10), (10000, 20000), (5, 10**7)]:
+            for memory in [1024, 1024**2, 64*1024**2]:
+                tile_rows, tile_cols = get_tile_shape(nrows, ncols, nbuffers=3, memory=memory)
+
+                assert 1 <= tile_rows <= nrows
+                assert 1 <= tile_cols <= ncols
+                assert tile_rows*tile_cols*8*3 <= max(memory, 8*3)
+
+        # Small grids fit in one tile
+        assert get_tile_shape(254, 250) == (254, 250)
+
+        # unless they must be split to keep workers busy
+        tile_rows, tile_cols = get_tile_shape(254, 250, min_tiles=16)
+        assert tile_cols == 250
+        assert len(get_tiles(254, 250, tile_rows, tile_cols)) >= 16
+
+
+    def test_tiled_calculation(self):
+        """Test that tiled calculation agrees with calculation over the whole grid
+        """
+
+        a = 0.97429
+        b = 11.037
+
+        H = read_coverage('data/shakemap_padang_20090930.asc')
+        E = read_coverage('data/population_padang_1.asc')
+
+        # Engine computes in double precision irrespective of the file format
+        ref = 10**(a*H.get_data().astype(numpy.float64)-b)*E.get_data().astype(numpy.float64)
+
+        nrows, ncols = H.get_shape()
+        for tile_shape in [(1, ncols), (17, 33), (nrows, ncols)]:
+            output_file = 'tiled_fatality.tif'
+            writer = RasterWriter(output_file, nrows, ncols,
+                                  H.get_geotransform(),
+                                  H.get_projection())
+            total = calculate_impact(H, E, writer, fatality_kernel, tile_shape=tile_shape)
+            writer.close()
+
+            F = read_coverage(output_file)
+            assert F.get_geotransform() == H.get_geotransform()
+            assert numpy.alltrue(F.get_data() == ref)
+            assert numpy.allclose(total, numpy.sum(ref), rtol=1.0e-12)
+
+            os.remove(output_file)
+
+
+    def test_parallel_calculation(self):
+        """Test that parallel tile evaluation is identical to serial evaluation
+        """
+
+        H = read_coverage('data/shakemap_padang_20090930.asc')
+        E = read_coverage('data/population_padang_2.asc')
+
+        nrows, ncols = H.get_shape()
+        tile_shape = (16, 100)
+
+        results = []
+        for workers in [1, 3, 0]:
+            output_file = 'parallel_fatality_%i.tif' % workers
+            writer = RasterWriter(output_file, nrows, ncols,
+                                  H.get_geotransform(),
+                                  H.get_projection())
+            total = calculate_impact(H, E, writer, fatality_kernel,
+                                     tile_shape=tile_shape, workers=workers)
+            writer.close()
+
+            results.append((read_coverage(output_file).get_data(), total))
+            os.remove(output_file)
+
+        F_ref, total_ref = results[0]
+        for F, total in results[1:]:
+            assert numpy.alltrue(F == F_ref)
+            assert total == total_ref
+
+
+    def test_parallel_calculation_in_memory(self):
+        """Test that workers can evaluate rasters held in memory by the parent process
+        """
+
+        H = MemoryRaster(open('data/shakemap_padang_20090930.asc', 'rb').read(), 'hazard')
+        E = MemoryRaster(open('data/population_padang_2.asc', 'rb').read(), 'exposure')
+
+        nrows, ncols = H.get_shape()
+
+        results = []
+        for workers in [1, 3]:
+            output_file = 'parallel_memory_%i.tif' % workers
+            writer = RasterWriter(output_file, nrows, ncols,
+                                  H.get_geotransform(),
+                                  H.get_projection())
+            total = calculate_impact(H, E, writer, fatality_kernel,
+                                     tile_shape=(16, 100), workers=workers)
+            writer.close()
+
+            results.append((read_coverage(output_file).get_data(), total))
+            os.remove(output_file)
+
+        assert numpy.alltrue(results[0][0] == results[1][0])
+        assert results[0][1] == results[1][1]
+
+
+    def test_scenarios(self):
+        """Test that batched scenarios agree with separate calculations
+        """
+
+        hazards = [read_coverage('data/shakemap_padang_20090930.asc'),
+                   read_coverage('data/population_padang_1.asc'),   # Not a hazard but a different grid of values
+                   read_coverage('data/shakemap_padang_20090930.asc')]
+        E = read_coverage('data/population_padang_2.asc')
+
+        nrows, ncols = E.get_shape()
+        writers = []
+        for k in range(len(hazards)):
+            writers.append(RasterWriter('scenario_%i.tif' % k, nrows, ncols,
+                                        E.get_geotransform(),
+                                        E.get_projection()))
+
+        totals = calculate_scenarios(hazards, E, writers, fatality_kernel, tile_shape=(20, 50))
+        for writer in writers:
+            writer.close()
+
+        assert len(totals) == len(hazards)
+        for k, H in enumerate(hazards):
+            writer = RasterWriter('single.tif', nrows, ncols,
+                                  E.get_geotransform(),
+                                  E.get_projection())
+            total = calculate_impact(H, E, writer, fatality_kernel, tile_shape=(20, 50))
+            writer.close()
+
+            F = read_coverage('scenario_%i.tif' % k).get_data()
+            assert numpy.alltrue(F == read_coverage('single.tif').get_data())
+            assert numpy.allclose(totals[k], total, rtol=1.0e-12)
+
+            os.remove('single.tif')
+            os.remove('scenario_%i.tif' % k)
+
+        assert totals[0] == totals[2]
+
+
+    def test_nodata_propagation(self):
+        """Test that NODATA in the inputs gives NODATA in the output
+        """
+
+        H = read_coverage('data/test_grid.asc')
+        E = read_coverage('data/test_grid.asc')
+
+        nrows, ncols = H.get_shape()
+        output_file = 'tiled_nodata.tif'
+        writer = RasterWriter(output_file, nrows, ncols,
+                              H.get_geotransform(),
+                              H.get_projection())
+        calculate_impact(H, E, writer, fatality_kernel, tile_shape=(2, 3))
+        writer.close()
+
+        A = H.get_data()
+        F = read_coverage(output_file).get_data()
+        assert numpy.alltrue((F == -9999) == (A == -9999))
+
+        os.remove(output_file)
+
+
+    def test_incremental_update(self):
+        """Test that updating for a revised hazard recomputes changed tiles only
+        """
+
+        H = read_coverage('data/shakemap_padang_20090930.asc')
+        E = read_coverage('data/population_padang_1.asc')
+
+        nrows, ncols = H.get_shape()
+        geotransform = H.get_geotransform()
+        projection = H.get_projection()
+        tile_shape = (16, 50)
+
+        record = {}
+        writer = RasterWriter('incremental_fatality.tif', nrows, ncols, geotransform, projection)
+        calculate_impact(H, E, writer, fatality_kernel, tile_shape=tile_shape, record=record)
+        writer.close()
+
+        tiles = get_tiles(nrows, ncols, tile_shape[0], tile_shape[1])
+        assert record['tile_shape'] == tile_shape
+        assert len(record['digests']) == len(record['totals']) == len(tiles)
+
+        # Revise hazard in a small region
+        A = H.get_data().astype(numpy.float64)
+        A[40:50, 120:130] += 0.5
+        writer = RasterWriter('revised_shakemap.tif', nrows, ncols, geotransform, projection)
+        writer.write_block(A, 0, 0)
+        writer.close()
+        H_revised = read_coverage('revised_shakemap.tif')
+
+        writer = RasterUpdater('incremental_fatality.tif')
+        total, changed = update_impact(H_revised, E, writer, fatality_kernel, record)
+        writer.close()
+
+        assert changed == [(32, 100, 16, 50), (48, 100, 16, 50)]
+
+        # Result agrees with full recalculation
+        writer = RasterWriter('full_fatality.tif', nrows, ncols, geotransform, projection)
+        total_ref = calculate_impact(H_revised, E, writer, fatality_kernel, tile_shape=tile_shape)
+        writer.close()
+
+        F = read_coverage('incremental_fatality.tif').get_data()
+        assert numpy.alltrue(F == read_coverage('full_fatality.tif').get_data())
+        assert numpy.allclose(total, total_ref, rtol=1.0e-12)
+
+        # Nothing to do if the hazard is unchanged
+        writer = RasterUpdater('incremental_fatality.tif')
+        assert update_impact(H_revised, E, writer, fatality_kernel, record)[1] == []
+        writer.close()
+
+        for filename in ['incremental_fatality.tif', 'revised_shakemap.tif', 'full_fatality.tif']:
+            os.remove(filename)
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_impact_engine, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,152 @@
+import sys, os
+import numpy
+import unittest
+import pickle
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+from impact_functions import get_impact_function, get_all_impact_functions
+from impact_functions import suggest_impact_functions, ImpactFunction
+from impact_functions import get_lookup_table, tabulate
+
+
+class Test_impact_functions(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+
+    def test_registry(self):
+        """Test that impact functions are discovered and have the mandatory details
+        """
+
+        functions = get_all_impact_functions()
+        assert len(functions) > 0
+
+        ids = [f.id for f in functions]
+        assert 'earthquake_fatality' in ids
+
+        for f in functions:
+            assert isinstance(f, ImpactFunction)
+
+            details = f.get_details()
+            for key in ['Id', 'Name', 'Description', 'Author']:
+                assert key in details
+            assert details['Id'] == f.id
+
+            assert f.buffers > 0
+            assert f.flops > 0
+
+        # Default function
+        assert get_impact_function(0) is get_impact_function('earthquake_fatality')
+        assert get_impact_function('') is get_impact_function('earthquake_fatality')
+
+        # Unknown function
+        try:
+            get_impact_function('no_such_function')
+        except KeyError:
+            pass
+        else:
+            msg = 'Unknown impact function should have raised KeyError'
+            raise Exception(msg)
+
+
+    def test_fatality_kernel(self):
+        """Test that in place fatality kernel reproduces the fatality formula
+        """
+
+        a = 0.97429
+        b = 11.037
+
+        H = numpy.linspace(1, 10, 30).reshape((5, 6))
+        E = numpy.linspace(0, 1000, 30).reshape((5, 6))
+        out = numpy.empty(H.shape)
+
+        f = get_impact_function('earthquake_fatality')
+        F = f(H, E, out)
+        assert F is out
+        assert numpy.alltrue(F == 10**(a*H-b)*E)
+
+        # Parameters can be overridden and function survives pickling (for worker processes)
+        f = f.__class__(a=1.0, b=10.0)
+        f = pickle.loads(pickle.dumps(f))
+        F = f(H, E, out)
+        assert numpy.allclose(F, 10**(H-10.0)*E, rtol=1.0e-15)
+
+
+    def test_lookup_table(self):
+        """Test that tabulated transfer function is within its reported error bound
+        """
+
+        f = get_impact_function('earthquake_fatality')
+
+        H = numpy.linspace(1, 12, 10001)
+        E = numpy.ones(H.shape)*1000
+        ref = f(H, E, numpy.empty(H.shape))
+
+        for resolution in [10, 100, 1000]:
+            for interpolate in [True, False]:
+                table = get_lookup_table(f, resolution, interpolate)
+                bound = table.get_error_bound()
+
+                F = tabulate(f, resolution, interpolate)(H, E, numpy.empty(H.shape))
+                rel_err = numpy.max(numpy.abs(F - ref)/ref)
+                assert rel_err <= bound['max_relative_error']*(1 + 1.0e-3)
+
+                # Tables are cached
+                assert get_lookup_table(f, resolution, interpolate) is table
+
+            # Interpolation is more accurate than indexing
+            assert (get_lookup_table(f, resolution, True).max_relative_error <
+                    get_lookup_table(f, resolution, False).max_relative_error)
+
+        # Quantised hazard on the table nodes is reproduced by indexing
+        H = numpy.arange(10, 121)/10.0
+        E = numpy.ones(H.shape)
+        F = tabulate(f, 10, False)(H, E, numpy.empty(H.shape))
+        assert numpy.allclose(F, f(H, E, numpy.empty(H.shape)), rtol=1.0e-12)
+
+        # Values outside the table (e.g. NODATA) are evaluated exactly
+        H = numpy.array([-9999, 0.5, 13.0])
+        E = numpy.ones(H.shape)
+        F = tabulate(f, 10)(H, E, numpy.empty(H.shape))
+        assert numpy.alltrue(F == f(H, E, numpy.empty(H.shape)))
+
+        # NaN (e.g. cells outside an aligned hazard grid) and infinity do not break indexing
+        H = numpy.array([numpy.nan, 5.0, numpy.inf, -numpy.inf, 8.2])
+        E = numpy.ones(H.shape)
+        ref = f(H, E, numpy.empty(H.shape))
+        for interpolate in [True, False]:
+            F = tabulate(f, 10, interpolate)(H, E, numpy.empty(H.shape))
+            assert numpy.isnan(F[0])
+            assert numpy.allclose(F[[1, 4]], ref[[1, 4]], rtol=1.0e-12)
+            assert F[2] == ref[2]
+            assert F[3] == ref[3]
+
+
+    def test_suggestions(self):
+        """Test that impact functions are suggested from layer names
+        """
+
+        ids = [f.id for f in suggest_impact_functions(['shakemap_padang_20090930'],
+                                                      ['population_padang_1'])]
+        assert 'earthquake_fatality' in ids
+
+        ids = [f.id for f in suggest_impact_functions(['shakemap_padang_20090930'],
+                                                      ['bridge_S68_WestJava'])]
+        assert 'earthquake_fatality' not in ids
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_impact_functions, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,159 @@
+import sys, os
+import time
+import threading
+import unittest
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+from jobs import JobManager, report_stage, report_progress
+
+
+def wait_for(manager, job_id, timeout=10):
+    """Wait until job is finished or failed and return its status
+    """
+
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        status = manager.get_status(job_id)
+        if status['status'] in ['finished', 'failed']:
+            return status
+        time.sleep(0.01)
+
+    msg = 'Job %s did not finish within %i seconds' % (job_id, timeout)
+    raise Exception(msg)
+
+
+def staged_sum(x, y):
+    report_stage('first')
+    report_progress(0.5)
+    report_stage('second')
+    return x + y
+
+
+class Test_jobs(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+
+    def test_result_and_timings(self):
+        """Test that jobs return their result and report stages
+        """
+
+        manager = JobManager()
+        job_id = manager.submit(staged_sum, (2, 3), name='sum')
+
+        status = wait_for(manager, job_id)
+        assert status['status'] == 'finished'
+        assert status['name'] == 'sum'
+        assert manager.get_result(job_id) == 5
+
+        for stage in ['queued', 'first', 'second', 'total']:
+            assert status['timings'][stage] >= 0
+
+        # Reporting outside of jobs is harmless
+        report_stage('outside')
+        report_progress(1.0)
+
+
+    def test_failed_job(self):
+        """Test that errors of failed jobs are reported
+        """
+
+        manager = JobManager()
+        job_id = manager.submit(staged_sum, (2, 'three'))
+
+        status = wait_for(manager, job_id)
+        assert status['status'] == 'failed'
+        assert status['error'].startswith('TypeError')
+
+        try:
+            manager.get_result(job_id)
+        except Exception, e:
+            assert str(e).find('TypeError') > 0
+        else:
+            msg = 'Result of failed job should have raised an exception'
+            raise Exception(msg)
+
+        try:
+            manager.get_status('no_such_job')
+        except Exception:
+            pass
+        else:
+            msg = 'Unknown job id should have raised an exception'
+            raise Exception(msg)
+
+
+    def test_bounded_queue_and_concurrency(self):
+        """Test that at most max_running jobs run and at most max_queued jobs wait
+        """
+
+        release = threading.Event()
+        running = []
+        peak = []
+
+        def blocked():
+            running.append(1)
+            peak.append(len(running))
+            release.wait()
+            running.pop()
+            return 'done'
+
+        manager = JobManager(max_running=2, max_queued=3)
+        ids = [manager.submit(blocked) for i in range(2)]
+
+        # Wait for the first two jobs to start so that the queue is empty
+        t0 = time.time()
+        while len(running) < 2 and time.time() - t0 < 10:
+            time.sleep(0.01)
+
+        ids += [manager.submit(blocked) for i in range(3)]
+        try:
+            manager.submit(blocked)
+        except Exception:
+            pass
+        else:
+            msg = 'Submitting to a full queue should have raised an exception'
+            raise Exception(msg)
+
+        assert manager.get_status(ids[-1])['status'] == 'queued'
+
+        release.set()
+        for job_id in ids:
+            assert wait_for(manager, job_id)['status'] == 'finished'
+            assert manager.get_result(job_id) == 'done'
+
+        assert max(peak) == 2
+
+
+    def test_finished_jobs_expire(self):
+        """Test that only the most recently finished jobs are kept
+        """
+
+        manager = JobManager(max_running=1, max_finished=2)
+        ids = [manager.submit(staged_sum, (i, i)) for i in range(4)]
+        wait_for(manager, ids[-1])
+
+        assert manager.get_result(ids[-1]) == 6
+        try:
+            manager.get_result(ids[0])
+        except Exception:
+            pass
+        else:
+            msg = 'Expired job should have raised an exception'
+            raise Exception(msg)
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_jobs, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,132 @@
+import sys, os
+import numpy
+import unittest
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+from geoserver_api.mosaic import snap_bounding_box, get_uncovered_parts, split_bounding_box, mosaic_coverages
+from geoserver_api.raster import read_coverage, MemoryRaster
+
+
+class Test_mosaic(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+
+    def test_snap_bounding_box(self):
+        """Test that bounding boxes grow to cell boundaries of the layer grid
+        """
+
+        layer = [96.0, -1.0, 100.0, 4.0]
+        resolution = (0.5, 0.25)
+
+        assert snap_bounding_box([96.6, -0.9, 97.9, 3.1], layer, resolution) == [96.5, -1.0, 98.0, 3.25]
+
+        # Boundaries already on the grid are kept despite round off
+        assert snap_bounding_box([96.5 + 1.0e-12, -1.0, 98.0 - 1.0e-12, 3.25], layer, resolution) == \
+            [96.5, -1.0, 98.0, 3.25]
+
+
+    def test_uncovered_parts(self):
+        """Test that only parts outside covered bounding boxes remain
+        """
+
+        resolution = (0.5, 0.5)
+        request = [96.0, -1.0, 100.0, 4.0]
+
+        assert get_uncovered_parts(request, [], resolution) == [request]
+        assert get_uncovered_parts(request, [[95.0, -2.0, 101.0, 5.0]], resolution) == []
+
+        # Cached western half leaves the eastern half
+        assert get_uncovered_parts(request, [[90.0, -1.0, 98.0, 4.0]], resolution) == [[98.0, -1.0, 100.0, 4.0]]
+
+        # Two caches leave the south eastern corner
+        parts = get_uncovered_parts(request, [[90.0, -1.0, 98.0, 4.0], [98.0, 2.0, 100.0, 6.0]], resolution)
+        assert parts == [[98.0, -1.0, 100.0, 2.0]]
+
+        # Slivers from round off are ignored
+        assert get_uncovered_parts(request, [[96.0 + 1.0e-9, -1.0, 100.0, 4.0]], resolution) == []
+
+
+    def test_split_bounding_box(self):
+        """Test that bounding boxes are split into chunks of whole cells
+        """
+
+        resolution = (0.5, 0.5)
+        chunks = split_bounding_box([96.0, -1.0, 100.0, 4.0], resolution, 16)
+
+        assert len(chunks) == 6
+        assert chunks[0] == [96.0, 2.0, 98.0, 4.0]
+        assert chunks[-1] == [98.0, -1.0, 100.0, 0.0]
+
+        # Chunks cover the bounding box without overlap
+        cells = 0
+        for minx, miny, maxx, maxy in chunks:
+            cells += round((maxx - minx)/0.5)*round((maxy - miny)/0.5)
+        assert cells == 80
+
+        assert split_bounding_box([96.0, -1.0, 100.0, 4.0], resolution, 1000) == [[96.0, -1.0, 100.0, 4.0]]
+
+
+    def test_mosaic(self):
+        """Test that coverages are cut out of and assembled from pieces on the same grid
+        """
+
+        filename = 'data/test_grid.asc'
+        data = open(filename, 'rb').read()
+
+        R = read_coverage(filename)
+        A = R.get_data()
+        nrows, ncols = R.get_shape()
+        x0, dx, _, y0, _, dy = R.get_geotransform()
+        resolution = (dx, -dy)
+
+        def get_bounding_box(row, col, nrows, ncols):
+            return [x0 + col*dx, y0 + (row + nrows)*dy, x0 + (col + ncols)*dx, y0 + row*dy]
+
+        # Cut rows 1 to 3 and columns 2 to 4 from the whole grid
+        cut = mosaic_coverages(get_bounding_box(1, 2, 3, 2), resolution, [data])
+        C = MemoryRaster(cut, 'cut')
+        assert C.get_shape() == (3, 2)
+        assert numpy.allclose(C.get_data(), A[1:4, 2:4])
+        assert numpy.allclose(C.get_geotransform(), get_bounding_box(1, 2, 3, 2)[:1] + [dx, 0, y0 + dy, 0, dy])
+
+        # Results keep the data type of the pieces
+        assert C.get_data_type() == R.get_data_type()
+
+        # Assemble whole grid from overlapping western and eastern pieces
+        west = mosaic_coverages(get_bounding_box(0, 0, nrows, 3), resolution, [data])
+        east = mosaic_coverages(get_bounding_box(0, 2, nrows, ncols - 2), resolution, [data])
+        whole = mosaic_coverages(get_bounding_box(0, 0, nrows, ncols), resolution, [west, east])
+        assert numpy.allclose(MemoryRaster(whole, 'whole').get_data(), A)
+
+        # Assemble whole grid from chunks
+        chunks = [mosaic_coverages(bounding_box, resolution, [data])
+                  for bounding_box in split_bounding_box(get_bounding_box(0, 0, nrows, ncols), resolution, 4)]
+        assert len(chunks) == 12
+        whole = mosaic_coverages(get_bounding_box(0, 0, nrows, ncols), resolution, chunks)
+        assert numpy.allclose(MemoryRaster(whole, 'whole').get_data(), A)
+
+        # Cells not covered by any piece are NODATA
+        partial = MemoryRaster(mosaic_coverages(get_bounding_box(0, 0, nrows, ncols),
+                                                resolution, [west]), 'partial')
+        B = partial.get_data()
+        assert numpy.allclose(B[:, :3], A[:, :3])
+        assert numpy.all(B[:, 3:] == partial.get_nodata_value())
+        assert partial.get_data_type() == R.get_data_type()
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_mosaic, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -1,6 +1,7 @@
 import sys, os, string
 import numpy
 import unittest
+from osgeo import gdal
 
 
 # Add location of source code to search path so that API can be imported
@@ -9,7 +10,7 @@ source_path = os.path.join(parent_dir, 'source')
 sys.path.append(source_path)
 
 # Import everything from the API
-from geoserver_api.raster import read_coverage, write_coverage_to_ascii, read_coverage_asc, Raster
+from geoserver_api.raster import read_coverage, write_coverage_to_ascii, read_coverage_asc, Raster, MemoryRaster
 #from geoserver_api.raster import *
 
 
@@ -154,6 +155,29 @@ class Test_raster(unittest.TestCase):
         assert numpy.allclose(numpy.nanmax(A[:]), 50.9879837036)        
         
         
+    def test_memory_raster(self):
+        """Test that rasters can be read from memory without files on disk
+        """
+        
+        filename = 'data/test_grid.asc'
+        data = open(filename, 'rb').read()
+        files = os.listdir('.')
+        
+        R = MemoryRaster(data, 'test_grid')
+        assert R.name == 'test_grid'
+        assert R.filename.startswith('/vsimem/')
+        assert os.listdir('.') == files
+        
+        reference = read_coverage(filename)
+        assert numpy.allclose(R.get_data(), reference.get_data())
+        assert numpy.allclose(R.get_geotransform(), reference.get_geotransform())
+        assert R.get_nodata_value() == -9999
+        
+        # Buffer is released with the raster
+        memory_filename = R.filename
+        del R
+        assert gdal.Open(memory_filename) is None
+        
             
                         
 ################################################################################
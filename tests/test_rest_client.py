@@ -0,0 +1,185 @@
+import sys, os
+import socket
+import unittest
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+from geoserver_api.rest_client import RestClient, HTTPError, get_client, get_address, get_request_path, \
+    format_request_head, parse_status_line, parse_header, get_will_close, get_body_length
+from geoserver_api.utilities import curl
+from utilities import RestServer
+
+
+class Test_rest_client(unittest.TestCase):
+
+    def setUp(self):
+        self.server = RestServer()
+        self.url = self.server.url
+
+    def tearDown(self):
+        # Close pooled connections so the server threads serving them finish
+        for password in ['geoserver', 'wrong']:
+            get_client(self.url, 'admin', password).close()
+
+        self.server.stop()
+
+
+    def test_connections_are_reused(self):
+        """Test that consecutive requests share one keep-alive connection
+        """
+
+        client = RestClient(self.url, 'admin', 'geoserver')
+        for i in range(5):
+            status, body = client.request('GET', 'workspaces/hazard')
+            assert status == 200
+            assert body.startswith('Workspace "hazard"')
+
+        assert len(self.server.requests) == 5
+        assert self.server.requests[0][1] == '/geoserver/rest/workspaces/hazard'
+
+        # All requests came from the same client port
+        assert len(set([request[4] for request in self.server.requests])) == 1
+        client.close()
+
+
+    def test_errors(self):
+        """Test that error status codes raise HTTPError with the response body
+        """
+
+        client = RestClient(self.url, 'admin', 'geoserver')
+        try:
+            client.request('GET', 'workspaces/missing')
+        except HTTPError, e:
+            assert e.status == 404
+            assert str(e).find('No such resource') > 0
+        else:
+            msg = 'Missing resource should have raised HTTPError'
+            raise Exception(msg)
+
+        # Connection remains usable after an error
+        assert client.request('GET', 'workspaces/hazard')[0] == 200
+        client.close()
+
+        client = RestClient(self.url, 'admin', 'wrong')
+        try:
+            client.request('GET', 'workspaces/hazard')
+        except HTTPError, e:
+            assert e.status == 401
+        else:
+            msg = 'Wrong password should have raised HTTPError'
+            raise Exception(msg)
+
+
+    def test_retry(self):
+        """Test that only idempotent requests are repeated when a reused connection fails
+        """
+
+        class ClosedConnection:
+            def request(self, *args):
+                raise socket.error('Connection reset by peer')
+
+            def close(self):
+                pass
+
+        client = RestClient(self.url, 'admin', 'geoserver')
+
+        client._release_connection(ClosedConnection())
+        assert client.request('GET', 'workspaces/hazard')[0] == 200
+        assert len(self.server.requests) == 1
+
+        # Uploads are not sent twice
+        client._release_connection(ClosedConnection())
+        try:
+            client.request('PUT', 'workspaces/hazard/coveragestores/test_grid/file.geotiff', 'data')
+        except socket.error:
+            pass
+        else:
+            msg = 'Failed upload over reused connection should have raised socket.error'
+            raise Exception(msg)
+        assert len(self.server.requests) == 1
+        client.close()
+
+
+    def test_curl_compatibility(self):
+        """Test that curl sends data and reports errors as before
+        """
+
+        out = curl(self.url, 'admin', 'geoserver', 'GET', 'text/xml',
+                   'workspaces/hazard', '', '')
+        assert out == ['Workspace "hazard"\n', 'line 2\n']
+
+        # Conditions such as 'already exists' can be found in the error message
+        try:
+            curl(self.url, 'admin', 'geoserver', 'POST', 'text/xml', 'workspaces',
+                 '--data-ascii', '<workspace><name>existing</name></workspace>')
+        except Exception, e:
+            assert str(e).find('already exists') > 0
+        else:
+            msg = 'Existing workspace should have raised an exception'
+            raise Exception(msg)
+
+        # Files are uploaded with @filename
+        filename = 'data/test_grid.asc'
+        curl(self.url, 'admin', 'geoserver', 'PUT', 'image/tif',
+             'workspaces/hazard/coveragestores/test_grid/file.geotiff',
+             '--data-binary', '@%s' % filename)
+
+        method, path, body, content_type, address = self.server.requests[-1]
+        assert method == 'PUT'
+        assert content_type == 'image/tif'
+        assert body == open(filename, 'rb').read()
+
+        # Clients are shared per geoserver
+        assert get_client(self.url, 'admin', 'geoserver') is get_client(self.url + '/', 'admin', 'geoserver')
+
+
+    def test_protocol_functions(self):
+        """Test formatting of requests and interpretation of responses shared with the event loop client
+        """
+
+        address = get_address('http://localhost:8080/geoserver/wcs?request=GetCoverage')
+        assert address == ('http', 'localhost', 8080)
+        assert get_address('https://example.org/geoserver') == ('https', 'example.org', 443)
+        assert get_request_path('http://localhost:8080/geoserver/wcs?request=GetCoverage') == \
+            '/geoserver/wcs?request=GetCoverage'
+        assert get_request_path('http://localhost:8080') == '/'
+
+        head = format_request_head('PUT', '/geoserver/rest/styles/s', address, 'data',
+                                   {'Accept': '*/*'})
+        lines = head.split('\r\n')
+        assert lines[0] == 'PUT /geoserver/rest/styles/s HTTP/1.1'
+        assert sorted(lines[1:4]) == ['Accept: */*', 'Content-Length: 4', 'Host: localhost:8080']
+        assert head.endswith('\r\n\r\n')
+
+        assert parse_status_line('HTTP/1.1 404 Not Found\r\n') == ('HTTP/1.1', 404, 'Not Found')
+        assert parse_status_line('HTTP/1.0 200\r\n') == ('HTTP/1.0', 200, '')
+        self.assertRaises(EOFError, parse_status_line, '')
+
+        headers = {}
+        assert parse_header('Content-Length: 12\r\n', headers)
+        assert parse_header('Connection: Keep-Alive\r\n', headers)
+        assert not parse_header('\r\n', headers)
+        assert headers == {'content-length': '12', 'connection': 'Keep-Alive'}
+
+        assert not get_will_close('HTTP/1.1', {})
+        assert get_will_close('HTTP/1.1', {'connection': 'close'})
+        assert get_will_close('HTTP/1.0', {})
+        assert not get_will_close('HTTP/1.0', headers)
+
+        assert get_body_length('GET', 200, headers) == 12
+        assert get_body_length('HEAD', 200, headers) == 0
+        assert get_body_length('DELETE', 204, {}) == 0
+        assert get_body_length('GET', 200, {'transfer-encoding': 'chunked'}) == 'chunked'
+        assert get_body_length('GET', 200, {}) is None
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_rest_client, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
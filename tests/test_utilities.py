@@ -0,0 +1,52 @@
+import sys, os
+import zipfile
+import unittest
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+from geoserver_api.utilities import zip_shapefile
+
+
+class Test_utilities(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+
+    def test_zip_shapefile(self):
+        """Test that shapefiles are zipped with their auxiliary files into a private temporary file
+        """
+
+        files = os.listdir('.')
+
+        fid = zip_shapefile('data/bridge_S68_WestJava.shp')
+        try:
+            # Nothing is written to the working directory
+            assert os.listdir('.') == files
+
+            archive = zipfile.ZipFile(fid)
+            assert archive.namelist() == ['bridge_S68_WestJava.dbf',
+                                          'bridge_S68_WestJava.prj',
+                                          'bridge_S68_WestJava.sbn',
+                                          'bridge_S68_WestJava.sbx',
+                                          'bridge_S68_WestJava.shp',
+                                          'bridge_S68_WestJava.shp.xml',
+                                          'bridge_S68_WestJava.shx']
+            assert archive.read('bridge_S68_WestJava.shp') == open('data/bridge_S68_WestJava.shp', 'rb').read()
+        finally:
+            fid.close()
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_utilities, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
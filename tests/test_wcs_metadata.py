@@ -0,0 +1,178 @@
+import sys, os
+import shutil
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+import SocketServer
+
+
+# Add location of source code to search path so that API can be imported
+parent_dir = os.path.split(os.getcwd())[0]
+source_path = os.path.join(parent_dir, 'source')
+sys.path.append(source_path)
+
+from geoserver_api.wcs_metadata import MetadataCache
+
+
+ETAG = '"description-1"'
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve a coverage description with an ETag and honour If-None-Match
+    """
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.getheader('If-None-Match')))
+
+        if self.headers.getheader('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        data = self.server.document
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+DESCRIPTION = """<?xml version="1.0" encoding="UTF-8"?>
+<wcs:CoverageDescription version="1.0.0" xmlns:wcs="http://www.opengis.net/wcs"
+    xmlns:gml="http://www.opengis.net/gml">
+  <wcs:CoverageOffering>
+    <wcs:name>hazard:shakemap</wcs:name>
+    <wcs:lonLatEnvelope srsName="urn:ogc:def:crs:OGC:1.3:CRS84">
+      <gml:pos>%f %f</gml:pos>
+      <gml:pos>%f %f</gml:pos>
+    </wcs:lonLatEnvelope>
+    <wcs:domainSet>
+      <wcs:spatialDomain>
+        <gml:RectifiedGrid dimension="2" srsName="EPSG:4326">
+          <gml:origin><gml:pos>96.0 4.0</gml:pos></gml:origin>
+          <gml:offsetVector>%f 0.0</gml:offsetVector>
+          <gml:offsetVector>0.0 %f</gml:offsetVector>
+        </gml:RectifiedGrid>
+      </wcs:spatialDomain>
+    </wcs:domainSet>
+    <wcs:supportedCRSs>
+      <wcs:requestResponseCRSs>EPSG:4326</wcs:requestResponseCRSs>
+    </wcs:supportedCRSs>
+    <wcs:supportedFormats nativeFormat="GeoTIFF">
+      <wcs:formats>GeoTIFF</wcs:formats>
+      <wcs:formats>ArcGrid</wcs:formats>
+    </wcs:supportedFormats>
+  </wcs:CoverageOffering>
+</wcs:CoverageDescription>
+"""
+
+EXCEPTION = """<?xml version="1.0" encoding="UTF-8"?>
+<ServiceExceptionReport version="1.2.0">
+  <ServiceException code="CoverageNotDefined">Could not find coverage</ServiceException>
+</ServiceExceptionReport>
+"""
+
+
+def describe(bbox, resolution):
+    return DESCRIPTION % (tuple(bbox) + (resolution, -resolution))
+
+
+class Test_wcs_metadata(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('localhost', 0), Handler)
+        self.server.requests = []
+        self.server.document = describe([96.0, -1.0, 100.0, 4.0], 0.5)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+        self.url = 'http://localhost:%i/geoserver/wcs' % self.server.server_address[1]
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def test_metadata_is_cached(self):
+        """Test that metadata is cached in memory and on disk and revalidated when stale
+        """
+
+        cache = MetadataCache(ttl=600, directory=self.directory)
+        metadata = cache.get(self.url, 'hazard:shakemap')
+        assert metadata['bbox'] == [96.0, -1.0, 100.0, 4.0]
+        assert metadata['resx'] == metadata['resy'] == 0.5
+        assert metadata['crs'] == 'EPSG:4326'
+        assert metadata['formats'] == ['GeoTIFF', 'ArcGrid']
+
+        # Only the requested layer is described
+        assert len(self.server.requests) == 1
+        assert self.server.requests[0][0].find('request=DescribeCoverage') > 0
+        assert self.server.requests[0][0].find('coverage=hazard%3Ashakemap') > 0
+
+        # Fresh entries are used without contacting the server
+        for i in range(3):
+            assert cache.get(self.url + '/', 'hazard:shakemap') == metadata
+        assert len(self.server.requests) == 1
+
+        # Entries survive restarts through the on-disk store
+        cache = MetadataCache(ttl=600, directory=self.directory)
+        assert cache.get(self.url, 'hazard:shakemap') == metadata
+        assert len(self.server.requests) == 1
+
+        # Stale entries are revalidated with a conditional request
+        cache = MetadataCache(ttl=-1, directory=self.directory)
+        assert cache.get(self.url, 'hazard:shakemap') == metadata
+        assert len(self.server.requests) == 2
+        assert self.server.requests[-1][1] == ETAG
+
+
+    def test_invalidation(self):
+        """Test that invalidated entries are fetched again
+        """
+
+        cache = MetadataCache(ttl=600, directory=self.directory)
+        cache.get(self.url, 'hazard:shakemap')
+
+        self.server.document = describe([96.0, -2.0, 101.0, 4.0], 0.25)
+        cache.invalidate(self.url, 'hazard:shakemap')
+        assert os.listdir(self.directory) == []
+
+        metadata = cache.get(self.url, 'hazard:shakemap')
+        assert metadata['bbox'] == [96.0, -2.0, 101.0, 4.0]
+        assert metadata['resy'] == 0.25
+        assert len(self.server.requests) == 2
+        assert self.server.requests[-1][1] is None
+
+        # Other layers are unaffected
+        cache.get(self.url, 'exposure:population')
+        cache.invalidate(self.url, 'hazard:shakemap')
+        assert len(os.listdir(self.directory)) == 1
+
+        # Unknown layers raise KeyError
+        self.server.document = EXCEPTION
+        try:
+            cache.get(self.url, 'hazard:missing')
+        except KeyError:
+            pass
+        else:
+            msg = 'Unknown layer should have raised KeyError'
+            raise Exception(msg)
+
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_wcs_metadata, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
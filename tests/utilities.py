@@ -2,6 +2,10 @@
 """
 
 import os
+import base64
+import threading
+import BaseHTTPServer
+import SocketServer
 import urllib, urllib2, osgeo
 from subprocess import Popen, PIPE	
 
@@ -284,3 +288,74 @@ def get_pathname_from_package(package):
     path = x.__path__[0]
 
     return path
+
+
+class RestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Minimal imitation of the Geoserver REST API recording requests
+
+    GET requests for paths in server.listings are answered with the listing and
+    requests for paths in server.failures with the given status and body.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_request(self):
+        server = self.server
+
+        length = int(self.headers.getheader('Content-Length', 0))
+        body = self.rfile.read(length)
+        server.requests.append((self.command, self.path, body,
+                                self.headers.getheader('Content-type'),
+                                self.client_address))
+
+        expected = 'Basic ' + base64.b64encode('admin:geoserver')
+        if self.headers.getheader('Authorization') != expected:
+            status, data = 401, 'Unauthorized'
+        elif self.path in server.failures:
+            status, data = server.failures[self.path]
+        elif self.command == 'GET' and self.path in server.listings:
+            status, data = 200, server.listings[self.path]
+        elif self.path.endswith('/workspaces') and body.find('existing') > 0:
+            status, data = 500, 'Workspace named existing already exists'
+        elif self.path.find('missing') > 0:
+            status, data = 404, 'No such resource'
+        elif self.path.endswith('/rest'):
+            status, data = 200, 'Catalog: workspaces, layers, styles\n'
+        else:
+            status, data = 200, 'Workspace "hazard"\nline 2\n'
+
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_request
+
+    def log_message(self, *args):
+        pass
+
+
+class RestServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Server for RestHandler on a free local port, serving from a thread of its own
+
+    The URL of the imitated geoserver is given by attribute url.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, handler=RestHandler):
+
+        BaseHTTPServer.HTTPServer.__init__(self, ('localhost', 0), handler)
+
+        self.requests = []    # (method, path, body, content type, client address)
+        self.listings = {}    # path -> JSON listing
+        self.failures = {}    # path -> status, body
+        self.url = 'http://localhost:%i/geoserver' % self.server_address[1]
+
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()